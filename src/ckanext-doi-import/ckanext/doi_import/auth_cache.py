@@ -0,0 +1,138 @@
+"""
+Per-worker cache of validated API tokens for the harvest-doi endpoints
+
+Resolving a token costs three database round-trips (ApiToken, User and the
+package_create auth check). Validated results are kept in memory for a short
+TTL. Revoking a token, changing or deleting a user, or changing memberships
+through the action API bumps a generation counter in Redis, which drops the
+cached entries in every worker. Changes made outside the action API (e.g.
+`ckan sysadmin remove`) are picked up when the TTL expires.
+"""
+
+import threading
+import time
+
+import ckan.plugins.toolkit as toolkit
+
+from ckanext.doi_import import upstream
+
+GENERATION_KEY = 'ckanext-doi_import:auth_cache_generation'
+
+_entries = {}
+_lock = threading.Lock()
+
+
+class AuthEntry(object):
+    """Outcome of validating one API token"""
+
+    def __init__(self, user_id, user_name, authorized, generation):
+        self.user_id = user_id
+        self.user_name = user_name
+        self.authorized = authorized
+        self.generation = generation
+        self.expires_at = time.time() + get_ttl()
+
+
+def get_ttl():
+    return float(upstream.get_setting('auth_cache.ttl', 300))
+
+
+def _redis():
+    try:
+        from ckan.lib.redis import connect_to_redis
+        return connect_to_redis()
+    except Exception:
+        return None
+
+
+def current_generation():
+    """Shared invalidation counter, or None when Redis is unavailable"""
+    conn = _redis()
+    if conn is None:
+        return None
+    try:
+        value = conn.get(GENERATION_KEY)
+    except Exception:
+        return None
+    return int(value) if value else 0
+
+
+def get(token):
+    """Return the cached AuthEntry for token, or None if missing or stale"""
+    if get_ttl() <= 0:
+        return None
+
+    with _lock:
+        entry = _entries.get(token)
+    if entry is None:
+        return None
+
+    if entry.expires_at < time.time() or entry.generation != current_generation():
+        with _lock:
+            _entries.pop(token, None)
+        return None
+    return entry
+
+
+def store(token, user_id, user_name, authorized):
+    """Record a validated token and return its AuthEntry"""
+    entry = AuthEntry(user_id, user_name, authorized, current_generation())
+    if get_ttl() > 0:
+        with _lock:
+            _entries[token] = entry
+    return entry
+
+
+def invalidate():
+    """Drop cached tokens in this worker and, through Redis, in all others"""
+    with _lock:
+        _entries.clear()
+
+    conn = _redis()
+    if conn is not None:
+        try:
+            conn.incr(GENERATION_KEY)
+        except Exception:
+            pass
+
+
+def _invalidating(original_action, context, data_dict):
+    result = original_action(context, data_dict)
+    invalidate()
+    return result
+
+
+# Chained core actions that can change what a cached token is allowed to do
+
+@toolkit.chained_action
+def api_token_revoke(original_action, context, data_dict):
+    return _invalidating(original_action, context, data_dict)
+
+
+@toolkit.chained_action
+def user_update(original_action, context, data_dict):
+    return _invalidating(original_action, context, data_dict)
+
+
+@toolkit.chained_action
+def user_delete(original_action, context, data_dict):
+    return _invalidating(original_action, context, data_dict)
+
+
+@toolkit.chained_action
+def member_create(original_action, context, data_dict):
+    return _invalidating(original_action, context, data_dict)
+
+
+@toolkit.chained_action
+def member_delete(original_action, context, data_dict):
+    return _invalidating(original_action, context, data_dict)
+
+
+chained_actions = {
+    'api_token_revoke': api_token_revoke,
+    'user_update': user_update,
+    'user_delete': user_delete,
+    'member_create': member_create,
+    'member_delete': member_delete,
+}
@@ -0,0 +1,148 @@
+"""
+On-disk response cache for upstream API calls
+
+Responses are stored in a small SQLite database together with their ETag and
+Last-Modified validators. Entries younger than the TTL are served without any
+network traffic; older entries are revalidated with a conditional GET, so an
+unchanged record costs a 304 instead of a full JSON download. When the cache
+grows past its size limit the least recently used entries are evicted.
+
+SQLite is used so that every uwsgi worker and CLI process on the host shares
+the same cache file safely.
+"""
+
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    body TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    fetched_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at);
+"""
+
+DEFAULT_PATH = os.path.join(tempfile.gettempdir(), 'ckanext-doi-import', 'http_cache.sqlite')
+
+
+class CacheEntry(object):
+    """A cached upstream response"""
+
+    def __init__(self, body, etag, last_modified, fetched_at):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = fetched_at
+
+    def is_fresh(self, ttl):
+        return (time.time() - self.fetched_at) < ttl
+
+    def conditional_headers(self):
+        """Request headers to revalidate this entry upstream"""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class ResponseCache(object):
+    """TTL + LRU cache of upstream response bodies backed by SQLite"""
+
+    def __init__(self, path=DEFAULT_PATH, max_entries=10000):
+        self.path = path
+        self.max_entries = max_entries
+        self._initialized = False
+        self._init_lock = threading.Lock()
+
+    def _connect(self):
+        # One short-lived connection per operation keeps this safe across
+        # threads and forked workers
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10)
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    conn.execute('PRAGMA journal_mode=WAL')
+                    conn.executescript(SCHEMA)
+                    self._initialized = True
+        return conn
+
+    def get(self, key):
+        """Return the CacheEntry for key, or None, and mark it as recently used"""
+        conn = self._connect()
+        try:
+            with conn:
+                row = conn.execute(
+                    'SELECT body, etag, last_modified, fetched_at FROM responses WHERE key = ?',
+                    (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                conn.execute(
+                    'UPDATE responses SET accessed_at = ? WHERE key = ?',
+                    (time.time(), key)
+                )
+            return CacheEntry(*row)
+        finally:
+            conn.close()
+
+    def set(self, key, body, etag=None, last_modified=None):
+        """Store a fresh response body and evict the least recently used overflow"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO responses '
+                    '(key, body, etag, last_modified, fetched_at, accessed_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (key, body, etag, last_modified, now, now)
+                )
+                count = conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+                if count > self.max_entries:
+                    conn.execute(
+                        'DELETE FROM responses WHERE key IN ('
+                        'SELECT key FROM responses ORDER BY accessed_at ASC LIMIT ?)',
+                        (count - self.max_entries,)
+                    )
+        finally:
+            conn.close()
+
+    def touch(self, key):
+        """Mark an entry as revalidated upstream (after a 304 response)"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    'UPDATE responses SET fetched_at = ?, accessed_at = ? WHERE key = ?',
+                    (now, now, key)
+                )
+        finally:
+            conn.close()
+
+    def delete(self, key):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+        finally:
+            conn.close()
+
+    def clear(self):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('DELETE FROM responses')
+        finally:
+            conn.close()
@@ -0,0 +1,111 @@
+"""
+Canonical DOI handling shared by every import and harvest path
+
+Registry entries, form input and dataset fields spell the same record in many
+ways (https://doi.org/..., doi:..., zenodo.org/record/..., zenodo.org/records/...,
+zenodo.org/api/records/..., URL-encoded, with query strings, mixed case).
+Everything is reduced to one canonical form here so a record is fetched,
+matched and indexed exactly once:
+
+    doi          lowercase bare DOI, e.g. 10.5281/zenodo.12345
+    record_id    Zenodo record id for Zenodo DOIs, e.g. 12345
+    concept_doi  Zenodo concept (all versions) DOI, when known
+
+This module has no CKAN dependency so standalone scripts can use it.
+"""
+
+import re
+from collections import namedtuple
+from urllib.parse import unquote
+
+ZENODO_DOI_PREFIX = '10.5281/zenodo.'
+
+DOI_PREFIX_RE = re.compile(
+    r'^(?:https?://(?:dx\.)?doi\.org/|doi:\s*|(?:https?://)?zenodo\.org/doi/)',
+    re.IGNORECASE
+)
+DOI_RE = re.compile(r'^10\.\d{4,9}/\S+$')
+ZENODO_RECORD_URL_RE = re.compile(
+    r'zenodo\.org/(?:api/)?(?:records?|uploads|deposit)/(\d+)', re.IGNORECASE
+)
+ZENODO_DOI_RE = re.compile(r'^10\.5281/zenodo\.(\d+)$')
+
+
+class CanonicalDOI(namedtuple('CanonicalDOI', ['doi', 'record_id', 'concept_doi'])):
+    """Canonical identifiers of one record"""
+
+    @property
+    def url(self):
+        return f'https://doi.org/{self.doi}'
+
+    @property
+    def is_zenodo(self):
+        return self.record_id is not None
+
+
+def normalize_doi(value):
+    """Return the lowercase bare DOI for a DOI, DOI URL or Zenodo record URL"""
+    if not value or not isinstance(value, str):
+        return None
+
+    # Query strings and fragments (?download=1, #files) are not part of a DOI
+    value = re.split(r'[?#]', unquote(value.strip()), maxsplit=1)[0].strip()
+    match = ZENODO_RECORD_URL_RE.search(value)
+    if match:
+        return ZENODO_DOI_PREFIX + match.group(1)
+
+    value = DOI_PREFIX_RE.sub('', value).strip().rstrip('/').lower()
+    return value if DOI_RE.match(value) else None
+
+
+def zenodo_record_id(value):
+    """Return the Zenodo record id for a Zenodo DOI or record URL"""
+    doi = normalize_doi(value)
+    match = ZENODO_DOI_RE.match(doi or '')
+    return match.group(1) if match else None
+
+
+def canonicalize(value, concept_doi=None):
+    """Return the CanonicalDOI for any DOI spelling, or None if it is not a DOI"""
+    doi = normalize_doi(value)
+    if not doi:
+        return None
+    return CanonicalDOI(doi, zenodo_record_id(doi), normalize_doi(concept_doi))
+
+
+def from_zenodo_record(record):
+    """Canonical identifiers of a Zenodo API record payload"""
+    record_id = str(record.get('id') or record.get('record_id') or '')
+    doi = record.get('doi') or (ZENODO_DOI_PREFIX + record_id if record_id else None)
+    concept_doi = record.get('conceptdoi')
+    if not concept_doi and record.get('conceptrecid'):
+        concept_doi = ZENODO_DOI_PREFIX + str(record['conceptrecid'])
+
+    canonical = canonicalize(doi, concept_doi)
+    if canonical and record_id and canonical.record_id != record_id:
+        # DOIs minted elsewhere but deposited on Zenodo keep their own DOI
+        canonical = canonical._replace(record_id=record_id)
+    return canonical
+
+
+def normalize_many(values, invalid=None):
+    """Canonicalize a list of identifiers in one pass, dropping duplicates
+
+    Order of first appearance is preserved. Values that are not DOIs are
+    skipped and, when ``invalid`` is a list, appended to it.
+    """
+    seen = set()
+    canonical_dois = []
+
+    for value in values:
+        canonical = canonicalize(value)
+        if canonical is None:
+            if invalid is not None:
+                invalid.append(value)
+            continue
+        if canonical.doi in seen:
+            continue
+        seen.add(canonical.doi)
+        canonical_dois.append(canonical)
+
+    return canonical_dois
@@ -0,0 +1,133 @@
+"""
+Deferred Solr indexing for bulk imports
+
+Normally every package_create/package_update reindexes that one dataset and
+commits Solr, from CKAN's synchronous_search plugin. Inside
+deferred_indexing() that plugin skips the packages written by the current
+thread and their ids are collected instead. They are reindexed in chunks of
+ckanext.doi_import.index_chunk_size (default 200) with a single Solr commit
+per chunk, and once more when the block ends.
+
+Only the thread that opened the block is affected: packages written by other
+threads (web requests, other jobs) are indexed as usual. Deleted packages are
+always removed from the index right away.
+"""
+
+import threading
+from contextlib import contextmanager
+
+import ckan.plugins.toolkit as toolkit
+
+DEFAULT_CHUNK_SIZE = 200
+
+_lock = threading.Lock()
+_local = threading.local()
+_guard_installed = False
+
+
+class DeferredIndex(object):
+    """Package ids written during a bulk run and not reindexed yet"""
+
+    def __init__(self, chunk_size=None):
+        self.chunk_size = chunk_size or get_chunk_size()
+        self.pending = set()
+        self.indexed = 0
+        self._lock = threading.Lock()
+
+    def add(self, package_id):
+        with self._lock:
+            self.pending.add(package_id)
+
+    def is_due(self):
+        return len(self.pending) >= self.chunk_size
+
+    def checkpoint(self):
+        """Reindex the collected packages once a full chunk is pending
+
+        Called by the writer between two datasets, never from inside a
+        database commit.
+        """
+        if self.is_due():
+            self.flush()
+
+    def flush(self):
+        """Reindex all collected packages with one Solr commit"""
+        from ckan.lib import search
+
+        with self._lock:
+            package_ids = sorted(self.pending)
+            self.pending = set()
+        if not package_ids:
+            return
+
+        search.rebuild(package_ids=package_ids, defer_commit=True, quiet=True)
+        search.commit()
+        self.indexed += len(package_ids)
+
+
+def get_chunk_size():
+    return toolkit.asint(
+        toolkit.config.get('ckanext.doi_import.index_chunk_size', DEFAULT_CHUNK_SIZE)
+    )
+
+
+def _active_runs():
+    """Bulk runs opened by the current thread, outermost first"""
+    if not hasattr(_local, 'runs'):
+        _local.runs = []
+    return _local.runs
+
+
+def package_written(package_id):
+    """Collect a written package in the bulk runs of the current thread
+
+    Returns False when the thread has no bulk run, so the package has to be
+    indexed as usual.
+    """
+    runs = _active_runs()
+    for run in runs:
+        run.add(package_id)
+    return bool(runs)
+
+
+def _install_guard():
+    """Route synchronous_search notifications through package_written
+
+    SynchronousSearchPlugin is a singleton, so replacing notify on the class
+    covers the instance CKAN dispatches to. Outside bulk runs the original
+    notify is called unchanged.
+    """
+    global _guard_installed
+
+    from ckan import model
+    from ckan.lib import search
+
+    with _lock:
+        if _guard_installed:
+            return
+        original_notify = search.SynchronousSearchPlugin.notify
+
+        def notify(self, entity, operation):
+            if (isinstance(entity, model.Package)
+                    and operation != model.DomainObjectOperation.deleted
+                    and package_written(entity.id)):
+                return
+            return original_notify(self, entity, operation)
+
+        search.SynchronousSearchPlugin.notify = notify
+        _guard_installed = True
+
+
+@contextmanager
+def deferred_indexing(chunk_size=None):
+    """Suspend per-package indexing in this thread and reindex the written packages in bulk"""
+    _install_guard()
+
+    batch = DeferredIndex(chunk_size)
+    runs = _active_runs()
+    runs.append(batch)
+    try:
+        yield batch
+    finally:
+        runs.remove(batch)
+        batch.flush()
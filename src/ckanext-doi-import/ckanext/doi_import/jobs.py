@@ -0,0 +1,141 @@
+"""
+Background jobs for DOI imports
+
+Imports run on the CKAN job queue (RQ on the compose Redis service) so a slow
+Zenodo response never ties up a web worker. A worker must be running:
+
+    ckan -c /srv/app/ckan.ini jobs worker
+
+Progress and per-DOI outcomes are kept in the RQ job's meta so the status
+endpoint can report them while the job runs.
+"""
+
+from contextlib import nullcontext
+from datetime import datetime, timezone
+
+import ckan.plugins.toolkit as toolkit
+
+from ckanext.doi_import import indexing
+
+# DOIs imported between two progress updates
+PROGRESS_CHUNK_SIZE = 10
+
+# Seconds before RQ kills a running import job
+DEFAULT_JOB_TIMEOUT = 3600
+
+# Seconds a job may stay queued before the status reports a missing worker
+DEFAULT_WORKER_WAIT = 60
+
+NO_WORKER_WARNING = (
+    'The import has not started yet. Is a background worker running '
+    '(ckan jobs worker)?'
+)
+
+
+def enqueue_import(user_name, dois, owner_org, contributing_organizations=None, force=False,
+                   bulk=False):
+    """Queue an import of one or more DOIs and return the RQ job"""
+    timeout = toolkit.asint(
+        toolkit.config.get('ckanext.doi_import.job_timeout', DEFAULT_JOB_TIMEOUT)
+    )
+    title = f'DOI import ({len(dois)} DOI{"s" if len(dois) != 1 else ""}) by {user_name}'
+
+    job = toolkit.enqueue_job(
+        import_dois,
+        [user_name, list(dois), owner_org, contributing_organizations or [], force, bulk],
+        title=title,
+        rq_kwargs={'timeout': timeout}
+    )
+    job.meta.update({
+        'user': user_name,
+        'progress': {'done': 0, 'total': len(dois)},
+        'results': [],
+    })
+    job.save_meta()
+    return job
+
+
+def import_dois(user_name, dois, owner_org, contributing_organizations, force, bulk=False):
+    """Job function: import DOIs in chunks and record progress on the job
+
+    With bulk, Solr indexing is deferred for the whole job (see indexing.py).
+    """
+    import rq
+
+    job = rq.get_current_job()
+    context = {'user': user_name, 'ignore_auth': False}
+
+    results = []
+    summary = {'created': 0, 'updated': 0, 'unchanged': 0, 'failed': 0}
+
+    with (indexing.deferred_indexing() if bulk else nullcontext()) as deferred:
+        for i in range(0, len(dois), PROGRESS_CHUNK_SIZE):
+            chunk = dois[i:i + PROGRESS_CHUNK_SIZE]
+            try:
+                batch = toolkit.get_action('doi_import_batch')(context, {
+                    'dois': chunk,
+                    'owner_org': owner_org,
+                    'contributing_organizations': contributing_organizations,
+                    'force': force
+                })
+                chunk_results = batch['results']
+            except Exception as e:
+                chunk_results = [{'doi': doi, 'status': 'failed', 'error': str(e)} for doi in chunk]
+
+            for result in chunk_results:
+                summary[result['status']] += 1
+            results.extend(chunk_results)
+
+            if job is not None:
+                job.meta['progress'] = {'done': len(results), 'total': len(dois)}
+                job.meta['results'] = results
+                job.save_meta()
+
+            if deferred is not None:
+                deferred.checkpoint()
+
+    return {'results': results, 'summary': summary}
+
+
+def get_import_status(job_id):
+    """Status of an import job, or None if the job is unknown or expired"""
+    from ckan.lib.jobs import job_from_id
+
+    try:
+        job = job_from_id(job_id)
+    except KeyError:
+        return None
+
+    job_status = job.get_status()
+    status = {
+        'id': job.id,
+        'status': getattr(job_status, 'value', job_status),
+        'user': job.meta.get('user'),
+        'progress': job.meta.get('progress', {}),
+        'results': job.meta.get('results', []),
+    }
+
+    if status['status'] == 'queued' and waiting_for_worker(job.enqueued_at):
+        status['warning'] = NO_WORKER_WARNING
+
+    if job.is_finished and job.result:
+        status['results'] = job.result['results']
+        status['summary'] = job.result['summary']
+    elif job.is_failed:
+        status['error'] = (job.exc_info or 'Import job failed').strip().splitlines()[-1]
+
+    return status
+
+
+def waiting_for_worker(enqueued_at, now=None):
+    """Whether a job queued at enqueued_at has waited longer than a worker would take"""
+    if enqueued_at is None:
+        return False
+    wait = toolkit.asint(
+        toolkit.config.get('ckanext.doi_import.worker_wait', DEFAULT_WORKER_WAIT)
+    )
+    if enqueued_at.tzinfo is None:
+        # RQ stores naive UTC timestamps
+        enqueued_at = enqueued_at.replace(tzinfo=timezone.utc)
+    now = now or datetime.now(timezone.utc)
+    return (now - enqueued_at).total_seconds() > wait
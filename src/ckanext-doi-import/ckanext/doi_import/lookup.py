@@ -0,0 +1,162 @@
+"""
+Exact-match lookup of existing datasets by DOI or Zenodo record id
+
+DoiImportPlugin.before_dataset_index stores the normalized DOIs and Zenodo
+record ids of every dataset in vocab_* fields, so a dataset can be found with
+a single term query. Datasets indexed before those fields existed only have
+them after ``ckan search-index rebuild``; until then values without a hit are
+looked up once more by dataset URL and DOI extra (the match used before),
+unless ckanext.doi_import.lookup_fallback is false.
+"""
+
+import json
+
+import ckan.plugins.toolkit as toolkit
+
+from ckanext.doi_import.identifiers import normalize_doi, zenodo_record_id
+
+# Solr fields holding exact-match lookup keys.
+# vocab_* is a stored, multi-valued string field in the CKAN Solr schema.
+DOI_FIELD = 'vocab_doi'
+RECORD_ID_FIELD = 'vocab_zenodo_record_id'
+
+# Stored copy of the dataset's metadata_hash, so harvests can tell unchanged
+# records apart from a narrow search without loading each dataset
+HASH_FIELD = 'vocab_metadata_hash'
+
+# Dataset fields that may carry a DOI or a Zenodo URL
+DOI_SOURCE_FIELDS = ['doi', 'concept_doi', 'canonical_id', 'url', 'zenodo_url', 'identifier']
+
+CHUNK_SIZE = 50
+
+
+def dataset_lookup_keys(pkg_dict):
+    """Collect the normalized DOIs and Zenodo record ids a dataset is known by"""
+    dois = set()
+    record_ids = set()
+
+    def _value(key):
+        # Scheming fields are top-level; plain extras are flattened to extras_*
+        return pkg_dict.get(key) or pkg_dict.get('extras_' + key)
+
+    for key in DOI_SOURCE_FIELDS:
+        value = _value(key)
+        if key == 'identifier' and isinstance(value, str) and value.startswith('{'):
+            try:
+                value = json.loads(value)
+            except ValueError:
+                pass
+        if isinstance(value, dict):
+            value = value.get('value') or value.get('url')
+
+        doi = normalize_doi(value)
+        if doi:
+            dois.add(doi)
+        record_id = zenodo_record_id(value)
+        if record_id:
+            record_ids.add(record_id)
+
+    record_id = _value('zenodo_record_id')
+    if record_id and str(record_id).isdigit():
+        record_ids.add(str(record_id))
+
+    return dois, record_ids
+
+
+def index_lookup_keys(pkg_dict):
+    """Add the lookup fields to a dataset dict about to be indexed"""
+    dois, record_ids = dataset_lookup_keys(pkg_dict)
+    if dois:
+        pkg_dict[DOI_FIELD] = sorted(dois)
+    if record_ids:
+        pkg_dict[RECORD_ID_FIELD] = sorted(record_ids)
+    if pkg_dict.get('metadata_hash'):
+        pkg_dict[HASH_FIELD] = [pkg_dict['metadata_hash']]
+    return pkg_dict
+
+
+def fallback_enabled():
+    return toolkit.asbool(toolkit.config.get('ckanext.doi_import.lookup_fallback', True))
+
+
+def find_datasets(context, values):
+    """Map each DOI, DOI URL or Zenodo record URL, as given, to its dataset or None"""
+    keys = {}
+    for value in values:
+        keys[value] = (normalize_doi(value), zenodo_record_id(value))
+
+    dois = sorted(set(doi for doi, record_id in keys.values() if doi))
+    record_ids = sorted(set(record_id for doi, record_id in keys.values() if record_id))
+
+    by_doi = {}
+    by_record_id = {}
+
+    def _collect(datasets):
+        for dataset in datasets:
+            dataset_dois, dataset_record_ids = dataset_lookup_keys(dataset)
+            for doi in dataset_dois:
+                by_doi.setdefault(doi, dataset)
+            for record_id in dataset_record_ids:
+                by_record_id.setdefault(record_id, dataset)
+
+    _collect(_search(context, dois, record_ids, _lookup_clauses))
+
+    if fallback_enabled():
+        missing_dois = [doi for doi in dois if doi not in by_doi]
+        missing_record_ids = [rid for rid in record_ids if rid not in by_record_id]
+        _collect(_search(context, missing_dois, missing_record_ids, _fallback_clauses))
+
+    return {
+        value: by_doi.get(doi) or by_record_id.get(record_id)
+        for value, (doi, record_id) in keys.items()
+    }
+
+
+def _search(context, dois, record_ids, clauses_for):
+    """Run chunked package_search queries, returning every dataset found"""
+    datasets = []
+    for i in range(0, max(len(dois), len(record_ids)), CHUNK_SIZE):
+        doi_chunk = dois[i:i + CHUNK_SIZE]
+        record_id_chunk = record_ids[i:i + CHUNK_SIZE]
+
+        result = toolkit.get_action('package_search')(context, {
+            'fq': ' OR '.join(clauses_for(doi_chunk, record_id_chunk)),
+            'rows': 2 * (len(doi_chunk) + len(record_id_chunk)),
+            'include_private': True,
+        })
+        datasets.extend(result.get('results', []))
+    return datasets
+
+
+def _quoted(values):
+    return '({})'.format(' OR '.join(f'"{value}"' for value in values))
+
+
+def _lookup_clauses(dois, record_ids):
+    """Term queries on the lookup fields"""
+    clauses = []
+    if dois:
+        clauses.append(f'{DOI_FIELD}:{_quoted(dois)}')
+    if record_ids:
+        clauses.append(f'{RECORD_ID_FIELD}:{_quoted(record_ids)}')
+    return clauses
+
+
+def _fallback_clauses(dois, record_ids):
+    """Queries on the dataset URL and DOI extra, for datasets indexed without lookup fields
+
+    Hits are checked against dataset_lookup_keys, so a loose match here
+    never maps a value to the wrong dataset.
+    """
+    urls = []
+    for doi in dois:
+        urls.append(f'https://doi.org/{doi}')
+    for record_id in record_ids:
+        urls.append(f'https://zenodo.org/record/{record_id}')
+        urls.append(f'https://zenodo.org/records/{record_id}')
+
+    clauses = [f'url:{_quoted(urls)}']
+    if dois:
+        doi_values = dois + [f'https://doi.org/{doi}' for doi in dois]
+        clauses.append(f'extras_doi:{_quoted(doi_values)}')
+    return clauses
@@ -0,0 +1,260 @@
+"""
+Database tables owned by the DOI import extension
+
+Tables are created on startup (DoiImportPlugin.configure) if they do not exist.
+"""
+
+import datetime
+
+from sqlalchemy import (
+    BigInteger, Column, DateTime, Integer, MetaData, Table, UnicodeText, func, select
+)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+import ckan.model as model
+
+from ckanext.doi_import import identifiers
+
+metadata = MetaData()
+
+# Compact list of the files of a Zenodo record, used instead of one CKAN
+# resource per file for records with very large file lists
+file_manifest_table = Table(
+    'doi_import_file_manifest', metadata,
+    Column('package_id', UnicodeText, primary_key=True),
+    Column('position', Integer, primary_key=True),
+    Column('name', UnicodeText, nullable=False),
+    Column('size', BigInteger),
+    Column('checksum', UnicodeText),
+    Column('url', UnicodeText),
+)
+
+
+# Registry of DOIs to harvest (replaces config/zenodo_dois.txt). Keyed by the
+# canonical DOI, so membership checks are an index lookup and concurrent
+# inserts from several workers cannot create duplicates.
+REGISTRY_PENDING = 'pending'
+REGISTRY_HARVESTED = 'harvested'
+REGISTRY_FAILED = 'failed'
+
+doi_registry_table = Table(
+    'doi_import_registry', metadata,
+    Column('doi', UnicodeText, primary_key=True),
+    Column('record_id', UnicodeText, index=True),
+    Column('source', UnicodeText),
+    Column('status', UnicodeText, nullable=False, default=REGISTRY_PENDING, index=True),
+    Column('error', UnicodeText),
+    Column('upstream_updated', UnicodeText),
+    Column('last_harvested', DateTime),
+    Column('added', DateTime, nullable=False, default=datetime.datetime.utcnow),
+)
+
+
+# Small key/value store for harvest bookkeeping, e.g. the time of the last
+# successful Zenodo harvest used by incremental runs
+harvest_state_table = Table(
+    'doi_import_harvest_state', metadata,
+    Column('name', UnicodeText, primary_key=True),
+    Column('value', UnicodeText),
+    Column('updated', DateTime, nullable=False, default=datetime.datetime.utcnow),
+)
+
+
+# Per-DOI outcome of each harvest run, written as the run goes so an
+# interrupted run can be resumed and its failures retried
+harvest_checkpoint_table = Table(
+    'doi_import_harvest_checkpoint', metadata,
+    Column('run_id', UnicodeText, primary_key=True),
+    Column('doi', UnicodeText, primary_key=True),
+    Column('status', UnicodeText, nullable=False),
+    Column('upstream_updated', UnicodeText),
+    Column('metadata_hash', UnicodeText),
+    Column('error', UnicodeText),
+    Column('updated', DateTime, nullable=False, default=datetime.datetime.utcnow),
+)
+
+
+def init_tables():
+    metadata.create_all(model.meta.engine, checkfirst=True)
+
+
+def replace_file_manifest(package_id, files):
+    """Store the file manifest of a dataset, replacing any previous one"""
+    model.Session.execute(
+        file_manifest_table.delete().where(file_manifest_table.c.package_id == package_id)
+    )
+    if files:
+        model.Session.execute(file_manifest_table.insert(), [
+            {
+                'package_id': package_id,
+                'position': position,
+                'name': file_info.get('name', ''),
+                'size': file_info.get('size'),
+                'checksum': file_info.get('checksum'),
+                'url': file_info.get('url'),
+            }
+            for position, file_info in enumerate(files)
+        ])
+    model.Session.commit()
+
+
+def count_file_manifest(package_id):
+    return model.Session.execute(
+        select(func.count()).select_from(file_manifest_table)
+        .where(file_manifest_table.c.package_id == package_id)
+    ).scalar() or 0
+
+
+def get_file_manifest_page(package_id, offset=0, limit=50):
+    """One page of a dataset's file manifest, in upstream order"""
+    table = file_manifest_table
+    rows = model.Session.execute(
+        select(table.c.name, table.c.size, table.c.checksum, table.c.url)
+        .where(table.c.package_id == package_id)
+        .order_by(table.c.position)
+        .offset(offset)
+        .limit(limit)
+    )
+    return [dict(row._mapping) for row in rows]
+
+
+def registry_contains(doi):
+    canonical = identifiers.canonicalize(doi)
+    if canonical is None:
+        return False
+    return model.Session.execute(
+        select(doi_registry_table.c.doi).where(doi_registry_table.c.doi == canonical.doi)
+    ).first() is not None
+
+
+def registry_add(values):
+    """Add DOIs (any spelling) to the registry, ignoring ones already present
+
+    Returns the number of DOIs that were new.
+    """
+    if isinstance(values, str):
+        values = [values]
+
+    rows = [
+        {
+            'doi': canonical.doi,
+            'record_id': canonical.record_id,
+            'source': value,
+            'status': REGISTRY_PENDING,
+            'added': datetime.datetime.utcnow(),
+        }
+        for value, canonical in (
+            (value, identifiers.canonicalize(value)) for value in values
+        )
+        if canonical is not None
+    ]
+    if not rows:
+        return 0
+
+    # De-duplicate within the batch; ON CONFLICT handles rows already stored
+    rows = list({row['doi']: row for row in reversed(rows)}.values())[::-1]
+    result = model.Session.execute(
+        pg_insert(doi_registry_table).values(rows)
+        .on_conflict_do_nothing(index_elements=['doi'])
+    )
+    model.Session.commit()
+    return result.rowcount
+
+
+def registry_record(doi, status, upstream_updated=None, error=None):
+    """Record the outcome of harvesting a DOI, adding it to the registry if needed"""
+    canonical = identifiers.canonicalize(doi)
+    if canonical is None:
+        return
+
+    now = datetime.datetime.utcnow()
+    values = {'status': status, 'error': error}
+    if status == REGISTRY_HARVESTED:
+        values['last_harvested'] = now
+    if upstream_updated:
+        values['upstream_updated'] = upstream_updated
+
+    model.Session.execute(
+        pg_insert(doi_registry_table).values(
+            doi=canonical.doi, record_id=canonical.record_id, source=doi, added=now, **values
+        ).on_conflict_do_update(index_elements=['doi'], set_=values)
+    )
+    model.Session.commit()
+
+
+def registry_list(status=None, harvested_before=None):
+    """Registry entries as dicts, optionally filtered by status or harvest age"""
+    table = doi_registry_table
+    query = select(table).order_by(table.c.added, table.c.doi)
+    if status:
+        query = query.where(table.c.status == status)
+    if harvested_before:
+        query = query.where(
+            (table.c.last_harvested == None) | (table.c.last_harvested < harvested_before)  # noqa: E711
+        )
+    return [dict(row._mapping) for row in model.Session.execute(query)]
+
+
+def registry_remove(doi):
+    canonical = identifiers.canonicalize(doi)
+    if canonical is None:
+        return False
+    result = model.Session.execute(
+        doi_registry_table.delete().where(doi_registry_table.c.doi == canonical.doi)
+    )
+    model.Session.commit()
+    return result.rowcount > 0
+
+
+def get_harvest_state(name, default=None):
+    value = model.Session.execute(
+        select(harvest_state_table.c.value).where(harvest_state_table.c.name == name)
+    ).scalar()
+    return default if value is None else value
+
+
+def set_harvest_state(name, value):
+    values = {'value': value, 'updated': datetime.datetime.utcnow()}
+    model.Session.execute(
+        pg_insert(harvest_state_table).values(name=name, **values)
+        .on_conflict_do_update(index_elements=['name'], set_=values)
+    )
+    model.Session.commit()
+
+
+def record_checkpoint(run_id, doi, status, upstream_updated=None, metadata_hash=None, error=None):
+    """Durably record the outcome of one DOI in a harvest run"""
+    values = {
+        'status': status,
+        'upstream_updated': upstream_updated,
+        'metadata_hash': metadata_hash,
+        'error': error,
+        'updated': datetime.datetime.utcnow(),
+    }
+    model.Session.execute(
+        pg_insert(harvest_checkpoint_table).values(run_id=run_id, doi=doi, **values)
+        .on_conflict_do_update(index_elements=['run_id', 'doi'], set_=values)
+    )
+    model.Session.commit()
+
+
+def get_checkpoints(run_id, status=None):
+    """{doi: checkpoint dict} of a harvest run, optionally only one status"""
+    table = harvest_checkpoint_table
+    query = select(table).where(table.c.run_id == run_id)
+    if status:
+        query = query.where(table.c.status == status)
+    return {row.doi: dict(row._mapping) for row in model.Session.execute(query)}
+
+
+def prune_checkpoints(keep_runs):
+    """Delete the checkpoints of all but the most recent keep_runs runs"""
+    table = harvest_checkpoint_table
+    recent = [
+        row.run_id for row in model.Session.execute(
+            select(table.c.run_id).distinct().order_by(table.c.run_id.desc()).limit(keep_runs)
+        )
+    ]
+    if recent:
+        model.Session.execute(table.delete().where(table.c.run_id.notin_(recent)))
+        model.Session.commit()
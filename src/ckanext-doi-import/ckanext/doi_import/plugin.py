@@ -8,16 +8,49 @@ import ckan.plugins.toolkit as toolkit
 import requests
 import re
 import json
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from urllib.parse import urlparse
 
+from ckanext.doi_import import auth_cache, identifiers, indexing, jobs, lookup, previews, upstream
+from ckanext.doi_import import model as import_model
+
+log = logging.getLogger(__name__)
+
+# Default number of concurrent upstream fetches for batch imports
+DEFAULT_BATCH_WORKERS = 4
+
+# Maximum number of DOIs accepted in a single batch request
+MAX_BATCH_SIZE = 500
+
+# Records with more files than this get a file manifest instead of one
+# resource per file
+DEFAULT_MAX_FILE_RESOURCES = 50
+
+# Files returned per page by the file manifest endpoint
+FILE_MANIFEST_PAGE_SIZE = 50
+
+# Fields that are not part of the upstream metadata and are left out of the
+# metadata hash
+HASH_EXCLUDED_FIELDS = ('id', 'name', 'owner_org', 'contributing_organizations', 'metadata_hash')
+
+DATACITE_API_URL = 'https://api.datacite.org/dois'
+
+# DOIs per DataCite multi-DOI query, and records per result page
+DATACITE_BATCH_SIZE = 50
+DATACITE_PAGE_SIZE = 100
+
 class DoiImportPlugin(plugins.SingletonPlugin):
     """CKAN plugin for importing datasets from DOI"""
     
     plugins.implements(plugins.IConfigurer)
+    plugins.implements(plugins.IConfigurable)
     plugins.implements(plugins.IBlueprint)
     plugins.implements(plugins.IActions)
     plugins.implements(plugins.ITemplateHelpers)
+    plugins.implements(plugins.IPackageController, inherit=True)
 
     # IConfigurer
     def update_config(self, config_):
@@ -25,11 +58,22 @@ class DoiImportPlugin(plugins.SingletonPlugin):
         toolkit.add_public_directory(config_, 'public')
         toolkit.add_resource('public', 'doi_import')
 
+    # IConfigurable
+    def configure(self, config_):
+        import_model.init_tables()
+
+    # IPackageController
+    def before_dataset_index(self, pkg_dict):
+        # Exact-match lookup keys so a dataset can be found by DOI with a
+        # single term query (see lookup.find_datasets)
+        return lookup.index_lookup_keys(pkg_dict)
+
     # ITemplateHelpers
     def get_helpers(self):
         """Provide helper functions for templates"""
         return {
-            'doi_import_enabled': lambda: True
+            'doi_import_enabled': lambda: True,
+            'doi_import_file_manifest_count': import_model.count_file_manifest
         }
 
     # IBlueprint
@@ -42,24 +86,54 @@ class DoiImportPlugin(plugins.SingletonPlugin):
                              self.import_doi_form, 
                              methods=['GET', 'POST'])
         
+        blueprint.add_url_rule('/dataset/import-doi/preview', 
+                             'import_doi_preview', 
+                             self.import_doi_preview, 
+                             methods=['POST'])
+        
+        blueprint.add_url_rule('/dataset/import-doi/confirm', 
+                             'import_doi_confirm', 
+                             self.import_doi_confirm, 
+                             methods=['POST'])
+        
         blueprint.add_url_rule('/dataset/new-choice', 
                              'dataset_new_choice', 
                              self.dataset_new_choice, 
                              methods=['GET'])
         
+        blueprint.add_url_rule('/dataset/<id>/files', 
+                             'file_manifest', 
+                             self.file_manifest_endpoint, 
+                             methods=['GET'])
+        
         blueprint.add_url_rule('/api/harvest-doi', 
                              'harvest_doi', 
                              self.harvest_doi_endpoint, 
                              methods=['POST'])
         
+        blueprint.add_url_rule('/api/harvest-doi/batch', 
+                             'harvest_doi_batch', 
+                             self.harvest_doi_batch_endpoint, 
+                             methods=['POST'])
+        
+        blueprint.add_url_rule('/api/harvest-doi/status/<job_id>', 
+                             'harvest_doi_status', 
+                             self.harvest_doi_status_endpoint, 
+                             methods=['GET'])
+        
         return blueprint
 
     # IActions
     def get_actions(self):
-        return {
+        actions = {
             'doi_fetch_metadata': doi_fetch_metadata,
-            'doi_create_dataset': doi_create_dataset
+            'doi_create_dataset': doi_create_dataset,
+            'doi_import_batch': doi_import_batch,
+            'doi_registry_list': doi_registry_list
         }
+        # Keep the harvest-doi token cache in sync with token/user changes
+        actions.update(auth_cache.chained_actions)
+        return actions
 
     def dataset_new_choice(self):
         """Show choice between manual dataset creation and DOI import"""
@@ -78,6 +152,29 @@ class DoiImportPlugin(plugins.SingletonPlugin):
         
         return render_template('doi_import/dataset_new_choice.html')
 
+    def file_manifest_endpoint(self, id):
+        """Page through the file manifest of a dataset as JSON"""
+        from flask import request, jsonify
+        
+        context = {'user': toolkit.c.user, 'auth_user_obj': toolkit.c.userobj}
+        try:
+            dataset_dict = toolkit.get_action('package_show')(context, {'id': id})
+        except toolkit.ObjectNotFound:
+            return jsonify({'error': 'Dataset not found'}), 404
+        except toolkit.NotAuthorized:
+            return jsonify({'error': 'Not authorized to view this dataset'}), 403
+        
+        offset = max(request.args.get('offset', 0, type=int), 0)
+        limit = min(max(request.args.get('limit', FILE_MANIFEST_PAGE_SIZE, type=int), 1),
+                    FILE_MANIFEST_PAGE_SIZE * 10)
+        
+        return jsonify({
+            'total': import_model.count_file_manifest(dataset_dict['id']),
+            'offset': offset,
+            'limit': limit,
+            'files': import_model.get_file_manifest_page(dataset_dict['id'], offset, limit)
+        })
+
     def import_doi_form(self):
         """Handle the DOI import form"""
         from flask import request, render_template, redirect, url_for, flash
@@ -125,6 +222,20 @@ class DoiImportPlugin(plugins.SingletonPlugin):
                 flash('Please provide a DOI URL', 'error')
                 return redirect(url_for('doi_import.import_doi_form'))
             
+            # Run the import in the background and let the page poll for it.
+            # Needs a `ckan jobs worker`, which the compose files start.
+            if toolkit.asbool(toolkit.config.get('ckanext.doi_import.async_form', True)):
+                try:
+                    job = jobs.enqueue_import(
+                        toolkit.c.user, [doi_url], selected_org, contributing_orgs
+                    )
+                    return render_template('doi_import/import_status.html',
+                                         job_id=job.id,
+                                         doi_url=doi_url)
+                except Exception as e:
+                    # Job queue unavailable, fall back to importing inline
+                    log.warning('Could not enqueue DOI import, importing synchronously: %s', e)
+            
             try:
                 # Step 1: Fetch metadata from DOI
                 context = {'user': toolkit.c.user}
@@ -148,47 +259,156 @@ class DoiImportPlugin(plugins.SingletonPlugin):
                 flash(f'Error importing dataset: {str(e)}', 'error')
                 return redirect(url_for('doi_import.import_doi_form'))
             
-    def harvest_doi_endpoint(self):
-        """Secure API endpoint for automated DOI harvesting"""
+    def import_doi_preview(self):
+        """Fetch and map a DOI once and show what would be imported"""
+        from flask import request, render_template, redirect, url_for, flash
+        
+        doi_url = request.form.get('doi_url', '').strip()
+        selected_org = request.form.get('owner_org')
+        contributing_orgs = request.form.getlist('contributing_organizations')
+        
+        if not doi_url:
+            flash('Please provide a DOI URL', 'error')
+            return redirect(url_for('doi_import.import_doi_form'))
+        
+        try:
+            context = {'user': toolkit.c.user}
+            toolkit.check_access('package_create', context, {'owner_org': selected_org})
+            metadata = toolkit.get_action('doi_fetch_metadata')(
+                context, {'doi_url': doi_url}
+            )
+            metadata_url = metadata.get('url', '')
+            existing_dataset = _find_existing_datasets(context, [metadata_url]).get(metadata_url)
+        except toolkit.NotAuthorized:
+            flash('You are not allowed to create datasets in this organization', 'error')
+            return redirect(url_for('doi_import.import_doi_form'))
+        except Exception as e:
+            flash(f'Error fetching DOI metadata: {str(e)}', 'error')
+            return redirect(url_for('doi_import.import_doi_form'))
+        
+        preview_token = previews.store(
+            toolkit.c.user, doi_url, metadata, selected_org, contributing_orgs,
+            existing_dataset=existing_dataset
+        )
+        
+        try:
+            authors = json.loads(metadata.get('authors') or '[]')
+        except ValueError:
+            authors = []
+        
+        return render_template('doi_import/import_preview.html',
+                             preview_token=preview_token,
+                             doi_url=doi_url,
+                             metadata=metadata,
+                             authors=authors,
+                             file_count=len(metadata.get('file_manifest') or []),
+                             existing_dataset=existing_dataset,
+                             preview_ttl=previews.get_ttl())
+    
+    def import_doi_confirm(self):
+        """Create (or update) the dataset from a previewed mapping, without refetching it"""
+        from flask import request, redirect, url_for, flash
+        
+        preview_token = request.form.get('preview_token', '')
+        preview = previews.load(preview_token, toolkit.c.user)
+        if preview is None:
+            flash('The preview has expired, please import the DOI again', 'error')
+            return redirect(url_for('doi_import.import_doi_form'))
+        
+        try:
+            context = {'user': toolkit.c.user}
+            dataset_dict = toolkit.get_action('doi_create_dataset')(
+                context, _preview_write_data(preview)
+            )
+        except Exception as e:
+            flash(f'Error importing dataset: {str(e)}', 'error')
+            return redirect(url_for('doi_import.import_doi_form'))
+        
+        previews.discard(preview_token)
+        action = 'updated' if preview.get('existing_dataset') else 'imported'
+        flash(f'Dataset "{dataset_dict["title"]}" {action} successfully!', 'success')
+        return redirect(url_for('dataset.read', id=dataset_dict['name']))
+    
+    def _authenticate_api_request(self):
+        """Resolve the API token in the Authorization header to an action context
+        
+        Returns a (context, error_response) tuple; exactly one of them is None.
+        """
         from flask import request, jsonify
         import ckan.model as model
         
         # Get the authorization header
         auth_header = request.headers.get('Authorization')
         if not auth_header:
-            return jsonify({'error': 'Authorization header required'}), 401
+            return None, (jsonify({'error': 'Authorization header required'}), 401)
         
         # Extract token (handle both "Bearer token" and just "token" formats)
         token = auth_header.replace('Bearer ', '').replace('bearer ', '').strip()
         
+        # Tokens validated recently by this worker skip the database entirely
+        entry = auth_cache.get(token)
+        if entry is None:
+            entry = self._validate_api_token(token)
+            if isinstance(entry, tuple):
+                return None, entry
+        
+        if not entry.authorized:
+            return None, (jsonify({'error': 'User not authorized to create datasets'}), 403)
+        
+        context = {
+            'model': model,
+            'session': model.Session,
+            'user': entry.user_name,
+            'api_version': 3,
+            'ignore_auth': False
+        }
+        
+        return context, None
+
+    def _validate_api_token(self, token):
+        """Look up an API token and its user and cache the permission check
+        
+        Returns an auth_cache.AuthEntry, or an error response tuple.
+        """
+        from flask import jsonify
+        import ckan.model as model
+        
+        # Get token by id (the token string is stored as the id)
+        token_obj = model.Session.query(model.ApiToken).filter_by(id=token).first()
+        
+        if not token_obj:
+            return (jsonify({'error': 'Invalid API token'}), 401)
+        
+        # Get user by user_id
+        user_obj = model.User.get(token_obj.user_id)
+        
+        if not user_obj:
+            return (jsonify({'error': 'Token user not found'}), 401)
+        
+        # Verify user can create packages
+        context = {
+            'model': model,
+            'session': model.Session,
+            'user': user_obj.name,
+            'auth_user_obj': user_obj,
+            'ignore_auth': False
+        }
+        try:
+            toolkit.check_access('package_create', context)
+            authorized = True
+        except toolkit.NotAuthorized:
+            authorized = False
+        
+        return auth_cache.store(token, user_obj.id, user_obj.name, authorized)
+
+    def harvest_doi_endpoint(self):
+        """Secure API endpoint for automated DOI harvesting"""
+        from flask import request, jsonify
+        
         try:
-            # Get token by id (the token string is stored as the id)
-            token_obj = model.Session.query(model.ApiToken).filter_by(id=token).first()
-            
-            if not token_obj:
-                return jsonify({'error': 'Invalid API token'}), 401
-            
-            # Get user by user_id
-            user_obj = model.User.get(token_obj.user_id)
-            
-            if not user_obj:
-                return jsonify({'error': 'Token user not found'}), 401
-            
-            # Update context with user
-            context = {
-                'model': model,
-                'session': model.Session,
-                'user': user_obj.name,
-                'auth_user_obj': user_obj,
-                'api_version': 3,
-                'ignore_auth': False
-            }
-            
-            # Verify user can create packages
-            try:
-                toolkit.check_access('package_create', context)
-            except toolkit.NotAuthorized:
-                return jsonify({'error': 'User not authorized to create datasets'}), 403
+            context, error_response = self._authenticate_api_request()
+            if error_response:
+                return error_response
             
             # Get the DOI from request
             data = request.get_json()
@@ -197,28 +417,32 @@ class DoiImportPlugin(plugins.SingletonPlugin):
             
             doi_url = data.get('doi_url')
             
-            # Fetch metadata from Zenodo
-            metadata = toolkit.get_action('doi_fetch_metadata')(context, {'doi_url': doi_url})
-            
-            # Check if dataset already exists by searching for the DOI
-            doi_value = doi_url.replace('https://doi.org/', '').replace('http://doi.org/', '')
+            if data.get('async'):
+                job = jobs.enqueue_import(
+                    context['user'], [doi_url], data.get('owner_org', 'obis-community'),
+                    force=data.get('force', False)
+                )
+                return self._job_accepted_response(job)
             
-            # Search by URL field which contains the Zenodo record URL
-            search_results = toolkit.get_action('package_search')(
-                context,
-                {'fq': f'url:*zenodo.org/record*', 'rows': 1000}
-            )
+            # Fetch metadata from Zenodo. A harvester that knows the record
+            # changed (or forces the update) must not get a cached copy.
+            metadata = toolkit.get_action('doi_fetch_metadata')(context, {
+                'doi_url': doi_url,
+                'revalidate': data.get('revalidate') or data.get('force', False)
+            })
             
-            # Find matching record by comparing URLs
-            existing_dataset = None
+            # Check if dataset already exists with an exact DOI/record id lookup
             metadata_url = metadata.get('url', '')
+            existing_dataset = _find_existing_datasets(context, [metadata_url]).get(metadata_url)
             
-            for result in search_results.get('results', []):
-                if result.get('url') == metadata_url:
-                    existing_dataset = result
-                    break
-            
-            if existing_dataset:
+            if existing_dataset and metadata_unchanged(existing_dataset, metadata):
+                # Same upstream metadata as last time: skip the write and reindex
+                return jsonify({
+                    'success': True,
+                    'action': 'unchanged',
+                    'dataset': _dataset_summary(existing_dataset)
+                })
+            elif existing_dataset:
                 # Update existing dataset
                 metadata['id'] = existing_dataset['id']
                 metadata['name'] = existing_dataset['name']
@@ -233,12 +457,7 @@ class DoiImportPlugin(plugins.SingletonPlugin):
                 return jsonify({
                     'success': True,
                     'action': 'updated',
-                    'dataset': {
-                        'id': dataset_dict['id'],
-                        'name': dataset_dict['name'],
-                        'title': dataset_dict['title'],
-                        'url': f"{toolkit.config.get('ckan.site_url', 'http://localhost:5000')}/dataset/{dataset_dict['name']}"
-                    }
+                    'dataset': _dataset_summary(dataset_dict)
                 })
             else:
                 # Create new dataset
@@ -252,12 +471,7 @@ class DoiImportPlugin(plugins.SingletonPlugin):
                 return jsonify({
                     'success': True,
                     'action': 'created',
-                    'dataset': {
-                        'id': dataset_dict['id'],
-                        'name': dataset_dict['name'],
-                        'title': dataset_dict['title'],
-                        'url': f"{toolkit.config.get('ckan.site_url', 'http://localhost:5000')}/dataset/{dataset_dict['name']}"
-                    }
+                    'dataset': _dataset_summary(dataset_dict)
                 })
             
         except toolkit.ValidationError as e:
@@ -267,8 +481,82 @@ class DoiImportPlugin(plugins.SingletonPlugin):
             traceback.print_exc()
             return jsonify({'error': f'Server error: {str(e)}'}), 500
 
+    def harvest_doi_batch_endpoint(self):
+        """Secure API endpoint for harvesting a list of DOIs in one call"""
+        from flask import request, jsonify
+        
+        try:
+            context, error_response = self._authenticate_api_request()
+            if error_response:
+                return error_response
+            
+            data = request.get_json(silent=True)
+            if not data or not isinstance(data.get('dois'), list) or not data['dois']:
+                return jsonify({'error': 'dois list required in JSON body'}), 400
+            
+            if data.get('async'):
+                job = jobs.enqueue_import(
+                    context['user'], data['dois'], data.get('owner_org', 'obis-community'),
+                    force=data.get('force', False), bulk=data.get('bulk', False)
+                )
+                return self._job_accepted_response(job)
+            
+            result = toolkit.get_action('doi_import_batch')(context, {
+                'dois': data['dois'],
+                'owner_org': data.get('owner_org', 'obis-community'),
+                'force': data.get('force', False),
+                'bulk': data.get('bulk', False)
+            })
+            
+            return jsonify(dict(result, success=True))
+        
+        except toolkit.ValidationError as e:
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            return jsonify({'error': f'Server error: {str(e)}'}), 500
+
+    def harvest_doi_status_endpoint(self, job_id):
+        """Report progress and per-DOI outcomes of a background import job"""
+        from flask import request, jsonify
+        from ckan import authz
+        
+        # API clients send their token; the web form relies on the login session
+        if request.headers.get('Authorization'):
+            context, error_response = self._authenticate_api_request()
+            if error_response:
+                return error_response
+            user_name = context['user']
+        else:
+            user_name = toolkit.c.user
+            if not user_name:
+                return jsonify({'error': 'Authorization required'}), 401
+        
+        status = jobs.get_import_status(job_id)
+        if status is None:
+            return jsonify({'error': 'Job not found'}), 404
+        
+        if status.get('user') != user_name and not authz.is_sysadmin(user_name):
+            return jsonify({'error': 'Not authorized to view this job'}), 403
+        
+        return jsonify(dict(status, success=True))
+
+    def _job_accepted_response(self, job):
+        from flask import jsonify, url_for
+        
+        return jsonify({
+            'success': True,
+            'job_id': job.id,
+            'status_url': url_for('doi_import.harvest_doi_status', job_id=job.id, _external=True)
+        }), 202
+
 def doi_fetch_metadata(context, data_dict):
-    """Fetch metadata from a DOI URL"""
+    """Fetch metadata from a DOI URL
+
+    With ``revalidate`` a cached Zenodo record is checked with Zenodo even
+    when it is still fresh, for callers that know the record changed.
+    """
     
     doi_url = data_dict.get('doi_url', '').strip()
     if not doi_url:
@@ -279,80 +567,95 @@ def doi_fetch_metadata(context, data_dict):
     if not doi:
         raise toolkit.ValidationError({'doi_url': 'Invalid DOI URL format'})
     
-    # Try Zenodo first (even for non-Zenodo DOIs that might be on Zenodo)
+    return fetch_doi_metadata(doi, revalidate=toolkit.asbool(data_dict.get('revalidate', False)))
+
+
+def fetch_doi_metadata(doi, datacite_records=None, revalidate=False):
+    """Fetch and map the metadata of a canonical DOI from Zenodo or DataCite
+
+    ``datacite_records`` is an optional {doi: record} map prefetched with
+    fetch_datacite_records, so bulk imports resolve non-Zenodo DOIs in a few
+    requests instead of one per DOI. ``revalidate`` is passed on to
+    fetch_zenodo_record.
+    """
+    
+    # Direct Zenodo DOIs resolve straight from the record endpoint (one request)
+    if identifiers.zenodo_record_id(doi):
+        return fetch_zenodo_metadata(doi, revalidate)
+    
+    if datacite_records is None:
+        try:
+            datacite_records = fetch_datacite_records([doi])
+        except requests.RequestException:
+            datacite_records = {}
+    
+    record = datacite_records.get(doi)
+    if record:
+        # DOIs minted elsewhere but deposited on Zenodo get the richer Zenodo
+        # mapping (files, record links)
+        record_id = identifiers.zenodo_record_id(record.get('attributes', {}).get('url'))
+        if record_id:
+            return fetch_zenodo_metadata(f"10.5281/zenodo.{record_id}", revalidate)
+        return map_datacite_to_schema(record, doi)
+    
+    # Not registered with DataCite (e.g. Crossref DOIs): search Zenodo by DOI
     try:
-        # Try to find it on Zenodo by DOI
-        # Some DOIs from other publishers are also on Zenodo
-        zenodo_url = f"https://zenodo.org/api/records?q=doi:{doi}"
-        response = requests.get(zenodo_url, timeout=30)
-        response.raise_for_status()
-        data = response.json()
-        
-        if data.get('hits', {}).get('total', 0) > 0:
-            # Found on Zenodo!
-            record = data['hits']['hits'][0]
+        data = upstream.get_json(
+            "https://zenodo.org/api/records", params={'q': f'doi:"{doi}"'}
+        )
+        hits = data.get('hits', {}).get('hits', [])
+        
+        if hits:
+            # Found on Zenodo! Search hits carry the full record, so map the
+            # payload directly instead of downloading it a second time
+            record = hits[0]
             record_id = record.get('id')
-            return fetch_zenodo_metadata(f"10.5281/zenodo.{record_id}")
-    except:
-        pass  # Zenodo search failed, continue to other methods
+            if record.get('metadata'):
+                record['record_id'] = str(record_id)
+                return map_zenodo_to_schema(record, f"10.5281/zenodo.{record_id}")
+            return fetch_zenodo_metadata(f"10.5281/zenodo.{record_id}", revalidate)
+    except requests.RequestException:
+        pass  # Zenodo search failed, fall through to the error below
     
-    # Check if it's a direct Zenodo DOI
-    if 'zenodo' in doi_url.lower() or doi.startswith('10.5281/zenodo'):
-        return fetch_zenodo_metadata(doi)
-    else:
-        # Not on Zenodo and not a Zenodo DOI
-        raise toolkit.ValidationError({
-            'doi_url': 'This DOI is not available on Zenodo. We currently only support importing from Zenodo. Please use a Zenodo DOI (e.g., https://doi.org/10.5281/zenodo.XXXXX)'
-        })
+    raise toolkit.ValidationError({
+        'doi_url': 'This DOI was not found on Zenodo or DataCite. Please use a Zenodo or DataCite DOI (e.g., https://doi.org/10.5281/zenodo.XXXXX)'
+    })
 
 
 def extract_doi_from_url(url):
-    """Extract DOI from various URL formats"""
-    # Handle direct DOIs
-    if url.startswith('10.'):
-        return url
-    
-    # Handle DOI URLs
-    patterns = [
-        r'doi\.org/(.+)$',
-        r'zenodo\.org/record/(\d+)',
-        r'zenodo\.org/doi/(.+)$'
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, url)
-        if match:
-            if 'record' in pattern:
-                return f"10.5281/zenodo.{match.group(1)}"
-            else:
-                return match.group(1)
-    
-    return None
+    """Extract the canonical DOI from various URL formats"""
+    return identifiers.normalize_doi(url)
 
 
-def fetch_zenodo_metadata(doi):
-    """Fetch metadata from Zenodo API"""
+def fetch_zenodo_record(doi, revalidate=False):
+    """Fetch the raw Zenodo API record of a Zenodo DOI
+
+    The response cache may answer with a copy up to ckanext.doi_import.cache.ttl
+    old. With ``revalidate`` a cached copy is always checked with Zenodo
+    (a conditional GET), so harvests that know the record changed never map
+    stale metadata.
+    """
     
     # Extract record ID from DOI
-    match = re.search(r'zenodo\.(\d+)', doi)
-    if not match:
+    record_id = identifiers.zenodo_record_id(doi)
+    if not record_id:
         raise toolkit.ValidationError({'doi': 'Invalid Zenodo DOI format'})
     
-    record_id = match.group(1)
     api_url = f"https://zenodo.org/api/records/{record_id}"
     
     try:
-        response = requests.get(api_url, timeout=30)
-        response.raise_for_status()
-        data = response.json()
-        
-        # Add the record_id to the data for use in mapping
-        data['record_id'] = record_id
-        
-        return map_zenodo_to_schema(data, doi)
-        
+        data = upstream.get_cached_json(api_url, ttl=0 if revalidate else None)
     except requests.RequestException as e:
         raise toolkit.ValidationError({'doi': f'Failed to fetch Zenodo metadata: {str(e)}'})
+    
+    # Add the record_id to the data for use in mapping (the API may have
+    # redirected a concept DOI to its latest version)
+    data['record_id'] = str(data.get('id') or record_id)
+    return data
+
+def fetch_zenodo_metadata(doi, revalidate=False):
+    """Fetch metadata from Zenodo API"""
+    return map_zenodo_to_schema(fetch_zenodo_record(doi, revalidate), doi)
 
 def map_zenodo_to_schema(zenodo_data, doi):
     """Map Zenodo metadata to your CKAN schema format"""
@@ -361,6 +664,11 @@ def map_zenodo_to_schema(zenodo_data, doi):
     metadata = zenodo_data.get('metadata', {})
     files = zenodo_data.get('files', [])
     
+    # Canonical DOI plus the concept (all versions) DOI from the record
+    record_ids = identifiers.from_zenodo_record(zenodo_data)
+    canonical = identifiers.canonicalize(doi, record_ids.concept_doi if record_ids else None)
+    doi = canonical.doi if canonical else doi
+    
     # Basic fields
     mapped_data = {
         'title': metadata.get('title', 'Untitled Dataset'),
@@ -368,14 +676,23 @@ def map_zenodo_to_schema(zenodo_data, doi):
         'url': f"https://zenodo.org/record/{record_id}",
         'identifier': {
             'propertyID': 'DOI',
-            'value': doi.replace('https://doi.org/', '').replace('http://doi.org/', ''),
-            'url': f"https://doi.org/{doi.replace('https://doi.org/', '').replace('http://doi.org/', '')}"
+            'value': doi,
+            'url': f"https://doi.org/{doi}"
         },
+        'doi': f"https://doi.org/{doi}",
+        'zenodo_record_id': str(record_id),
         'version': metadata.get('version', '1.0'),
         'license_id': metadata.get('license', {}).get('id', 'notspecified'),
         'tag_string': ','.join([kw for kw in metadata.get('keywords', [])]),
     }
     
+    if canonical and canonical.concept_doi:
+        mapped_data['concept_doi'] = f"https://doi.org/{canonical.concept_doi}"
+    
+    # Upstream modification time, used to detect unchanged records on re-harvest
+    if zenodo_data.get('updated'):
+        mapped_data['date_modified'] = zenodo_data['updated']
+    
     # Map resource type - handle both old and new Zenodo API formats
     resource_type_data = metadata.get('resource_type', {})
     
@@ -421,15 +738,39 @@ def map_zenodo_to_schema(zenodo_data, doi):
     
     # Create resources that link to Zenodo files instead of importing them
     resources = []
+    max_file_resources = toolkit.asint(
+        toolkit.config.get('ckanext.doi_import.max_file_resources', DEFAULT_MAX_FILE_RESOURCES)
+    )
 
-    for file_info in files:
-        resource = {
-            'name': file_info.get('key', file_info.get('filename', 'Download')),
-            'url': f"https://zenodo.org/record/{record_id}/files/{file_info.get('key', '')}",
-            'format': file_info.get('type', '').upper(),
-            'description': f"Download from Zenodo. File size: {file_info.get('size', 0)} bytes"
-        }
-        resources.append(resource)
+    if len(files) > max_file_resources:
+        # Very large file lists are kept out of the package: one resource for
+        # the whole record plus a compact manifest stored in a side table
+        # (see doi_create_dataset) that the dataset page pages through
+        mapped_data['file_manifest'] = [
+            {
+                'name': file_info.get('key', file_info.get('filename', '')),
+                'size': file_info.get('size'),
+                'checksum': file_info.get('checksum'),
+                'url': f"https://zenodo.org/record/{record_id}/files/{file_info.get('key', '')}"
+            }
+            for file_info in files
+        ]
+        resources.append({
+            'name': f'All files ({len(files)})',
+            'url': f"https://zenodo.org/records/{record_id}/files-archive",
+            'format': 'ZIP',
+            'description': f"Download all {len(files)} files of this record from Zenodo as one archive. "
+                           f"Total size: {sum(f.get('size') or 0 for f in files)} bytes"
+        })
+    else:
+        for file_info in files:
+            resource = {
+                'name': file_info.get('key', file_info.get('filename', 'Download')),
+                'url': f"https://zenodo.org/record/{record_id}/files/{file_info.get('key', '')}",
+                'format': file_info.get('type', '').upper(),
+                'description': f"Download from Zenodo. File size: {file_info.get('size', 0)} bytes"
+            }
+            resources.append(resource)
 
     # Add main Zenodo record as a resource
     resources.insert(0, {
@@ -539,12 +880,19 @@ def doi_create_dataset(context, data_dict):
     owner_org = data_dict.get('owner_org')
     contributing_orgs = data_dict.get('contributing_organizations', [])
     
-    # Extract DOI from the extras
-    doi = None
-    for extra in metadata.get('extras', []):
-        if extra.get('key') == 'doi':
-            doi = extra.get('value')
-            break
+    # Hash the upstream metadata (including the file manifest) before it is
+    # extended with organizations and ids
+    metadata['metadata_hash'] = metadata_hash(metadata)
+    
+    # Large file lists are stored in a side table, not in the package
+    file_manifest = metadata.pop('file_manifest', None)
+    
+    # Registry key: the mappers set 'doi' to the DOI URL and keep the bare DOI
+    # in the identifier
+    identifier = metadata.get('identifier')
+    if isinstance(identifier, dict):
+        identifier = identifier.get('value')
+    doi = identifiers.normalize_doi(metadata.get('doi')) or identifiers.normalize_doi(identifier)
     
     # Add organization
     if owner_org:
@@ -583,6 +931,13 @@ def doi_create_dataset(context, data_dict):
             print(f"Created dataset: {dataset_dict['name']}")
             print(f"DEBUG: Created dataset product_type: {dataset_dict.get('product_type')}")
         
+        # Store (or clear a stale) file manifest for the dataset
+        if file_manifest or 'id' in metadata:
+            import_model.replace_file_manifest(dataset_dict['id'], file_manifest)
+        
+        if doi:
+            record_harvested_doi(doi, metadata.get('date_modified'))
+        
         return dataset_dict
         
     except toolkit.ValidationError as e:
@@ -590,67 +945,432 @@ def doi_create_dataset(context, data_dict):
         raise toolkit.ValidationError(f"Failed to create/update dataset: {e}")
 
 
-def fetch_datacite_metadata(doi):
-    """Fallback: fetch metadata from DataCite API for non-Zenodo DOIs"""
+def metadata_hash(metadata):
+    """SHA-256 of the canonical JSON form of mapped upstream metadata
     
-    api_url = f"https://api.datacite.org/dois/{doi}"
+    Keys are sorted, tags and extras are put in a stable order and fields set
+    by CKAN or the importer (HASH_EXCLUDED_FIELDS) are ignored, so the hash
+    only changes when the upstream record does.
+    """
+    canonical = {
+        key: value for key, value in metadata.items()
+        if key not in HASH_EXCLUDED_FIELDS
+    }
+    if canonical.get('tag_string'):
+        canonical['tag_string'] = ','.join(sorted(
+            tag.strip() for tag in canonical['tag_string'].split(',') if tag.strip()
+        ))
+    if canonical.get('extras'):
+        canonical['extras'] = sorted(canonical['extras'], key=lambda extra: extra.get('key', ''))
+    
+    payload = json.dumps(
+        canonical, sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def metadata_unchanged(existing_dataset, metadata):
+    """True if a dataset was imported from exactly this mapped metadata"""
+    stored_hash = existing_dataset.get('metadata_hash')
+    return bool(stored_hash) and stored_hash == metadata_hash(metadata)
+
+
+def doi_import_batch(context, data_dict):
+    """Import or refresh a list of DOIs in one call
     
+    Upstream metadata is fetched concurrently with a bounded thread pool, then
+    all CKAN writes happen in a single sequential pass. Returns one result per
+    DOI with a status of created, updated, unchanged or failed.
+    
+    With ``bulk`` the written datasets are reindexed together after the
+    pass, with one Solr commit, instead of one by one.
+    """
+    
+    toolkit.check_access('package_create', context)
+    
+    dois = data_dict.get('dois') or []
+    if not isinstance(dois, list) or not dois:
+        raise toolkit.ValidationError({'dois': 'A list of DOIs is required'})
+    if len(dois) > MAX_BATCH_SIZE:
+        raise toolkit.ValidationError({
+            'dois': f'At most {MAX_BATCH_SIZE} DOIs can be imported per batch'
+        })
+    
+    owner_org = data_dict.get('owner_org') or 'obis-community'
+    contributing_orgs = data_dict.get('contributing_organizations') or []
+    force = toolkit.asbool(data_dict.get('force', False))
+    bulk = toolkit.asbool(data_dict.get('bulk', False))
+    workers = toolkit.asint(
+        toolkit.config.get('ckanext.doi_import.batch_workers', DEFAULT_BATCH_WORKERS)
+    )
+    
+    # Step 1: Fetch all upstream metadata concurrently. The fetch functions do
+    # not touch the database, so they are safe to run outside the request thread.
+    canonical_dois = [extract_doi_from_url(str(doi).strip()) for doi in dois]
+    
+    # Non-Zenodo DOIs are resolved from DataCite up front in a few multi-DOI
+    # queries; if that fails each DOI falls back to its own lookup
     try:
-        response = requests.get(api_url, timeout=30)
-        response.raise_for_status()
-        data = response.json()
+        datacite_records = fetch_datacite_records([
+            doi for doi in canonical_dois if doi and not identifiers.zenodo_record_id(doi)
+        ])
+    except requests.RequestException as e:
+        log.warning('DataCite batch lookup failed: %s', e)
+        datacite_records = None
+    
+    def _fetch(doi):
+        if not doi:
+            return None, 'Invalid DOI URL format'
+        try:
+            return fetch_doi_metadata(doi, datacite_records, revalidate=force), None
+        except Exception as e:
+            return None, str(e)
+    
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(dois)))) as executor:
+        fetched = list(executor.map(_fetch, canonical_dois))
+    
+    # Step 2: Look up all existing datasets at once
+    existing_by_url = _find_existing_datasets(
+        context, [metadata.get('url') for metadata, error in fetched if metadata]
+    )
+    
+    # Step 3: Write to CKAN in one sequential pass
+    results = []
+    if bulk:
+        with indexing.deferred_indexing():
+            _write_batch(context, dois, fetched, existing_by_url, results,
+                         owner_org, contributing_orgs, force)
+    else:
+        _write_batch(context, dois, fetched, existing_by_url, results,
+                     owner_org, contributing_orgs, force)
+    
+    summary = {'created': 0, 'updated': 0, 'unchanged': 0, 'failed': 0}
+    for result in results:
+        summary[result['status']] += 1
+    
+    return {'results': results, 'summary': summary}
+
+
+def _write_batch(context, dois, fetched, existing_by_url, results,
+                 owner_org, contributing_orgs, force):
+    """Write the fetched metadata of a batch to CKAN, appending to results"""
+    for doi_url, (metadata, error) in zip(dois, fetched):
+        # CKAN keeps state such as context['package'] from one action call,
+        # so every write gets its own context
+        write_context = _write_context(context)
+        result = {'doi': doi_url}
+        
+        if error:
+            result.update({'status': 'failed', 'error': error})
+            results.append(result)
+            continue
         
-        return map_datacite_to_schema(data, doi)
+        existing_dataset = existing_by_url.get(metadata.get('url'))
+        
+        try:
+            if existing_dataset and (metadata_unchanged(existing_dataset, metadata) or (
+                    not force and metadata.get('date_modified') and
+                    existing_dataset.get('date_modified') == metadata['date_modified'])):
+                result.update({
+                    'status': 'unchanged',
+                    'dataset': _dataset_summary(existing_dataset)
+                })
+            elif existing_dataset:
+                metadata['id'] = existing_dataset['id']
+                metadata['name'] = existing_dataset['name']
+                dataset_dict = doi_create_dataset(write_context, {
+                    'metadata': metadata,
+                    'owner_org': existing_dataset.get('owner_org', owner_org),
+                    'contributing_organizations': [],
+                    'is_update': True
+                })
+                result.update({'status': 'updated', 'dataset': _dataset_summary(dataset_dict)})
+            else:
+                dataset_dict = doi_create_dataset(write_context, {
+                    'metadata': metadata,
+                    'owner_org': owner_org,
+                    'contributing_organizations': contributing_orgs,
+                    'is_update': False
+                })
+                # Guard against the same record appearing twice in one batch
+                existing_by_url[metadata.get('url')] = dataset_dict
+                result.update({'status': 'created', 'dataset': _dataset_summary(dataset_dict)})
+        except Exception as e:
+            result.update({'status': 'failed', 'error': str(e)})
         
+        results.append(result)
+
+
+def _preview_write_data(preview):
+    """doi_create_dataset input for a confirmed preview
+
+    A DOI that was already imported updates that dataset, like /api/harvest-doi,
+    instead of creating a second one.
+    """
+    metadata = dict(preview['metadata'])
+    existing_dataset = preview.get('existing_dataset')
+    if not existing_dataset:
+        return {
+            'metadata': metadata,
+            'owner_org': preview['owner_org'],
+            'contributing_organizations': preview['contributing_organizations'],
+        }
+    
+    metadata['id'] = existing_dataset['id']
+    metadata['name'] = existing_dataset['name']
+    return {
+        'metadata': metadata,
+        'owner_org': existing_dataset.get('owner_org') or preview['owner_org'],
+        'contributing_organizations': preview['contributing_organizations'],
+        'is_update': True
+    }
+
+
+def _write_context(context):
+    """Fresh action context for one write, with the caller's user and auth"""
+    return {
+        'user': context.get('user'),
+        'ignore_auth': context.get('ignore_auth', False),
+    }
+
+
+def _find_existing_datasets(context, urls):
+    """Return a {url: dataset} map for datasets matching the given Zenodo record URLs"""
+    
+    urls = sorted(set(url for url in urls if url))
+    if not urls:
+        return {}
+    
+    found = lookup.find_datasets(context, urls)
+    return {url: dataset for url, dataset in found.items() if dataset}
+
+
+def _dataset_summary(dataset_dict):
+    """Compact representation of a dataset for API responses"""
+    site_url = toolkit.config.get('ckan.site_url', 'http://localhost:5000')
+    return {
+        'id': dataset_dict['id'],
+        'name': dataset_dict['name'],
+        'title': dataset_dict['title'],
+        'url': f"{site_url}/dataset/{dataset_dict['name']}"
+    }
+
+
+@toolkit.side_effect_free
+def doi_registry_list(context, data_dict):
+    """List the DOIs in the harvest registry
+
+    Optional ``status`` (pending, harvested, failed) filters the entries.
+    Sysadmins only.
+    """
+    toolkit.check_access('sysadmin', context, data_dict)
+
+    entries = import_model.registry_list(status=data_dict.get('status'))
+    for entry in entries:
+        for key in ('added', 'last_harvested'):
+            if entry[key]:
+                entry[key] = entry[key].isoformat()
+    return entries
+
+
+def fetch_datacite_records(dois):
+    """Fetch DataCite records for many DOIs, returned as {doi: record}
+
+    DOIs are resolved DATACITE_BATCH_SIZE at a time with one multi-DOI query
+    (query=doi:("a" OR "b" ...)), following the result pages. DOIs unknown to
+    DataCite are missing from the result.
+    """
+    dois = sorted(set(doi for doi in dois if doi))
+    records = {}
+    
+    for i in range(0, len(dois), DATACITE_BATCH_SIZE):
+        chunk = dois[i:i + DATACITE_BATCH_SIZE]
+        url = DATACITE_API_URL
+        params = {
+            'query': 'doi:(' + ' OR '.join(f'"{doi}"' for doi in chunk) + ')',
+            'page[size]': DATACITE_PAGE_SIZE,
+            'page[cursor]': 1,
+            'affiliation': 'true',
+        }
+        
+        while url:
+            data = upstream.get_json(url, params=params)
+            for record in data.get('data', []):
+                doi = identifiers.normalize_doi(record.get('attributes', {}).get('doi'))
+                if doi:
+                    records[doi] = record
+            # The next link already carries the query and the page cursor
+            url = data.get('links', {}).get('next')
+            params = None
+    
+    return records
+
+
+def fetch_datacite_metadata(doi):
+    """Fetch and map the metadata of one non-Zenodo DOI from DataCite"""
+    
+    try:
+        records = fetch_datacite_records([doi])
     except requests.RequestException as e:
         raise toolkit.ValidationError({'doi': f'Failed to fetch DataCite metadata: {str(e)}'})
+    
+    if doi not in records:
+        raise toolkit.ValidationError({'doi': f'DOI not found on DataCite: {doi}'})
+    return map_datacite_to_schema(records[doi], doi)
 
 
 def map_datacite_to_schema(datacite_data, doi):
-    """Map DataCite metadata to schema (basic implementation)"""
+    """Map a DataCite record (JSON:API resource) to the CKAN schema"""
     
-    attributes = datacite_data.get('data', {}).get('attributes', {})
+    # Accept both a bare record and a single-record API response
+    record = datacite_data.get('data', datacite_data)
+    attributes = record.get('attributes', {})
+    doi = identifiers.normalize_doi(attributes.get('doi')) or doi
+    doi_url = f"https://doi.org/{doi}"
+    
+    titles = attributes.get('titles') or [{}]
+    descriptions = attributes.get('descriptions') or []
+    abstract = next(
+        (d for d in descriptions if d.get('descriptionType') == 'Abstract'),
+        descriptions[0] if descriptions else {}
+    )
+    keywords = [s['subject'] for s in attributes.get('subjects') or [] if s.get('subject')]
+    types = attributes.get('types') or {}
     
     mapped_data = {
-        'title': attributes.get('title', 'Untitled Dataset'),
-        'notes': attributes.get('descriptions', [{}])[0].get('description', ''),
-        'url': f"https://doi.org/{doi}",
-        'version': attributes.get('version', '1.0'),
-        'product_type': ['derived_dataset'],
+        'title': titles[0].get('title', 'Untitled Dataset'),
+        'notes': abstract.get('description', ''),
+        'url': doi_url,
+        'identifier': {
+            'propertyID': 'DOI',
+            'value': doi,
+            'url': doi_url
+        },
+        'doi': doi_url,
+        'canonical_id': doi_url,
+        'version': attributes.get('version') or '1.0',
+        'license_id': map_zenodo_license([
+            {'id': rights.get('rightsIdentifier', '')}
+            for rights in attributes.get('rightsList') or []
+        ]),
+        'tag_string': ','.join(keywords),
+        'keywords': ', '.join(keywords),
+        'product_type': map_datacite_resource_type(types.get('resourceTypeGeneral')),
         'update_frequency': 'never',
-        'resources': [],
-        'extras': [
-            {'key': 'doi', 'value': doi},
-            {'key': 'source', 'value': 'datacite'},
-        ]
     }
     
+    if types.get('schemaOrg'):
+        mapped_data['resource_type'] = f"https://schema.org/{types['schemaOrg']}"
+    
+    publisher = attributes.get('publisher')
+    if isinstance(publisher, dict):
+        publisher = publisher.get('name')
+    if publisher:
+        mapped_data['publisher_name'] = publisher
+    
+    # Dates: issued date (or publication year), registry creation and update
+    dates = {d.get('dateType'): d.get('date') for d in attributes.get('dates') or []}
+    date_published = dates.get('Issued') or str(attributes.get('publicationYear') or '')
+    if date_published:
+        mapped_data['date_published'] = date_published[:10]
+    if attributes.get('created'):
+        mapped_data['date_created'] = attributes['created']
+    if attributes.get('updated'):
+        # Upstream modification time, used to detect unchanged records on re-harvest
+        mapped_data['date_modified'] = attributes['updated']
+    if dates.get('Collected'):
+        mapped_data['temporal_coverage'] = dates['Collected']
+    
+    authors = [_datacite_person(creator) for creator in attributes.get('creators') or []]
+    if authors:
+        mapped_data['authors'] = json.dumps(authors, ensure_ascii=False)
+    
+    contributors = []
+    for contributor in attributes.get('contributors') or []:
+        entry = _datacite_person(contributor)
+        entry['type'] = contributor.get('contributorType', '')
+        contributors.append(entry)
+    if contributors:
+        mapped_data['contributors'] = json.dumps(contributors, ensure_ascii=False)
+    
+    funding = [
+        {
+            'funder_name': ref.get('funderName', ''),
+            'funder_id': ref.get('funderIdentifier', ''),
+            'grant_name': ref.get('awardTitle', ''),
+            'grant_id': ref.get('awardNumber', ''),
+            'grant_url': ref.get('awardUri', ''),
+        }
+        for ref in attributes.get('fundingReferences') or []
+    ]
+    if funding:
+        mapped_data['funding'] = json.dumps(funding, ensure_ascii=False)
+    
+    resources = [{
+        'name': 'Landing Page',
+        'url': attributes.get('url') or doi_url,
+        'format': 'HTML',
+        'description': f'View this {types.get("resourceTypeGeneral", "resource").lower()} at its publisher'
+    }]
+    for content_url in attributes.get('contentUrl') or []:
+        resources.append({
+            'name': content_url.rsplit('/', 1)[-1] or 'Download',
+            'url': content_url,
+            'description': 'Download from the publisher'
+        })
+    mapped_data['resources'] = resources
+    
+    extras = [
+        {'key': 'source', 'value': 'datacite'},
+    ]
+    if attributes.get('publicationYear'):
+        extras.append({'key': 'publication_year', 'value': str(attributes['publicationYear'])})
+    mapped_data['extras'] = extras
+    
     return mapped_data
 
-def add_doi_to_whitelist(doi):
-    """Add successfully imported DOI to the whitelist file"""
-    whitelist_path = '/srv/app/src_extensions/ckanext-zenodo/ckanext/zenodo/config/zenodo_dois.txt'
+
+def _datacite_person(person):
+    """Author/contributor entry in the same shape as the Zenodo mapping"""
+    affiliations = []
+    for affiliation in person.get('affiliation') or []:
+        if isinstance(affiliation, dict):
+            affiliation = affiliation.get('name', '')
+        if affiliation:
+            affiliations.append(affiliation)
     
+    entry = {
+        'name': person.get('name', ''),
+        'affiliation': ', '.join(affiliations),
+        'email': ''
+    }
+    for identifier in person.get('nameIdentifiers') or []:
+        if identifier.get('nameIdentifierScheme') == 'ORCID':
+            entry['orcid'] = identifier.get('nameIdentifier', '')
+    return entry
+
+
+def map_datacite_resource_type(resource_type_general):
+    """Map a DataCite resourceTypeGeneral to product_type values"""
+    type_mapping = {
+        'Text': 'publication',
+        'JournalArticle': 'publication',
+        'Preprint': 'publication',
+        'Report': 'publication',
+        'Image': 'image',
+        'Audiovisual': 'video',
+        'PhysicalObject': 'physical_object',
+    }
+    if resource_type_general in type_mapping:
+        return [type_mapping[resource_type_general]]
+    return map_zenodo_resource_type((resource_type_general or 'dataset').lower())
+
+def record_harvested_doi(doi, upstream_updated=None):
+    """Mark a DOI as harvested in the registry, adding it if it is new"""
     try:
-        # Read existing DOIs
-        existing_dois = set()
-        try:
-            with open(whitelist_path, 'r') as f:
-                for line in f:
-                    line = line.strip()
-                    if line and not line.startswith('#'):
-                        existing_dois.add(line)
-        except FileNotFoundError:
-            pass  # File doesn't exist yet, that's ok
-        
-        # Add new DOI if not already present
-        if doi not in existing_dois:
-            with open(whitelist_path, 'a') as f:
-                f.write(f"\n{doi}")
-            print(f"Added {doi} to whitelist")
-        else:
-            print(f"{doi} already in whitelist")
-            
+        import_model.registry_record(
+            doi, import_model.REGISTRY_HARVESTED, upstream_updated=upstream_updated
+        )
     except Exception as e:
-        print(f"Warning: Could not add DOI to whitelist: {e}")
-        # Don't fail the import if whitelist update fails
\ No newline at end of file
+        import_model.model.Session.rollback()
+        log.warning('Could not update registry for %s: %s', doi, e)
@@ -0,0 +1,99 @@
+"""
+Short-lived server-side store for DOI import previews
+
+The import form can fetch and map a DOI once, show the result, and create the
+dataset from the same mapping when the user confirms, without a second
+upstream call. Mapped metadata is kept in Redis under a random preview token
+for ckanext.doi_import.preview.ttl seconds (default 900). Without Redis the
+previews are kept in the memory of the worker that made them.
+"""
+
+import json
+import secrets
+import threading
+import time
+
+from ckanext.doi_import import upstream
+
+KEY_PREFIX = 'ckanext-doi_import:preview:'
+
+DEFAULT_TTL = 900
+
+_local = {}
+_local_lock = threading.Lock()
+
+
+def get_ttl():
+    return int(upstream.get_setting('preview.ttl', DEFAULT_TTL))
+
+
+def _redis():
+    try:
+        from ckan.lib.redis import connect_to_redis
+        conn = connect_to_redis()
+        conn.ping()
+        return conn
+    except Exception:
+        return None
+
+
+def store(user_name, doi_url, metadata, owner_org=None, contributing_organizations=None,
+          existing_dataset=None):
+    """Keep a mapped preview and return its token
+
+    existing_dataset is the dataset already imported from the DOI, if any;
+    its id, name and organization are kept so confirming updates it.
+    """
+    token = secrets.token_urlsafe(24)
+    if existing_dataset:
+        existing_dataset = {
+            key: existing_dataset.get(key) for key in ('id', 'name', 'owner_org')
+        }
+    payload = json.dumps({
+        'user': user_name,
+        'doi_url': doi_url,
+        'metadata': metadata,
+        'owner_org': owner_org,
+        'contributing_organizations': contributing_organizations or [],
+        'existing_dataset': existing_dataset or None,
+    })
+
+    conn = _redis()
+    if conn is not None:
+        conn.setex(KEY_PREFIX + token, get_ttl(), payload)
+    else:
+        with _local_lock:
+            now = time.time()
+            for key in [key for key, (expires, _) in _local.items() if expires < now]:
+                del _local[key]
+            _local[token] = (now + get_ttl(), payload)
+    return token
+
+
+def load(token, user_name):
+    """The preview stored under token for this user, or None if missing or expired"""
+    if not token:
+        return None
+
+    conn = _redis()
+    if conn is not None:
+        payload = conn.get(KEY_PREFIX + token)
+    else:
+        with _local_lock:
+            expires, payload = _local.get(token, (0, None))
+        if expires < time.time():
+            payload = None
+
+    if not payload:
+        return None
+    preview = json.loads(payload)
+    return preview if preview.get('user') == user_name else None
+
+
+def discard(token):
+    conn = _redis()
+    if conn is not None:
+        conn.delete(KEY_PREFIX + token)
+    else:
+        with _local_lock:
+            _local.pop(token, None)
@@ -0,0 +1,285 @@
+"""
+Per-host token-bucket rate limiter for upstream APIs
+
+Every upstream request (see upstream.get) takes a token from the bucket of
+its host first. Buckets live in Redis so all CKAN workers, background jobs
+and CLI runs share one budget per host; without Redis each process keeps its
+own buckets.
+
+The rate of a bucket adapts to what the upstream reports:
+
+- X-RateLimit-Remaining / X-RateLimit-Reset: spread the remaining requests
+  evenly until the reset, or wait for the reset when none are left
+- 429/503 with Retry-After: pause the host until then and halve the rate
+- hosts that send no rate-limit headers: slowly raise the rate after each
+  successful response, up to ratelimit.max_rate
+
+Settings (CKAN config or CKANEXT__DOI_IMPORT__* environment variables):
+
+    ckanext.doi_import.ratelimit.enabled    true
+    ckanext.doi_import.ratelimit.rate       initial requests/second per host
+    ckanext.doi_import.ratelimit.burst      bucket size
+    ckanext.doi_import.ratelimit.max_rate   upper bound for the adaptive rate
+    ckanext.doi_import.ratelimit.redis_url  for scripts outside CKAN
+"""
+
+import email.utils
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+KEY_PREFIX = 'ckanext-doi_import:ratelimit:'
+
+# Initial rates (requests/second) for known hosts, before any headers are seen
+HOST_RATES = {
+    'zenodo.org': 2.0,
+    'api.datacite.org': 5.0,
+    'oceanexpert.org': 1.0,
+}
+
+MIN_RATE = 0.05
+
+# Growth factor of the rate after a success from a host without rate-limit headers
+RATE_INCREASE = 1.05
+
+# Buckets idle for this long are dropped from Redis
+STATE_TTL = 3600
+
+# Takes one token, or returns how long to wait for one (as a string: Redis
+# truncates Lua numbers to integers)
+ACQUIRE_SCRIPT = """
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated', 'rate', 'blocked_until')
+local now = tonumber(ARGV[1])
+local burst = tonumber(ARGV[3])
+local rate = tonumber(state[3]) or tonumber(ARGV[2])
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+local blocked_until = tonumber(state[4]) or 0
+
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if now < blocked_until then
+  wait = blocked_until - now
+elseif tokens >= 1 then
+  tokens = tokens - 1
+else
+  wait = (1 - tokens) / rate
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now), 'rate', tostring(rate))
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[4]))
+return tostring(wait)
+"""
+
+
+def _setting(name):
+    from ckanext.doi_import import upstream
+    return upstream.get_setting(name)
+
+
+def is_enabled():
+    return str(_setting('ratelimit.enabled')).lower() in ('true', '1', 'yes', 'on')
+
+
+def host_of(url):
+    return (urlparse(url).hostname or '').lower()
+
+
+def initial_rate(host):
+    for known_host, rate in HOST_RATES.items():
+        if host == known_host or host.endswith('.' + known_host):
+            return rate
+    return float(_setting('ratelimit.rate'))
+
+
+class LocalBuckets(object):
+    """In-process buckets, used when Redis is not available"""
+
+    def __init__(self):
+        self._state = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, host, rate, burst):
+        now = time.time()
+        with self._lock:
+            state = self._state.setdefault(host, {
+                'tokens': burst, 'updated': now, 'rate': rate, 'blocked_until': 0
+            })
+            state['tokens'] = min(
+                burst, state['tokens'] + max(0, now - state['updated']) * state['rate']
+            )
+            state['updated'] = now
+            if now < state['blocked_until']:
+                return state['blocked_until'] - now
+            if state['tokens'] >= 1:
+                state['tokens'] -= 1
+                return 0
+            return (1 - state['tokens']) / state['rate']
+
+    def get_rate(self, host):
+        with self._lock:
+            state = self._state.get(host)
+            return state['rate'] if state else None
+
+    def update(self, host, rate=None, blocked_until=None):
+        with self._lock:
+            state = self._state.get(host)
+            if state is None:
+                return
+            if rate is not None:
+                state['rate'] = rate
+            if blocked_until is not None:
+                state['blocked_until'] = max(state['blocked_until'], blocked_until)
+
+
+class RedisBuckets(object):
+    """Buckets shared by every process through Redis"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._acquire = conn.register_script(ACQUIRE_SCRIPT)
+
+    def acquire(self, host, rate, burst):
+        return float(self._acquire(
+            keys=[KEY_PREFIX + host], args=[time.time(), rate, burst, STATE_TTL]
+        ))
+
+    def get_rate(self, host):
+        value = self.conn.hget(KEY_PREFIX + host, 'rate')
+        return float(value) if value else None
+
+    def update(self, host, rate=None, blocked_until=None):
+        key = KEY_PREFIX + host
+        if rate is not None:
+            self.conn.hset(key, 'rate', str(rate))
+        if blocked_until is not None:
+            current = self.conn.hget(key, 'blocked_until')
+            if not current or float(current) < blocked_until:
+                self.conn.hset(key, 'blocked_until', str(blocked_until))
+        self.conn.expire(key, STATE_TTL)
+
+
+_buckets = None
+_buckets_pid = None
+_buckets_lock = threading.Lock()
+
+
+def _connect_redis():
+    redis_url = _setting('ratelimit.redis_url') or os.environ.get('CKAN_REDIS_URL')
+    if not redis_url:
+        try:
+            from ckan.lib.redis import connect_to_redis
+            return connect_to_redis()
+        except Exception:
+            return None
+    try:
+        import redis
+        return redis.Redis.from_url(redis_url)
+    except Exception:
+        return None
+
+
+def get_buckets():
+    """Redis-backed buckets when Redis answers, in-process ones otherwise"""
+    global _buckets, _buckets_pid
+
+    pid = os.getpid()
+    if _buckets is None or _buckets_pid != pid:
+        with _buckets_lock:
+            if _buckets is None or _buckets_pid != pid:
+                buckets = None
+                conn = _connect_redis()
+                if conn is not None:
+                    try:
+                        conn.ping()
+                        buckets = RedisBuckets(conn)
+                    except Exception:
+                        buckets = None
+                _buckets = buckets or LocalBuckets()
+                _buckets_pid = pid
+    return _buckets
+
+
+def acquire(url):
+    """Block until a request to the host of url is allowed"""
+    if not is_enabled():
+        return
+
+    host = host_of(url)
+    burst = float(_setting('ratelimit.burst'))
+    rate = initial_rate(host)
+
+    while True:
+        try:
+            wait = get_buckets().acquire(host, rate, burst)
+        except Exception:
+            # Never let a Redis hiccup block upstream calls
+            return
+        if wait <= 0:
+            return
+        time.sleep(min(wait, float(_setting('http.read_timeout'))))
+
+
+def parse_retry_after(value, now=None):
+    """Seconds to wait from a Retry-After header (delta seconds or HTTP date)"""
+    if not value:
+        return None
+    now = time.time() if now is None else now
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - now)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_reset(value, now=None):
+    """Epoch time of an X-RateLimit-Reset header (epoch or delta seconds)"""
+    if not value:
+        return None
+    now = time.time() if now is None else now
+    try:
+        reset = float(value)
+    except ValueError:
+        return None
+    # Small values are a number of seconds, large ones an epoch timestamp
+    return reset if reset > 10 ** 9 else now + reset
+
+
+def observe(url, response):
+    """Tune the bucket of the host of url from an upstream response"""
+    if not is_enabled() or response is None:
+        return
+
+    host = host_of(url)
+    now = time.time()
+    max_rate = float(_setting('ratelimit.max_rate'))
+    headers = response.headers
+
+    try:
+        buckets = get_buckets()
+        rate = buckets.get_rate(host) or initial_rate(host)
+
+        if response.status_code in (429, 503):
+            retry_after = parse_retry_after(headers.get('Retry-After'), now)
+            if retry_after is None:
+                retry_after = 1 / rate
+            buckets.update(host, rate=max(MIN_RATE, rate / 2), blocked_until=now + retry_after)
+            return
+
+        remaining = headers.get('X-RateLimit-Remaining')
+        reset_at = parse_reset(headers.get('X-RateLimit-Reset'), now)
+        if remaining is not None and reset_at is not None:
+            remaining = int(float(remaining))
+            if remaining <= 0:
+                buckets.update(host, blocked_until=reset_at)
+            else:
+                window = max(reset_at - now, 1.0)
+                buckets.update(host, rate=min(max_rate, max(MIN_RATE, remaining / window)))
+        elif response.status_code < 400 and rate < max_rate:
+            buckets.update(host, rate=min(max_rate, rate * RATE_INCREASE))
+    except Exception:
+        pass
@@ -0,0 +1,65 @@
+"""
+Stub upstream HTTP server shared by the upstream, cache and rate limit tests
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from ckanext.doi_import import ratelimit, upstream
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers GETs with server.responses, one (status, headers, body) each
+
+    The last response is repeated once the others are used up. Requests are
+    recorded with their headers and client address.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requests.append({
+            'path': self.path,
+            'headers': dict(self.headers),
+            'client': self.client_address,
+        })
+        responses = self.server.responses
+        status, headers, body = responses.pop(0) if len(responses) > 1 else responses[0]
+        if not isinstance(body, (str, bytes)):
+            body = json.dumps(body)
+        payload = body.encode('utf-8') if isinstance(body, str) else body
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server(monkeypatch, tmp_path):
+    """Local upstream with no retries, no rate limiting and a private cache file"""
+    monkeypatch.setenv('CKANEXT__DOI_IMPORT__RATELIMIT__ENABLED', 'false')
+    monkeypatch.setenv('CKANEXT__DOI_IMPORT__HTTP__RETRIES', '0')
+    monkeypatch.setenv('CKANEXT__DOI_IMPORT__HTTP__BACKOFF_FACTOR', '0')
+    monkeypatch.setenv('CKANEXT__DOI_IMPORT__CACHE__PATH', str(tmp_path / 'cache.sqlite'))
+    monkeypatch.setattr(upstream, '_response_cache', None)
+    monkeypatch.setattr(ratelimit, '_buckets', None)
+    upstream.reset_session()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.requests = []
+    server.responses = [(200, {'Content-Type': 'application/json'}, {})]
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = f'http://127.0.0.1:{server.server_port}'
+    yield server
+    upstream.reset_session()
+    server.shutdown()
+    server.server_close()
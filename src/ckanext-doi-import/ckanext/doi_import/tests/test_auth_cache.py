@@ -0,0 +1,92 @@
+"""
+Tests for auth_cache.py, the per-worker cache of validated API tokens.
+"""
+import time
+
+import pytest
+
+from ckanext.doi_import import auth_cache
+
+
+class FakeRedis(object):
+    """The two commands the generation counter uses"""
+
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def incr(self, key):
+        self.values[key] = int(self.values.get(key) or 0) + 1
+        return self.values[key]
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    conn = FakeRedis()
+    monkeypatch.setattr(auth_cache, '_redis', lambda: conn)
+    monkeypatch.setattr(auth_cache, '_entries', {})
+    monkeypatch.delenv('CKANEXT__DOI_IMPORT__AUTH_CACHE__TTL', raising=False)
+    return conn
+
+
+def test_validated_token_is_cached(redis):
+    auth_cache.store('token', 'user-id', 'harvester', True)
+
+    entry = auth_cache.get('token')
+    assert (entry.user_id, entry.user_name, entry.authorized) == ('user-id', 'harvester', True)
+    assert auth_cache.get('other') is None
+
+
+def test_entry_expires_after_ttl(redis, monkeypatch):
+    monkeypatch.setenv('CKANEXT__DOI_IMPORT__AUTH_CACHE__TTL', '60')
+    auth_cache.store('token', 'user-id', 'harvester', True)
+
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 61)
+    assert auth_cache.get('token') is None
+
+
+def test_zero_ttl_disables_the_cache(redis, monkeypatch):
+    monkeypatch.setenv('CKANEXT__DOI_IMPORT__AUTH_CACHE__TTL', '0')
+    auth_cache.store('token', 'user-id', 'harvester', True)
+    assert auth_cache.get('token') is None
+
+
+def test_generation_bump_from_another_worker_drops_entries(redis):
+    auth_cache.store('token', 'user-id', 'harvester', True)
+
+    redis.incr(auth_cache.GENERATION_KEY)
+    assert auth_cache.get('token') is None
+
+
+def test_token_revoke_invalidates(redis):
+    auth_cache.store('token', 'user-id', 'harvester', True)
+    revoked = []
+
+    def original_revoke(context, data_dict):
+        revoked.append(data_dict['token'])
+        return None
+
+    auth_cache.api_token_revoke(original_revoke, {}, {'token': 'token'})
+
+    assert revoked == ['token']
+    assert auth_cache.get('token') is None
+    assert redis.get(auth_cache.GENERATION_KEY) == 1
+
+
+def test_invalidate_without_redis_clears_this_worker(monkeypatch):
+    monkeypatch.setattr(auth_cache, '_redis', lambda: None)
+    monkeypatch.setattr(auth_cache, '_entries', {})
+    auth_cache.store('token', 'user-id', 'harvester', True)
+    assert auth_cache.get('token') is not None
+
+    auth_cache.invalidate()
+    assert auth_cache.get('token') is None
+
+
+def test_membership_and_user_changes_are_chained():
+    assert set(auth_cache.chained_actions) == {
+        'api_token_revoke', 'user_update', 'user_delete', 'member_create', 'member_delete'
+    }
@@ -0,0 +1,112 @@
+"""
+Tests for the doi_import_batch action.
+
+Upstream fetches and CKAN writes are replaced with monkeypatched functions,
+so only the batch logic (statuses, summary, contexts) is exercised.
+"""
+import pytest
+
+import ckan.plugins.toolkit as toolkit
+
+from ckanext.doi_import import plugin
+
+NEW = '10.5281/zenodo.1'
+CHANGED = '10.5281/zenodo.2'
+SAME = '10.5281/zenodo.3'
+BROKEN = '10.5281/zenodo.4'
+
+
+def mapped(record_id, title):
+    return {
+        'title': title,
+        'url': f'https://zenodo.org/record/{record_id}',
+        'doi': f'https://doi.org/10.5281/zenodo.{record_id}',
+        'tag_string': 'a,b',
+    }
+
+
+@pytest.fixture
+def batch(monkeypatch):
+    """Fake upstream and CKAN; returns the list of writes made"""
+    records = {
+        NEW: mapped(1, 'New'),
+        CHANGED: mapped(2, 'Changed upstream'),
+        SAME: mapped(3, 'Same'),
+    }
+    existing = {
+        records[CHANGED]['url']: {'id': 'id-2', 'name': 'changed', 'title': 'Changed',
+                                  'owner_org': 'org', 'metadata_hash': 'old'},
+        records[SAME]['url']: {'id': 'id-3', 'name': 'same', 'title': 'Same',
+                               'owner_org': 'org',
+                               'metadata_hash': plugin.metadata_hash(dict(records[SAME]))},
+    }
+
+    def fetch(doi, datacite_records=None, revalidate=False):
+        if doi not in records:
+            raise toolkit.ValidationError({'doi': 'not found'})
+        return dict(records[doi])
+
+    writes = []
+
+    def create(context, data_dict):
+        writes.append((dict(context), data_dict))
+        # CKAN actions leave state behind in the context they were given
+        context['package'] = 'stale'
+        metadata = data_dict['metadata']
+        return {'id': metadata.get('id', 'new-id'), 'name': metadata.get('name', 'new'),
+                'title': metadata['title']}
+
+    monkeypatch.setattr(toolkit, 'check_access', lambda *args, **kwargs: True)
+    monkeypatch.setattr(plugin, 'fetch_datacite_records', lambda dois: {})
+    monkeypatch.setattr(plugin, 'fetch_doi_metadata', fetch)
+    monkeypatch.setattr(plugin, '_find_existing_datasets',
+                        lambda context, urls: {url: existing[url] for url in urls if url in existing})
+    monkeypatch.setattr(plugin, 'doi_create_dataset', create)
+    return writes
+
+
+def test_batch_statuses(batch):
+    result = plugin.doi_import_batch({'user': 'harvester'}, {
+        'dois': [f'https://doi.org/{NEW}', CHANGED, SAME, BROKEN, 'not a doi'],
+    })
+
+    assert [r['status'] for r in result['results']] == [
+        'created', 'updated', 'unchanged', 'failed', 'failed'
+    ]
+    assert result['summary'] == {'created': 1, 'updated': 1, 'unchanged': 1, 'failed': 2}
+    assert result['results'][0]['doi'] == f'https://doi.org/{NEW}'
+    assert result['results'][1]['dataset']['id'] == 'id-2'
+    assert result['results'][2]['dataset']['id'] == 'id-3'
+    assert result['results'][4]['error'] == 'Invalid DOI URL format'
+
+    # Updates keep the id and name of the existing dataset
+    updated = batch[1][1]['metadata']
+    assert (updated['id'], updated['name']) == ('id-2', 'changed')
+
+
+def test_batch_force_does_not_rewrite_same_hash(batch):
+    result = plugin.doi_import_batch({'user': 'harvester'}, {'dois': [SAME], 'force': True})
+    assert result['results'][0]['status'] == 'unchanged'
+    assert batch == []
+
+
+def test_every_write_gets_a_fresh_context(batch):
+    plugin.doi_import_batch({'user': 'harvester', 'ignore_auth': False}, {
+        'dois': [NEW, CHANGED],
+    })
+
+    assert len(batch) == 2
+    for context, data_dict in batch:
+        assert context == {'user': 'harvester', 'ignore_auth': False}
+
+
+def test_batch_requires_dois(batch):
+    with pytest.raises(toolkit.ValidationError):
+        plugin.doi_import_batch({'user': 'harvester'}, {'dois': []})
+
+
+def test_batch_size_limit(batch):
+    with pytest.raises(toolkit.ValidationError):
+        plugin.doi_import_batch({'user': 'harvester'}, {
+            'dois': [NEW] * (plugin.MAX_BATCH_SIZE + 1)
+        })
@@ -0,0 +1,90 @@
+"""
+Tests for cache.py and the conditional GETs of upstream.get_cached_json.
+"""
+import time
+
+from ckanext.doi_import import cache, upstream
+
+RECORD = (200, {'Content-Type': 'application/json', 'ETag': '"v1"',
+                'Last-Modified': 'Mon, 03 Jun 2024 10:00:00 GMT'}, {'id': 1, 'title': 'Record'})
+
+
+def test_entry_freshness(tmp_path, monkeypatch):
+    response_cache = cache.ResponseCache(str(tmp_path / 'cache.sqlite'))
+    response_cache.set('key', '{}', etag='"v1"')
+
+    entry = response_cache.get('key')
+    assert entry.is_fresh(60)
+
+    monkeypatch.setattr(time, 'time', lambda: entry.fetched_at + 61)
+    assert not entry.is_fresh(60)
+    assert entry.conditional_headers() == {'If-None-Match': '"v1"'}
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, monkeypatch):
+    response_cache = cache.ResponseCache(str(tmp_path / 'cache.sqlite'), max_entries=2)
+    clock = iter(range(1000, 2000))
+    monkeypatch.setattr(time, 'time', lambda: next(clock))
+
+    response_cache.set('a', 'A')
+    response_cache.set('b', 'B')
+    response_cache.get('a')  # b is now the least recently used
+    response_cache.set('c', 'C')
+
+    assert response_cache.get('b') is None
+    assert response_cache.get('a').body == 'A'
+    assert response_cache.get('c').body == 'C'
+
+
+def test_fresh_entry_is_served_without_request(stub_server):
+    stub_server.responses = [RECORD]
+    url = stub_server.url + '/api/records/1'
+
+    assert upstream.get_cached_json(url) == {'id': 1, 'title': 'Record'}
+    assert upstream.get_cached_json(url) == {'id': 1, 'title': 'Record'}
+    assert len(stub_server.requests) == 1
+
+
+def test_stale_entry_is_revalidated_with_304(stub_server):
+    stub_server.responses = [RECORD, (304, {}, '')]
+    url = stub_server.url + '/api/records/1'
+
+    assert upstream.get_cached_json(url, ttl=0) == {'id': 1, 'title': 'Record'}
+    assert upstream.get_cached_json(url, ttl=0) == {'id': 1, 'title': 'Record'}
+
+    revalidation = stub_server.requests[1]['headers']
+    assert revalidation['If-None-Match'] == '"v1"'
+    assert revalidation['If-Modified-Since'] == 'Mon, 03 Jun 2024 10:00:00 GMT'
+
+
+def test_changed_record_replaces_entry(stub_server):
+    stub_server.responses = [
+        RECORD,
+        (200, {'Content-Type': 'application/json', 'ETag': '"v2"'}, {'id': 1, 'title': 'New'}),
+    ]
+    url = stub_server.url + '/api/records/1'
+
+    upstream.get_cached_json(url, ttl=0)
+    assert upstream.get_cached_json(url, ttl=0) == {'id': 1, 'title': 'New'}
+    assert upstream.get_cached_json(url) == {'id': 1, 'title': 'New'}
+    assert len(stub_server.requests) == 2
+
+
+def test_query_parameters_are_part_of_the_key(stub_server):
+    url = stub_server.url + '/api/records'
+
+    upstream.get_cached_json(url, params={'q': 'a'})
+    upstream.get_cached_json(url, params={'q': 'b'})
+    upstream.get_cached_json(url, params={'q': 'a'})
+    assert [request['path'] for request in stub_server.requests] == [
+        '/api/records?q=a', '/api/records?q=b'
+    ]
+
+
+def test_disabled_cache_always_fetches(stub_server, monkeypatch):
+    monkeypatch.setenv('CKANEXT__DOI_IMPORT__CACHE__ENABLED', 'false')
+    url = stub_server.url + '/api/records/1'
+
+    upstream.get_cached_json(url)
+    upstream.get_cached_json(url)
+    assert len(stub_server.requests) == 2
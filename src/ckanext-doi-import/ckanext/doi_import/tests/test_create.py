@@ -0,0 +1,118 @@
+"""
+Tests for map_zenodo_to_schema's file handling and doi_create_dataset.
+
+package_create/package_update and the side tables are replaced with
+monkeypatched functions that record what would be written.
+"""
+import pytest
+
+import ckan.plugins.toolkit as toolkit
+
+from ckanext.doi_import import plugin
+from ckanext.doi_import import model as import_model
+
+
+def zenodo_record(file_count):
+    return {
+        'id': 42,
+        'record_id': 42,
+        'doi': '10.5281/zenodo.42',
+        'metadata': {'title': 'Many files', 'resource_type': {'type': 'dataset'}},
+        'files': [
+            {'key': f'part-{i}.csv', 'size': 10, 'checksum': f'md5:{i}', 'type': 'csv'}
+            for i in range(file_count)
+        ],
+    }
+
+
+@pytest.fixture
+def ckan(monkeypatch):
+    """Fake package actions and side tables; returns what was written"""
+    written = {'packages': [], 'manifests': {}, 'registry': []}
+
+    def package_write(context, data_dict):
+        written['packages'].append(dict(data_dict))
+        return dict(data_dict, id=data_dict.get('id', 'new-id'))
+
+    def replace_file_manifest(package_id, files):
+        written['manifests'][package_id] = files
+
+    def registry_record(doi, status, upstream_updated=None, error=None):
+        written['registry'].append((doi, status, upstream_updated))
+
+    monkeypatch.setattr(toolkit, 'get_action', lambda name: package_write)
+    monkeypatch.setattr(import_model, 'replace_file_manifest', replace_file_manifest)
+    monkeypatch.setattr(import_model, 'registry_record', registry_record)
+    return written
+
+
+def test_few_files_become_resources():
+    mapped = plugin.map_zenodo_to_schema(zenodo_record(3), '10.5281/zenodo.42')
+
+    assert 'file_manifest' not in mapped
+    assert [r['name'] for r in mapped['resources']] == [
+        'Zenodo Record', 'part-0.csv', 'part-1.csv', 'part-2.csv'
+    ]
+
+
+def test_many_files_become_a_manifest(monkeypatch):
+    monkeypatch.setitem(toolkit.config, 'ckanext.doi_import.max_file_resources', '5')
+
+    mapped = plugin.map_zenodo_to_schema(zenodo_record(6), '10.5281/zenodo.42')
+
+    assert len(mapped['file_manifest']) == 6
+    assert mapped['file_manifest'][0] == {
+        'name': 'part-0.csv', 'size': 10, 'checksum': 'md5:0',
+        'url': 'https://zenodo.org/record/42/files/part-0.csv',
+    }
+    assert [r['name'] for r in mapped['resources']] == ['Zenodo Record', 'All files (6)']
+    assert mapped['resources'][1]['url'] == 'https://zenodo.org/records/42/files-archive'
+
+
+def test_manifest_is_stored_outside_the_package(ckan, monkeypatch):
+    monkeypatch.setitem(toolkit.config, 'ckanext.doi_import.max_file_resources', '5')
+    mapped = plugin.map_zenodo_to_schema(zenodo_record(6), '10.5281/zenodo.42')
+
+    dataset = plugin.doi_create_dataset({'user': 'harvester'}, {'metadata': mapped})
+
+    assert 'file_manifest' not in ckan['packages'][0]
+    assert len(ckan['manifests'][dataset['id']]) == 6
+
+
+def test_update_clears_a_stale_manifest(ckan):
+    mapped = plugin.map_zenodo_to_schema(zenodo_record(2), '10.5281/zenodo.42')
+    mapped.update(id='id-42', name='many-files')
+
+    plugin.doi_create_dataset({'user': 'harvester'}, {'metadata': mapped})
+
+    assert ckan['manifests'] == {'id-42': None}
+
+
+def test_create_without_manifest_leaves_the_table_alone(ckan):
+    mapped = plugin.map_zenodo_to_schema(zenodo_record(2), '10.5281/zenodo.42')
+
+    plugin.doi_create_dataset({'user': 'harvester'}, {'metadata': mapped})
+
+    assert ckan['manifests'] == {}
+
+
+def test_created_dataset_is_recorded_as_harvested(ckan):
+    record = dict(zenodo_record(1), updated='2024-06-01T10:00:00+00:00')
+    mapped = plugin.map_zenodo_to_schema(record, 'https://doi.org/10.5281/zenodo.42')
+
+    plugin.doi_create_dataset({'user': 'harvester'}, {'metadata': mapped})
+
+    assert ckan['registry'] == [
+        ('10.5281/zenodo.42', import_model.REGISTRY_HARVESTED, '2024-06-01T10:00:00+00:00')
+    ]
+
+
+def test_datacite_dataset_is_recorded_by_identifier(ckan):
+    metadata = {
+        'title': 'Report',
+        'identifier': {'propertyID': 'DOI', 'value': '10.1234/ABC'},
+    }
+
+    plugin.doi_create_dataset({'user': 'harvester'}, {'metadata': metadata})
+
+    assert [doi for doi, status, updated in ckan['registry']] == ['10.1234/abc']
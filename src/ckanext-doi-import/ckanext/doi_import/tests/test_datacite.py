@@ -0,0 +1,129 @@
+"""
+Tests for the DataCite path: multi-DOI fetches and the mapping to the schema.
+"""
+import json
+
+import pytest
+
+import ckan.plugins.toolkit as toolkit
+
+from ckanext.doi_import import plugin, upstream
+
+RECORD = {
+    'id': '10.1594/pangaea.123',
+    'attributes': {
+        'doi': '10.1594/PANGAEA.123',
+        'url': 'https://doi.pangaea.de/10.1594/PANGAEA.123',
+        'titles': [{'title': 'Plankton counts'}],
+        'descriptions': [
+            {'description': 'Methods', 'descriptionType': 'Methods'},
+            {'description': 'Counts of plankton', 'descriptionType': 'Abstract'},
+        ],
+        'subjects': [{'subject': 'plankton'}, {'subject': 'Baltic Sea'}, {}],
+        'types': {'resourceTypeGeneral': 'Dataset', 'schemaOrg': 'Dataset'},
+        'publisher': {'name': 'PANGAEA'},
+        'publicationYear': 2021,
+        'dates': [{'date': '2021-03-04', 'dateType': 'Issued'},
+                  {'date': '2019-05/2019-09', 'dateType': 'Collected'}],
+        'created': '2021-03-04T10:00:00Z',
+        'updated': '2024-01-02T10:00:00Z',
+        'rightsList': [{'rightsIdentifier': 'cc-by-4.0'}],
+        'creators': [{
+            'name': 'Doe, Jane',
+            'affiliation': [{'name': 'VLIZ'}, 'Ghent University'],
+            'nameIdentifiers': [{'nameIdentifier': 'https://orcid.org/0000-0001',
+                                 'nameIdentifierScheme': 'ORCID'}],
+        }],
+        'contributors': [{'name': 'Roe, Rick', 'contributorType': 'DataCurator'}],
+        'fundingReferences': [{'funderName': 'EU', 'awardNumber': '123'}],
+        'contentUrl': ['https://download.pangaea.de/dataset/123/counts.tab'],
+    },
+}
+
+
+def test_datacite_record_is_mapped_to_the_schema():
+    mapped = plugin.map_datacite_to_schema(RECORD, '10.1594/pangaea.123')
+
+    assert mapped['title'] == 'Plankton counts'
+    assert mapped['notes'] == 'Counts of plankton'
+    assert mapped['doi'] == 'https://doi.org/10.1594/pangaea.123'
+    assert mapped['identifier']['value'] == '10.1594/pangaea.123'
+    assert mapped['license_id'] == 'cc-by'
+    assert mapped['tag_string'] == 'plankton,Baltic Sea'
+    assert mapped['product_type'] == ['dataset']
+    assert mapped['resource_type'] == 'https://schema.org/Dataset'
+    assert mapped['publisher_name'] == 'PANGAEA'
+    assert mapped['date_published'] == '2021-03-04'
+    assert mapped['date_modified'] == '2024-01-02T10:00:00Z'
+    assert mapped['temporal_coverage'] == '2019-05/2019-09'
+
+    assert json.loads(mapped['authors']) == [{
+        'name': 'Doe, Jane', 'affiliation': 'VLIZ, Ghent University', 'email': '',
+        'orcid': 'https://orcid.org/0000-0001',
+    }]
+    assert json.loads(mapped['contributors'])[0]['type'] == 'DataCurator'
+    assert json.loads(mapped['funding'])[0]['grant_id'] == '123'
+
+    assert [r['url'] for r in mapped['resources']] == [
+        'https://doi.pangaea.de/10.1594/PANGAEA.123',
+        'https://download.pangaea.de/dataset/123/counts.tab',
+    ]
+    assert {'key': 'source', 'value': 'datacite'} in mapped['extras']
+
+
+def test_sparse_record_falls_back_to_defaults():
+    mapped = plugin.map_datacite_to_schema(
+        {'data': {'attributes': {'publicationYear': 2020}}}, '10.1234/abc'
+    )
+
+    assert mapped['title'] == 'Untitled Dataset'
+    assert mapped['license_id'] == 'notspecified'
+    assert mapped['date_published'] == '2020'
+    assert mapped['resources'][0]['url'] == 'https://doi.org/10.1234/abc'
+    assert 'authors' not in mapped
+
+
+@pytest.mark.parametrize('resource_type, product_type', [
+    ('JournalArticle', ['publication']),
+    ('Image', ['image']),
+    ('Audiovisual', ['video']),
+])
+def test_resource_types(resource_type, product_type):
+    assert plugin.map_datacite_resource_type(resource_type) == product_type
+
+
+class FakeDataCite(object):
+    """Pages through canned result pages; records the params of each request"""
+
+    def __init__(self, pages):
+        self.pages = list(pages)
+        self.requests = []
+
+    def get_json(self, url, params=None, **kwargs):
+        self.requests.append((url, params))
+        return self.pages.pop(0)
+
+
+def test_records_are_fetched_in_batches_following_pages(monkeypatch):
+    dois = [f'10.1234/{i}' for i in range(plugin.DATACITE_BATCH_SIZE + 1)]
+    fake = FakeDataCite([
+        {'data': [{'attributes': {'doi': '10.1234/0'}}], 'links': {'next': 'https://next-page'}},
+        {'data': [{'attributes': {'doi': '10.1234/1'}}], 'links': {}},
+        {'data': [], 'links': {}},
+    ])
+    monkeypatch.setattr(upstream, 'get_json', fake.get_json)
+
+    records = plugin.fetch_datacite_records(dois + [None, dois[0]])
+
+    assert sorted(records) == ['10.1234/0', '10.1234/1']
+    assert len(fake.requests) == 3
+    assert fake.requests[0][1]['query'].count(' OR ') == plugin.DATACITE_BATCH_SIZE - 1
+    assert fake.requests[1] == ('https://next-page', None)
+    assert fake.requests[2][1]['query'].count('"') == 2
+
+
+def test_unknown_datacite_doi(monkeypatch):
+    monkeypatch.setattr(upstream, 'get_json', lambda url, params=None, **kwargs: {'data': []})
+
+    with pytest.raises(toolkit.ValidationError):
+        plugin.fetch_datacite_metadata('10.1234/missing')
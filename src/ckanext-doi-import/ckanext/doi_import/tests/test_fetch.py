@@ -0,0 +1,113 @@
+"""
+Tests for fetch_doi_metadata: how many upstream requests each kind of DOI costs.
+"""
+import pytest
+
+import ckan.plugins.toolkit as toolkit
+
+from ckanext.doi_import import plugin, upstream
+
+RECORD = {
+    'id': 12345,
+    'doi': '10.5281/zenodo.12345',
+    'conceptdoi': '10.5281/zenodo.12344',
+    'updated': '2024-06-01T10:00:00+00:00',
+    'metadata': {
+        'title': 'Fish counts',
+        'description': 'Counts of fish',
+        'creators': [{'name': 'Doe, Jane', 'affiliation': 'VLIZ'}],
+        'keywords': ['fish'],
+        'resource_type': {'type': 'dataset'},
+        'license': {'id': 'cc-by-4.0'},
+    },
+    'files': [{'key': 'counts.csv', 'size': 10, 'type': 'csv'}],
+}
+
+
+class FakeUpstream(object):
+    """Records (url, params) of each request and answers from a {url: body} dict"""
+
+    def __init__(self):
+        self.requests = []
+        self.answers = {}
+
+    def get_json(self, url, params=None, **kwargs):
+        self.requests.append((url, params))
+        return self.answers.get(url, {})
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    fake = FakeUpstream()
+    monkeypatch.setattr(upstream, 'get_json', fake.get_json)
+    monkeypatch.setattr(upstream, 'get_cached_json', fake.get_json)
+    return fake
+
+
+def test_zenodo_doi_is_one_request(fake):
+    fake.answers['https://zenodo.org/api/records/12345'] = dict(RECORD)
+
+    metadata = plugin.fetch_doi_metadata('10.5281/zenodo.12345')
+
+    assert fake.requests == [('https://zenodo.org/api/records/12345', None)]
+    assert metadata['title'] == 'Fish counts'
+    assert metadata['identifier']['value'] == '10.5281/zenodo.12345'
+    assert metadata['concept_doi'] == 'https://doi.org/10.5281/zenodo.12344'
+
+
+def test_datacite_doi_deposited_on_zenodo_uses_zenodo_record(fake):
+    fake.answers[plugin.DATACITE_API_URL] = {'data': [{
+        'attributes': {'doi': '10.1234/ABC', 'url': 'https://zenodo.org/records/12345'},
+    }]}
+    fake.answers['https://zenodo.org/api/records/12345'] = dict(RECORD)
+
+    metadata = plugin.fetch_doi_metadata('10.1234/abc')
+
+    assert [url for url, params in fake.requests] == [
+        plugin.DATACITE_API_URL, 'https://zenodo.org/api/records/12345'
+    ]
+    assert metadata['zenodo_record_id'] == '12345'
+
+
+def test_zenodo_search_hit_is_mapped_without_second_request(fake):
+    fake.answers['https://zenodo.org/api/records'] = {
+        'hits': {'hits': [dict(RECORD)]}
+    }
+
+    metadata = plugin.fetch_doi_metadata('10.1000/crossref.1')
+
+    assert [url for url, params in fake.requests] == [
+        plugin.DATACITE_API_URL, 'https://zenodo.org/api/records'
+    ]
+    assert fake.requests[1][1] == {'q': 'doi:"10.1000/crossref.1"'}
+    assert metadata['url'] == 'https://zenodo.org/record/12345'
+
+
+def test_prefetched_datacite_records_skip_the_datacite_request(fake):
+    record = {'attributes': {'doi': '10.1234/abc', 'titles': [{'title': 'Report'}]}}
+
+    metadata = plugin.fetch_doi_metadata('10.1234/abc', {'10.1234/abc': record})
+
+    assert fake.requests == []
+    assert metadata['title'] == 'Report'
+
+
+def test_unknown_doi(fake):
+    with pytest.raises(toolkit.ValidationError):
+        plugin.fetch_doi_metadata('10.1000/unknown')
+
+
+def test_revalidate_bypasses_the_cache_ttl(monkeypatch):
+    ttls = []
+
+    def get_cached_json(url, params=None, ttl=None, **kwargs):
+        ttls.append(ttl)
+        return dict(RECORD)
+
+    monkeypatch.setattr(upstream, 'get_cached_json', get_cached_json)
+
+    plugin.fetch_doi_metadata('10.5281/zenodo.12345')
+    plugin.fetch_doi_metadata('10.5281/zenodo.12345', revalidate=True)
+
+    # None: the configured TTL; 0: always a conditional request
+    assert ttls == [None, 0]
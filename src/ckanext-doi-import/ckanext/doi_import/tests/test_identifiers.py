@@ -0,0 +1,63 @@
+"""
+Tests for identifiers.py, the canonical DOI handling.
+"""
+import pytest
+
+from ckanext.doi_import import identifiers
+
+
+@pytest.mark.parametrize('value', [
+    '10.5281/zenodo.12345',
+    'https://doi.org/10.5281/zenodo.12345',
+    'http://dx.doi.org/10.5281/zenodo.12345',
+    'doi:10.5281/zenodo.12345',
+    'DOI: 10.5281/ZENODO.12345',
+    'https://zenodo.org/record/12345',
+    'https://zenodo.org/records/12345',
+    'https://zenodo.org/api/records/12345',
+    'https://zenodo.org/records/12345?download=1',
+    'https://zenodo.org/records/12345#files',
+    'https://doi.org/10.5281/zenodo.12345?utm_source=mail',
+    'https://doi.org/10.5281%2Fzenodo.12345',
+    '  https://doi.org/10.5281/zenodo.12345/  ',
+])
+def test_spellings_of_one_zenodo_doi(value):
+    assert identifiers.normalize_doi(value) == '10.5281/zenodo.12345'
+    assert identifiers.zenodo_record_id(value) == '12345'
+
+
+def test_other_dois_are_lowercased():
+    assert identifiers.normalize_doi('https://doi.org/10.1594/PANGAEA.123') == '10.1594/pangaea.123'
+    assert identifiers.zenodo_record_id('10.1594/PANGAEA.123') is None
+
+
+@pytest.mark.parametrize('value', [None, '', 'not a doi', 'https://example.org/10', 42])
+def test_not_a_doi(value):
+    assert identifiers.normalize_doi(value) is None
+    assert identifiers.canonicalize(value) is None
+
+
+def test_canonical_url():
+    canonical = identifiers.canonicalize('doi:10.5281/zenodo.2', concept_doi='10.5281/zenodo.1')
+    assert canonical == ('10.5281/zenodo.2', '2', '10.5281/zenodo.1')
+    assert canonical.url == 'https://doi.org/10.5281/zenodo.2'
+    assert canonical.is_zenodo
+
+
+def test_from_zenodo_record():
+    canonical = identifiers.from_zenodo_record({'id': 7, 'conceptrecid': '6'})
+    assert canonical == ('10.5281/zenodo.7', '7', '10.5281/zenodo.6')
+
+    # A DOI minted elsewhere keeps it, with the Zenodo record id
+    canonical = identifiers.from_zenodo_record({'id': 7, 'doi': '10.1234/ABC'})
+    assert canonical == ('10.1234/abc', '7', None)
+
+
+def test_normalize_many_drops_duplicates_and_collects_invalid():
+    invalid = []
+    canonical = identifiers.normalize_many([
+        'https://zenodo.org/records/1', '10.5281/zenodo.1', 'nonsense', 'doi:10.1234/x',
+    ], invalid)
+
+    assert [c.doi for c in canonical] == ['10.5281/zenodo.1', '10.1234/x']
+    assert invalid == ['nonsense']
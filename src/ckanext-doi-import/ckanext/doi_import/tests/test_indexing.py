@@ -0,0 +1,131 @@
+"""
+Tests for indexing.py, with Solr replaced by a recorder.
+
+Writes are notified through CKAN's own dispatch (the domain object
+modification extension and the synchronous_search plugin), so the tests see
+whether a package write would be indexed right away.
+"""
+import threading
+
+import pytest
+
+from ckan import model, plugins
+from ckan.lib import search
+from ckan.model.modification import DomainObjectModificationExtension
+
+from ckanext.doi_import import indexing
+
+
+class RecordingIndex(object):
+    """Package index recording the ids sent to Solr per write"""
+
+    def __init__(self, calls):
+        self.calls = calls
+
+    def insert_dict(self, pkg_dict):
+        self.calls['indexed'].append(pkg_dict['id'])
+
+    update_dict = insert_dict
+
+    def remove_dict(self, pkg_dict):
+        self.calls['removed'].append(pkg_dict['id'])
+
+
+@pytest.fixture
+def solr(monkeypatch):
+    """Per-write index calls, bulk reindex calls as package id lists, and commits"""
+    calls = {'indexed': [], 'removed': [], 'rebuilt': [], 'commits': 0}
+
+    def rebuild(package_ids=None, defer_commit=False, quiet=False):
+        assert defer_commit
+        calls['rebuilt'].append(list(package_ids))
+
+    def commit():
+        calls['commits'] += 1
+
+    monkeypatch.setattr(
+        plugins, 'PluginImplementations', lambda interface: [search.SynchronousSearchPlugin()]
+    )
+    monkeypatch.setattr(search, 'index_for', lambda entity_type: RecordingIndex(calls))
+    monkeypatch.setattr(
+        search.logic, 'get_action', lambda name: lambda context, data_dict: dict(data_dict)
+    )
+    monkeypatch.setattr(search, 'rebuild', rebuild)
+    monkeypatch.setattr(search, 'commit', commit)
+    return calls
+
+
+def write(package_id, operation=model.DomainObjectOperation.changed):
+    """Notify a package write the way CKAN does before the session commits"""
+    DomainObjectModificationExtension().notify(model.Package(id=package_id), operation)
+
+
+def test_writes_outside_a_run_are_indexed_right_away(solr):
+    write('a')
+    assert solr['indexed'] == ['a']
+    assert solr['rebuilt'] == []
+
+
+def test_writes_in_a_run_are_not_indexed_per_write(solr):
+    with indexing.deferred_indexing() as deferred:
+        write('a', model.DomainObjectOperation.new)
+        write('b')
+        assert solr['indexed'] == []
+
+    assert solr['rebuilt'] == [['a', 'b']]
+    assert solr['commits'] == 1
+    assert deferred.indexed == 2
+
+
+def test_written_packages_are_reindexed_in_chunks(solr):
+    with indexing.deferred_indexing(chunk_size=2) as deferred:
+        for package_id in ['a', 'b', 'c']:
+            write(package_id)
+            deferred.checkpoint()
+        assert solr['rebuilt'] == [['a', 'b']]
+
+    assert solr['indexed'] == []
+    assert solr['rebuilt'] == [['a', 'b'], ['c']]
+    assert solr['commits'] == 2
+    assert deferred.indexed == 3
+
+
+def test_deleted_packages_are_removed_right_away(solr):
+    with indexing.deferred_indexing() as deferred:
+        write('a', model.DomainObjectOperation.deleted)
+        assert solr['removed'] == ['a']
+    assert deferred.indexed == 0
+
+
+def test_writes_of_other_threads_are_indexed_as_usual(solr):
+    with indexing.deferred_indexing() as deferred:
+        other = threading.Thread(target=write, args=('other',))
+        other.start()
+        other.join()
+        write('mine')
+
+    assert solr['indexed'] == ['other']
+    assert solr['rebuilt'] == [['mine']]
+    assert deferred.indexed == 1
+
+
+def test_indexing_resumes_after_an_error(solr):
+    with pytest.raises(RuntimeError):
+        with indexing.deferred_indexing():
+            write('a')
+            raise RuntimeError('write failed')
+
+    write('b')
+    assert solr['rebuilt'] == [['a']]
+    assert solr['indexed'] == ['b']
+
+
+def test_nested_runs_collect_in_both(solr):
+    with indexing.deferred_indexing() as outer:
+        with indexing.deferred_indexing() as inner:
+            write('a')
+        write('b')
+
+    assert inner.indexed == 1
+    assert outer.indexed == 2
+    assert solr['indexed'] == []
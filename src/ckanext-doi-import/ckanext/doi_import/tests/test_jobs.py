@@ -0,0 +1,42 @@
+"""
+Tests for jobs.py outside a running job queue.
+"""
+from datetime import datetime, timedelta, timezone
+
+import ckan.plugins.toolkit as toolkit
+
+from ckanext.doi_import import jobs
+
+NOW = datetime(2024, 6, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def test_job_queued_too_long_is_waiting_for_worker():
+    assert not jobs.waiting_for_worker(NOW - timedelta(seconds=30), now=NOW)
+    assert jobs.waiting_for_worker(NOW - timedelta(seconds=61), now=NOW)
+    assert not jobs.waiting_for_worker(None, now=NOW)
+
+
+def test_naive_enqueue_time_is_utc():
+    enqueued_at = (NOW - timedelta(seconds=61)).replace(tzinfo=None)
+    assert jobs.waiting_for_worker(enqueued_at, now=NOW)
+
+
+def test_worker_wait_setting(monkeypatch):
+    monkeypatch.setitem(toolkit.config, 'ckanext.doi_import.worker_wait', '300')
+    assert not jobs.waiting_for_worker(NOW - timedelta(seconds=61), now=NOW)
+
+
+def test_import_dois_outside_a_job_imports_in_chunks(monkeypatch):
+    calls = []
+
+    def batch(context, data_dict):
+        calls.append(data_dict['dois'])
+        return {'results': [{'doi': doi, 'status': 'created'} for doi in data_dict['dois']]}
+
+    monkeypatch.setattr(toolkit, 'get_action', lambda name: batch)
+    dois = [f'10.5281/zenodo.{i}' for i in range(jobs.PROGRESS_CHUNK_SIZE + 1)]
+
+    result = jobs.import_dois('harvester', dois, 'org', [], False)
+
+    assert [len(chunk) for chunk in calls] == [jobs.PROGRESS_CHUNK_SIZE, 1]
+    assert result['summary']['created'] == len(dois)
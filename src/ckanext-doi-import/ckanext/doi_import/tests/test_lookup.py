@@ -0,0 +1,96 @@
+"""
+Tests for lookup.py: finding existing datasets by DOI or Zenodo record id.
+"""
+import pytest
+
+import ckan.plugins.toolkit as toolkit
+
+from ckanext.doi_import import lookup
+
+INDEXED = {
+    'id': 'id-1', 'name': 'indexed',
+    'doi': 'https://doi.org/10.5281/zenodo.1', 'url': 'https://zenodo.org/records/1',
+    lookup.DOI_FIELD: ['10.5281/zenodo.1'], lookup.RECORD_ID_FIELD: ['1'],
+}
+
+# Indexed before the lookup fields existed
+LEGACY = {
+    'id': 'id-2', 'name': 'legacy',
+    'doi': 'https://doi.org/10.5281/zenodo.2', 'url': 'https://zenodo.org/record/2',
+}
+
+
+@pytest.fixture
+def searches(monkeypatch):
+    """Fake package_search answering vocab_* queries with INDEXED and url queries with LEGACY"""
+    made = []
+
+    def package_search(context, data_dict):
+        made.append(data_dict['fq'])
+        if data_dict['fq'].startswith('url:'):
+            return {'results': [LEGACY]}
+        return {'results': [INDEXED]}
+
+    monkeypatch.setattr(toolkit, 'get_action', lambda name: package_search)
+    return made
+
+
+def test_lookup_keys():
+    dois, record_ids = lookup.dataset_lookup_keys({
+        'doi': 'https://doi.org/10.5281/ZENODO.5',
+        'concept_doi': 'https://doi.org/10.5281/zenodo.4',
+        'identifier': '{"propertyID": "https://registry.identifiers.org/registry/doi", '
+                      '"value": "10.5281/zenodo.5"}',
+        'url': 'https://zenodo.org/records/5',
+    })
+    assert dois == {'10.5281/zenodo.5', '10.5281/zenodo.4'}
+    # Zenodo DOIs carry the record id as well
+    assert record_ids == {'5', '4'}
+
+
+def test_index_lookup_keys():
+    pkg_dict = lookup.index_lookup_keys({'doi': 'https://doi.org/10.5281/zenodo.7',
+                                         'metadata_hash': 'abc'})
+    assert pkg_dict[lookup.RECORD_ID_FIELD] == ['7']
+    assert pkg_dict[lookup.HASH_FIELD] == ['abc']
+    assert pkg_dict[lookup.DOI_FIELD] == ['10.5281/zenodo.7']
+
+
+def test_indexed_dataset_is_found_with_one_query(searches):
+    found = lookup.find_datasets({}, ['https://doi.org/10.5281/zenodo.1'])
+
+    assert found == {'https://doi.org/10.5281/zenodo.1': INDEXED}
+    assert searches == ['vocab_doi:("10.5281/zenodo.1") OR vocab_zenodo_record_id:("1")']
+
+
+def test_legacy_dataset_is_found_by_url(searches):
+    found = lookup.find_datasets({}, ['10.5281/zenodo.1', 'https://zenodo.org/record/2'])
+
+    assert found['10.5281/zenodo.1'] is INDEXED
+    assert found['https://zenodo.org/record/2'] is LEGACY
+    # Only the value without a hit is looked up again
+    assert searches[1] == (
+        'url:("https://doi.org/10.5281/zenodo.2" OR "https://zenodo.org/record/2" '
+        'OR "https://zenodo.org/records/2") OR extras_doi:("10.5281/zenodo.2" '
+        'OR "https://doi.org/10.5281/zenodo.2")'
+    )
+
+
+def test_fallback_hits_must_match(searches):
+    found = lookup.find_datasets({}, ['10.5281/zenodo.3'])
+    assert found == {'10.5281/zenodo.3': None}
+
+
+def test_fallback_can_be_disabled(searches, monkeypatch):
+    monkeypatch.setitem(toolkit.config, 'ckanext.doi_import.lookup_fallback', 'false')
+
+    found = lookup.find_datasets({}, ['https://zenodo.org/record/2'])
+    assert found == {'https://zenodo.org/record/2': None}
+    assert len(searches) == 1
+
+
+def test_large_lookups_are_chunked(searches):
+    values = [f'10.5281/zenodo.{i}' for i in range(100, 100 + lookup.CHUNK_SIZE + 1)]
+    lookup.find_datasets({}, values)
+
+    assert len([fq for fq in searches if fq.startswith('vocab_')]) == 2
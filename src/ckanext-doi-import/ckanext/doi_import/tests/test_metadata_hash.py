@@ -0,0 +1,44 @@
+"""
+Tests for metadata_hash and metadata_unchanged.
+"""
+from ckanext.doi_import import plugin
+
+METADATA = {
+    'title': 'Fish counts',
+    'doi': 'https://doi.org/10.5281/zenodo.1',
+    'tag_string': 'fish,counts',
+    'extras': [{'key': 'source', 'value': 'zenodo'}, {'key': 'publication_date', 'value': '2024'}],
+    'resources': [{'name': 'Zenodo Record', 'url': 'https://zenodo.org/record/1'}],
+}
+
+
+def test_hash_is_stable_across_key_order():
+    reordered = dict(reversed(list(METADATA.items())))
+    reordered['tag_string'] = ' counts, fish'
+    reordered['extras'] = list(reversed(METADATA['extras']))
+
+    assert plugin.metadata_hash(reordered) == plugin.metadata_hash(METADATA)
+
+
+def test_hash_ignores_fields_set_by_ckan_and_the_importer():
+    written = dict(METADATA, id='id-1', name='fish-counts', owner_org='obis',
+                   contributing_organizations=['vliz'], metadata_hash='old')
+
+    assert plugin.metadata_hash(written) == plugin.metadata_hash(METADATA)
+
+
+def test_changed_field_changes_hash():
+    assert plugin.metadata_hash(dict(METADATA, title='Fish counts v2')) != \
+        plugin.metadata_hash(METADATA)
+
+    resources = [dict(METADATA['resources'][0], url='https://zenodo.org/record/2')]
+    assert plugin.metadata_hash(dict(METADATA, resources=resources)) != \
+        plugin.metadata_hash(METADATA)
+
+
+def test_metadata_unchanged():
+    dataset = {'id': 'id-1', 'metadata_hash': plugin.metadata_hash(METADATA)}
+
+    assert plugin.metadata_unchanged(dataset, dict(METADATA))
+    assert not plugin.metadata_unchanged(dataset, dict(METADATA, title='New'))
+    assert not plugin.metadata_unchanged({'id': 'id-1'}, dict(METADATA))
@@ -0,0 +1,54 @@
+"""
+Tests for previews.py and confirming a preview.
+"""
+import pytest
+
+from ckanext.doi_import import plugin, previews
+
+METADATA = {'title': 'Fish counts', 'url': 'https://zenodo.org/record/1'}
+
+
+@pytest.fixture
+def local_store(monkeypatch):
+    """Previews kept in this process, as without Redis"""
+    monkeypatch.setattr(previews, '_redis', lambda: None)
+    monkeypatch.setattr(previews, '_local', {})
+
+
+def test_preview_is_only_loaded_by_its_user(local_store):
+    token = previews.store('alice', '10.5281/zenodo.1', METADATA, 'obis')
+
+    assert previews.load(token, 'alice')['metadata'] == METADATA
+    assert previews.load(token, 'bob') is None
+
+    previews.discard(token)
+    assert previews.load(token, 'alice') is None
+
+
+def test_expired_preview(local_store, monkeypatch):
+    monkeypatch.setenv('CKANEXT__DOI_IMPORT__PREVIEW__TTL', '-1')
+    token = previews.store('alice', '10.5281/zenodo.1', METADATA, 'obis')
+    assert previews.load(token, 'alice') is None
+
+
+def test_confirming_a_new_doi_creates(local_store):
+    token = previews.store('alice', '10.5281/zenodo.1', METADATA, 'obis', ['vliz'])
+
+    data = plugin._preview_write_data(previews.load(token, 'alice'))
+
+    assert data == {
+        'metadata': METADATA, 'owner_org': 'obis', 'contributing_organizations': ['vliz'],
+    }
+
+
+def test_confirming_an_imported_doi_updates_the_dataset(local_store):
+    existing = {'id': 'id-1', 'name': 'fish-counts', 'owner_org': 'obis-community',
+                'title': 'Fish counts', 'resources': []}
+    token = previews.store('alice', '10.5281/zenodo.1', METADATA, 'obis',
+                           existing_dataset=existing)
+
+    data = plugin._preview_write_data(previews.load(token, 'alice'))
+
+    assert data['is_update']
+    assert data['owner_org'] == 'obis-community'
+    assert data['metadata'] == dict(METADATA, id='id-1', name='fish-counts')
@@ -0,0 +1,105 @@
+"""
+Tests for ratelimit.py with in-process buckets.
+"""
+import time
+
+import pytest
+
+from ckanext.doi_import import ratelimit
+
+URL = 'https://zenodo.org/api/records/1'
+NOW = 1717236000.0
+
+
+class Response(object):
+    def __init__(self, status_code=200, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+@pytest.fixture
+def buckets(monkeypatch):
+    """Enabled limiter on fresh LocalBuckets and a frozen clock"""
+    monkeypatch.setenv('CKANEXT__DOI_IMPORT__RATELIMIT__ENABLED', 'true')
+    monkeypatch.setattr(time, 'time', lambda: NOW)
+    local = ratelimit.LocalBuckets()
+    monkeypatch.setattr(ratelimit, 'get_buckets', lambda: local)
+    # Create the zenodo.org bucket at its initial rate
+    local.acquire('zenodo.org', ratelimit.initial_rate('zenodo.org'), 5)
+    return local
+
+
+def test_parse_retry_after():
+    assert ratelimit.parse_retry_after('30', now=NOW) == 30.0
+    assert ratelimit.parse_retry_after('Sat, 01 Jun 2024 10:00:30 GMT', now=NOW) == 30.0
+    assert ratelimit.parse_retry_after('Sat, 01 Jun 2024 09:00:00 GMT', now=NOW) == 0.0
+    assert ratelimit.parse_retry_after('soon', now=NOW) is None
+    assert ratelimit.parse_retry_after(None) is None
+
+
+def test_parse_reset():
+    assert ratelimit.parse_reset('60', now=NOW) == NOW + 60
+    assert ratelimit.parse_reset(str(NOW + 60), now=NOW) == NOW + 60
+    assert ratelimit.parse_reset('later', now=NOW) is None
+
+
+def test_initial_rates():
+    assert ratelimit.initial_rate('zenodo.org') == 2.0
+    assert ratelimit.initial_rate('sandbox.zenodo.org') == 2.0
+    assert ratelimit.initial_rate('example.org') == 2.0
+    assert ratelimit.initial_rate('api.datacite.org') == 5.0
+
+
+def test_too_many_requests_halves_rate_and_blocks(buckets):
+    ratelimit.observe(URL, Response(429, {'Retry-After': '10'}))
+
+    assert buckets.get_rate('zenodo.org') == 1.0
+    assert buckets.acquire('zenodo.org', 2.0, 5) == 10.0
+
+
+def test_remaining_requests_are_spread_until_reset(buckets):
+    ratelimit.observe(URL, Response(200, {
+        'X-RateLimit-Remaining': '30', 'X-RateLimit-Reset': str(NOW + 60),
+    }))
+    assert buckets.get_rate('zenodo.org') == 0.5
+
+
+def test_no_remaining_requests_waits_for_reset(buckets):
+    ratelimit.observe(URL, Response(200, {
+        'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': '20',
+    }))
+    assert buckets.acquire('zenodo.org', 2.0, 5) == 20.0
+
+
+def test_rate_grows_without_headers_up_to_max(buckets, monkeypatch):
+    ratelimit.observe(URL, Response(200))
+    assert buckets.get_rate('zenodo.org') == pytest.approx(2.0 * ratelimit.RATE_INCREASE)
+
+    monkeypatch.setenv('CKANEXT__DOI_IMPORT__RATELIMIT__MAX_RATE', '2.15')
+    ratelimit.observe(URL, Response(200))
+    assert buckets.get_rate('zenodo.org') == 2.15
+
+
+def test_empty_bucket_waits_for_a_token(buckets):
+    for i in range(4):
+        assert buckets.acquire('zenodo.org', 2.0, 5) == 0
+    assert buckets.acquire('zenodo.org', 2.0, 5) == 0.5
+
+
+def test_acquire_sleeps_until_allowed(buckets, monkeypatch):
+    waits = iter([0.5, 0])
+    monkeypatch.setattr(buckets, 'acquire', lambda host, rate, burst: next(waits))
+    slept = []
+    monkeypatch.setattr(time, 'sleep', slept.append)
+
+    ratelimit.acquire(URL)
+    assert slept == [0.5]
+
+
+def test_unreachable_redis_falls_back_to_local_buckets(monkeypatch):
+    monkeypatch.setenv('CKANEXT__DOI_IMPORT__RATELIMIT__REDIS_URL', 'redis://127.0.0.1:1/0')
+    monkeypatch.setattr(ratelimit, '_buckets', None)
+
+    assert isinstance(ratelimit.get_buckets(), ratelimit.LocalBuckets)
+    # Kept for the rest of the process
+    assert ratelimit.get_buckets() is ratelimit.get_buckets()
@@ -0,0 +1,69 @@
+"""
+Tests for upstream.py, the pooled HTTP client, against a stub server.
+"""
+import pytest
+import requests
+
+from ckanext.doi_import import upstream
+
+JSON = {'Content-Type': 'application/json'}
+
+
+def test_settings_fall_back_to_environment(monkeypatch):
+    monkeypatch.setenv('CKANEXT__DOI_IMPORT__HTTP__READ_TIMEOUT', '7')
+    monkeypatch.delenv('CKANEXT__DOI_IMPORT__HTTP__CONNECT_TIMEOUT', raising=False)
+
+    assert upstream.get_timeout() == (5.0, 7.0)
+    assert upstream.get_setting('http.retries') == 3
+    assert upstream.get_setting('no.such.setting', 'default') == 'default'
+
+
+def test_one_session_per_process(stub_server):
+    session = upstream.get_session()
+    assert upstream.get_session() is session
+    assert session.headers['User-Agent'] == upstream.USER_AGENT
+
+    upstream.reset_session()
+    assert upstream.get_session() is not session
+
+
+def test_connections_are_kept_alive(stub_server):
+    for i in range(3):
+        assert upstream.get_json(stub_server.url + f'/records/{i}') == {}
+
+    # Every request came in over the same connection
+    assert len(stub_server.requests) == 3
+    assert len(set(request['client'] for request in stub_server.requests)) == 1
+
+
+def test_server_errors_are_retried(stub_server, monkeypatch):
+    monkeypatch.setenv('CKANEXT__DOI_IMPORT__HTTP__RETRIES', '2')
+    upstream.reset_session()
+    stub_server.responses = [
+        (503, {}, 'unavailable'),
+        (502, {}, 'bad gateway'),
+        (200, JSON, {'id': 1}),
+    ]
+
+    assert upstream.get_json(stub_server.url + '/records/1') == {'id': 1}
+    assert len(stub_server.requests) == 3
+
+
+def test_rate_limited_request_is_retried_after_retry_after(stub_server, monkeypatch):
+    monkeypatch.setenv('CKANEXT__DOI_IMPORT__RATELIMIT__ENABLED', 'true')
+    monkeypatch.setenv('CKANEXT__DOI_IMPORT__RATELIMIT__REDIS_URL', 'redis://127.0.0.1:1/0')
+    monkeypatch.setenv('CKANEXT__DOI_IMPORT__HTTP__RETRIES', '1')
+    stub_server.responses = [
+        (429, {'Retry-After': '0'}, 'slow down'),
+        (200, JSON, {'id': 1}),
+    ]
+
+    assert upstream.get_json(stub_server.url + '/records/1') == {'id': 1}
+    assert len(stub_server.requests) == 2
+
+
+def test_error_status_raises(stub_server):
+    stub_server.responses = [(404, JSON, {'status': 404})]
+
+    with pytest.raises(requests.HTTPError):
+        upstream.get_json(stub_server.url + '/records/missing')
@@ -0,0 +1,228 @@
+"""
+Shared HTTP client for upstream APIs (Zenodo, DataCite, ...)
+
+Every call goes through one requests.Session per process, so connections to
+each upstream host are pooled and kept alive instead of paying a new TCP+TLS
+handshake per lookup. Transient connection errors and 5xx responses are
+retried with jittered exponential backoff. Requests are throttled per host
+by the shared rate limiter (ratelimit.py); 429 responses are retried once
+the upstream's Retry-After has passed.
+
+Settings are read from the CKAN config when it is available, falling back to
+environment variables in the ckanext-envvars format, so standalone scripts can
+use the same client:
+
+    ckanext.doi_import.http.connect_timeout   CKANEXT__DOI_IMPORT__HTTP__CONNECT_TIMEOUT
+"""
+
+import json
+import os
+import random
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from ckanext.doi_import import cache, ratelimit
+
+DEFAULTS = {
+    'http.connect_timeout': 5,
+    'http.read_timeout': 30,
+    'http.retries': 3,
+    'http.backoff_factor': 0.5,
+    'http.pool_maxsize': 10,
+    'cache.enabled': 'true',
+    'cache.path': cache.DEFAULT_PATH,
+    'cache.ttl': 3600,
+    'cache.max_entries': 10000,
+    'ratelimit.enabled': 'true',
+    'ratelimit.rate': 2,
+    'ratelimit.burst': 5,
+    'ratelimit.max_rate': 10,
+    'ratelimit.redis_url': '',
+}
+
+# Status codes worth retrying; 429 is retried by get() after Retry-After
+RETRY_STATUSES = (500, 502, 503, 504)
+
+USER_AGENT = 'obis-products-catalog (ckanext-doi-import)'
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+_response_cache = None
+
+
+def get_setting(name, default=None):
+    """Read a ckanext.doi_import.* setting from CKAN config or the environment"""
+    if default is None:
+        default = DEFAULTS.get(name)
+
+    try:
+        from ckan.plugins import toolkit
+        value = toolkit.config.get(f'ckanext.doi_import.{name}')
+    except Exception:
+        value = None
+
+    if value is None:
+        env_name = 'CKANEXT__DOI_IMPORT__' + name.upper().replace('.', '__')
+        value = os.environ.get(env_name)
+
+    return default if value in (None, '') else value
+
+
+def get_timeout():
+    """(connect, read) timeout tuple for upstream requests"""
+    return (
+        float(get_setting('http.connect_timeout')),
+        float(get_setting('http.read_timeout')),
+    )
+
+
+class JitteredRetry(Retry):
+    """urllib3 Retry that adds full jitter to the exponential backoff"""
+
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        return random.uniform(0, backoff) if backoff else 0
+
+
+def _build_session():
+    retries = JitteredRetry(
+        total=int(get_setting('http.retries')),
+        backoff_factor=float(get_setting('http.backoff_factor')),
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        raise_on_status=False,
+    )
+    pool_maxsize = int(get_setting('http.pool_maxsize'))
+    adapter = HTTPAdapter(
+        pool_connections=pool_maxsize,
+        pool_maxsize=pool_maxsize,
+        max_retries=retries,
+    )
+
+    session = requests.Session()
+    session.headers['User-Agent'] = USER_AGENT
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session():
+    """Return the process-wide upstream session, creating it on first use
+
+    The session is rebuilt after a fork so uwsgi workers never share sockets
+    with the master process.
+    """
+    global _session, _session_pid
+
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                _session = _build_session()
+                _session_pid = pid
+    return _session
+
+
+def reset_session():
+    """Drop the pooled session (e.g. after changing settings)"""
+    global _session, _session_pid
+
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+        _session_pid = None
+
+
+def get(url, **kwargs):
+    """GET an upstream URL through the pooled session, within the host's rate limit"""
+    kwargs.setdefault('timeout', get_timeout())
+
+    attempts = int(get_setting('http.retries')) + 1
+    for attempt in range(attempts):
+        ratelimit.acquire(url)
+        response = get_session().get(url, **kwargs)
+        ratelimit.observe(url, response)
+        if response.status_code != 429 or attempt == attempts - 1 or not ratelimit.is_enabled():
+            return response
+        response.close()
+
+
+def get_json(url, **kwargs):
+    """GET an upstream URL and return the decoded JSON body
+
+    Raises requests.RequestException on connection errors or error statuses.
+    """
+    response = get(url, **kwargs)
+    response.raise_for_status()
+    return response.json()
+
+
+def get_response_cache():
+    """Return the shared on-disk response cache, or None if it is disabled"""
+    global _response_cache
+
+    if str(get_setting('cache.enabled')).lower() not in ('true', '1', 'yes', 'on'):
+        return None
+    if _response_cache is None:
+        _response_cache = cache.ResponseCache(
+            path=get_setting('cache.path'),
+            max_entries=int(get_setting('cache.max_entries')),
+        )
+    return _response_cache
+
+
+def get_cached_json(url, params=None, ttl=None, **kwargs):
+    """GET an upstream JSON document through the shared response cache
+
+    Fresh entries are returned without a request. Stale entries are
+    revalidated with If-None-Match/If-Modified-Since and reused on a 304.
+    Falls back to a plain request when the cache is disabled or unusable.
+    """
+    response_cache = get_response_cache()
+    if response_cache is None:
+        return get_json(url, params=params, **kwargs)
+
+    if ttl is None:
+        ttl = float(get_setting('cache.ttl'))
+    key = requests.Request('GET', url, params=params).prepare().url
+
+    try:
+        entry = response_cache.get(key)
+    except Exception:
+        # A broken cache file must never break the upstream call
+        return get_json(url, params=params, **kwargs)
+
+    if entry is not None and entry.is_fresh(ttl):
+        return json.loads(entry.body)
+
+    headers = dict(kwargs.pop('headers', None) or {})
+    if entry is not None:
+        headers.update(entry.conditional_headers())
+
+    response = get(url, params=params, headers=headers, **kwargs)
+
+    if response.status_code == 304 and entry is not None:
+        try:
+            response_cache.touch(key)
+        except Exception:
+            pass
+        return json.loads(entry.body)
+
+    response.raise_for_status()
+    data = response.json()
+    try:
+        response_cache.set(
+            key,
+            response.text,
+            etag=response.headers.get('ETag'),
+            last_modified=response.headers.get('Last-Modified'),
+        )
+    except Exception:
+        pass
+    return data
@@ -1,18 +1,26 @@
 import ckan.plugins as plugins
 import ckan.plugins.toolkit as toolkit
-from ckanext.obis_theme import helpers
+from ckanext.obis_theme import helpers, scheduler
 import click
-import requests
 import re
 import json
 import time
 import os
+import requests
+
+try:
+    # Pooled session, response cache and per-host rate limiter of
+    # ckanext-doi-import, when it is installed
+    from ckanext.doi_import import upstream
+except ImportError:
+    upstream = None
 
 
 class ObisThemePlugin(plugins.SingletonPlugin):
     plugins.implements(plugins.IConfigurer)
     plugins.implements(plugins.ITemplateHelpers)
     plugins.implements(plugins.IClick)
+    plugins.implements(plugins.IActions)
 
     # IConfigurer
 
@@ -35,6 +43,40 @@ class ObisThemePlugin(plugins.SingletonPlugin):
     def get_commands(self):
         return [obis]
 
+    # IActions
+
+    def get_actions(self):
+        return {'obis_scheduler_status': obis_scheduler_status}
+
+
+@toolkit.side_effect_free
+def obis_scheduler_status(context, data_dict):
+    """Status and last run of the `ckan obis scheduler` jobs. Sysadmins only."""
+    toolkit.check_access('sysadmin', context, data_dict)
+    return dict(
+        (name, scheduler.get_status(name))
+        for name in [scheduler.DAEMON] + SCHEDULER_JOBS
+    )
+
+
+def fetch_json(url, cached=False, read_timeout=None, **kwargs):
+    """GET an upstream JSON document through ckanext-doi-import's client if available"""
+    if upstream is None:
+        response = requests.get(url, timeout=read_timeout or 30, **kwargs)
+        response.raise_for_status()
+        return response.json()
+    if read_timeout:
+        kwargs['timeout'] = (upstream.get_timeout()[0], read_timeout)
+    if cached:
+        return upstream.get_cached_json(url, **kwargs)
+    return upstream.get_json(url, **kwargs)
+
+
+def throttle_ocean_expert():
+    """Fixed delay between Ocean Expert calls when the shared rate limiter is unavailable"""
+    if upstream is None:
+        time.sleep(1)
+
 
 @click.group()
 def obis():
@@ -55,9 +97,7 @@ def sync_nodes():
     
     click.echo("Fetching OBIS nodes...")
     try:
-        response = requests.get("https://api.obis.org/v3/node", timeout=30)
-        response.raise_for_status()
-        nodes = response.json().get('results', [])
+        nodes = fetch_json("https://api.obis.org/v3/node").get('results', [])
     except Exception as e:
         click.echo(f"Error fetching nodes: {e}", err=True)
         return
@@ -131,12 +171,9 @@ def sync_institutions(limit):
     def fetch_ocean_expert_data(oe_id):
         """Fetch detailed institution data from Ocean Expert API"""
         try:
-            response = requests.get(
-                f"https://oceanexpert.org/api/v1/institute/{oe_id}.json",
-                timeout=30
+            data = fetch_json(
+                f"https://oceanexpert.org/api/v1/institute/{oe_id}.json", cached=True
             )
-            response.raise_for_status()
-            data = response.json()
             return data if data and isinstance(data, dict) else None
         except Exception as e:
             click.echo(f"    Warning: Could not fetch Ocean Expert data for ID {oe_id}: {e}")
@@ -159,10 +196,8 @@ def sync_institutions(limit):
     # Fetch OBIS institutions
     click.echo("Fetching OBIS institutions...")
     try:
-        response = requests.get("https://api.obis.org/v3/institute", 
-                              params={'size': 10000}, timeout=120)
-        response.raise_for_status()
-        data = response.json()
+        data = fetch_json("https://api.obis.org/v3/institute",
+                          params={'size': 10000}, read_timeout=120)
         institutions = data.get('results', [])
         
         # Filter for those with Ocean Expert IDs
@@ -196,7 +231,7 @@ def sync_institutions(limit):
                 if ocean_expert_data:
                     enriched += 1
                     click.echo(f"  ✓ Retrieved Ocean Expert data")
-                time.sleep(1)  # Rate limiting
+                throttle_ocean_expert()
             
             # Determine final title and slug
             oe_institute = ocean_expert_data.get('institute') if ocean_expert_data else None
@@ -315,4 +350,69 @@ def sync_institutions(limit):
     # Verify with fresh query
     model.Session.expire_all()
     final_count = model.Session.query(Group).filter_by(type='group').count()
-    click.echo(f"\n✓ {final_count} groups in database after commit")
\ No newline at end of file
+    click.echo(f"\n✓ {final_count} groups in database after commit")
+
+
+# Jobs of `ckan obis scheduler`, in the order they run when due together
+SCHEDULER_JOBS = ['zenodo_harvest', 'sync_nodes', 'sync_institutions']
+
+
+@obis.command('scheduler')
+@click.option('--once', is_flag=True, help='Run every enabled job once, then exit')
+@click.option('--max-concurrent', default=None, type=int,
+              help='Jobs allowed to run at the same time')
+@click.pass_context
+def run_scheduler(ctx, once, max_concurrent):
+    """Run the Zenodo harvest and OBIS syncs periodically in one process"""
+    import signal
+    from flask import current_app
+
+    try:
+        scheduler.state_store()
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+
+    jobs = [
+        scheduler.Job('sync_nodes', lambda: ctx.invoke(sync_nodes), 86400),
+        scheduler.Job('sync_institutions', lambda: ctx.invoke(sync_institutions), 86400,
+                      after=['sync_nodes']),
+    ]
+    try:
+        from ckanext.zenodo.cli import harvest
+        jobs.insert(0, scheduler.Job(
+            'zenodo_harvest', lambda: ctx.invoke(harvest, incremental=True), 3600
+        ))
+    except ImportError:
+        click.echo("ckanext-zenodo not installed, the Zenodo harvest is not scheduled", err=True)
+
+    runner = scheduler.Scheduler(jobs, max_concurrent=max_concurrent, echo=click.echo)
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *args: runner.stop())
+
+    for job in jobs:
+        state = 'every %ss' % job.interval if job.enabled else 'disabled'
+        click.echo(f"{job.name}: {state}")
+    click.echo(f"Max concurrent jobs: {runner.max_concurrent}\n")
+
+    runner.run(current_app._get_current_object(), once=once)
+    click.echo("Scheduler stopped")
+
+
+@obis.command('scheduler-status')
+def scheduler_status():
+    """Show the status and last run of the scheduled jobs"""
+    try:
+        scheduler.state_store()
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+
+    for name in [scheduler.DAEMON] + SCHEDULER_JOBS:
+        status = scheduler.get_status(name)
+        if not status:
+            click.echo(f"{name}: never run")
+            continue
+        click.echo(f"{name}: {status.get('status')}")
+        for key in ('pid', 'started', 'stopped', 'last_start', 'last_end', 'last_duration',
+                    'last_error', 'runs', 'failures', 'next_run'):
+            if status.get(key) is not None:
+                click.echo(f"  {key}: {status[key]}")
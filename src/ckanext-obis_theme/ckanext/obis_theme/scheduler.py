@@ -0,0 +1,234 @@
+"""
+In-process scheduler for the periodic harvest and sync jobs
+
+`ckan obis scheduler` loads CKAN once and then runs the Zenodo harvest and the
+OBIS node and institution syncs on their intervals, so the pooled upstream
+session, the response cache and the rate-limit buckets stay warm between
+runs. The next run of a job is its interval after the end of the previous
+one, give or take `jitter` (a fraction of the interval), so jobs drift apart
+instead of hitting the upstreams together.
+
+Settings (CKAN config):
+
+    ckanext.obis_theme.scheduler.max_concurrent            1
+    ckanext.obis_theme.scheduler.jitter                    0.1
+    ckanext.obis_theme.scheduler.<job>.interval            seconds
+    ckanext.obis_theme.scheduler.<job>.enabled             true
+
+Jobs are zenodo_harvest, sync_nodes and sync_institutions. sync_institutions
+never runs while sync_nodes is running or due. The status of each job is kept
+in the doi_import_harvest_state table (see get_status), so it can be queried
+from other processes with `ckan obis scheduler-status` or the
+obis_scheduler_status action. The scheduler therefore needs ckanext-doi-import
+(`pip install ckanext-obis_theme[scheduler]`); the rest of the theme does not.
+"""
+
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+
+import ckan.plugins.toolkit as toolkit
+
+CONFIG_PREFIX = 'ckanext.obis_theme.scheduler.'
+
+DEFAULT_MAX_CONCURRENT = 1
+DEFAULT_JITTER = 0.1
+
+# Longest sleep between two looks at the schedule
+TICK = 30
+
+STATE_PREFIX = 'obis.scheduler.'
+
+# Status entry of the scheduler process itself
+DAEMON = 'daemon'
+
+
+class Job(object):
+    """A periodic job: a callable plus its default interval and prerequisites"""
+
+    def __init__(self, name, func, interval, after=()):
+        self.name = name
+        self.func = func
+        self.default_interval = interval
+        self.after = tuple(after)
+        self.next_run = 0
+        self.running = False
+
+    @property
+    def interval(self):
+        return toolkit.asint(
+            toolkit.config.get(f'{CONFIG_PREFIX}{self.name}.interval', self.default_interval)
+        )
+
+    @property
+    def enabled(self):
+        return toolkit.asbool(toolkit.config.get(f'{CONFIG_PREFIX}{self.name}.enabled', True))
+
+
+def _iso(timestamp):
+    if not timestamp:
+        return None
+    return datetime.fromtimestamp(timestamp, timezone.utc).replace(microsecond=0).isoformat()
+
+
+def _timestamp(value):
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def state_store():
+    """ckanext-doi-import's model, whose harvest state table holds the job status"""
+    try:
+        from ckanext.doi_import import model as import_model
+    except ImportError:
+        raise RuntimeError(
+            'The scheduler keeps its status in the doi_import_harvest_state table '
+            'and needs ckanext-doi-import to be installed'
+        )
+    return import_model
+
+
+def get_status(job_name):
+    """Stored status of a job: status, last_start, last_end, last_error, runs, next_run"""
+    value = state_store().get_harvest_state(STATE_PREFIX + job_name)
+    return json.loads(value) if value else {}
+
+
+def set_status(job_name, **values):
+    status = get_status(job_name)
+    status.update(values)
+    state_store().set_harvest_state(STATE_PREFIX + job_name, json.dumps(status))
+    return status
+
+
+class Scheduler(object):
+    """Runs jobs on their intervals, at most max_concurrent at a time"""
+
+    def __init__(self, jobs, max_concurrent=None, jitter=None, echo=print):
+        self.jobs = list(jobs)
+        self.max_concurrent = max_concurrent or toolkit.asint(
+            toolkit.config.get(CONFIG_PREFIX + 'max_concurrent', DEFAULT_MAX_CONCURRENT)
+        )
+        self.jitter = jitter if jitter is not None else float(
+            toolkit.config.get(CONFIG_PREFIX + 'jitter', DEFAULT_JITTER)
+        )
+        self.echo = echo
+        self.stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def _delay(self, job):
+        spread = job.interval * self.jitter
+        return max(0, job.interval + random.uniform(-spread, spread))
+
+    def load_schedule(self):
+        """Pick up after the runs recorded by a previous scheduler process"""
+        now = time.time()
+        for job in self.jobs:
+            last_end = _timestamp(get_status(job.name).get('last_end'))
+            job.next_run = last_end + self._delay(job) if last_end else now
+            set_status(job.name, next_run=_iso(job.next_run), status='scheduled')
+
+    def _blocked(self, job, now):
+        """True if a prerequisite of the job is running or due"""
+        for other in self.jobs:
+            if other.name in job.after and other.enabled and (
+                    other.running or other.next_run <= now):
+                return True
+        return False
+
+    def due_jobs(self, now=None):
+        """Jobs to start now, in order, within the concurrency limit"""
+        now = time.time() if now is None else now
+        with self._lock:
+            free = self.max_concurrent - sum(1 for job in self.jobs if job.running)
+            due = []
+            for job in sorted(self.jobs, key=lambda job: job.next_run):
+                if len(due) >= free:
+                    break
+                if job.enabled and not job.running and job.next_run <= now \
+                        and not self._blocked(job, now):
+                    job.running = True
+                    due.append(job)
+            return due
+
+    def _run(self, job, app):
+        with app.test_request_context():
+            try:
+                self._run_job(job)
+            finally:
+                from ckan import model
+                model.Session.remove()
+
+    def _run_job(self, job):
+        started = time.time()
+        set_status(job.name, status='running', last_start=_iso(started))
+        self.echo(f"[scheduler] {job.name}: started")
+        error = None
+        try:
+            job.func()
+        except BaseException as e:
+            # click commands end with SystemExit/Abort; never let them stop the loop
+            if not (isinstance(e, SystemExit) and not e.code):
+                error = str(e) or e.__class__.__name__
+            from ckan import model
+            model.Session.rollback()
+
+        finished = time.time()
+        with self._lock:
+            job.running = False
+            job.next_run = finished + self._delay(job)
+        status = get_status(job.name)
+        set_status(
+            job.name,
+            status='failed' if error else 'ok',
+            last_end=_iso(finished),
+            last_duration=round(finished - started, 1),
+            last_error=error,
+            runs=status.get('runs', 0) + 1,
+            failures=status.get('failures', 0) + (1 if error else 0),
+            next_run=_iso(job.next_run),
+        )
+        self.echo(f"[scheduler] {job.name}: {'failed: ' + error if error else 'finished'}"
+                  f" in {finished - started:.0f}s, next run at {_iso(job.next_run)}")
+
+    def run(self, app, once=False):
+        """Run until stop() (or, with once, until every job has run once)"""
+        # The table is created by the doi_import plugin, which may not be enabled
+        state_store().init_tables()
+        self.load_schedule()
+        set_status(DAEMON, status='running', pid=os.getpid(), started=_iso(time.time()),
+                   jobs=[job.name for job in self.jobs if job.enabled])
+        if once:
+            for job in self.jobs:
+                job.next_run = 0
+        pending = set(job.name for job in self.jobs if job.enabled)
+
+        while not self.stopping.is_set():
+            for job in self.due_jobs():
+                thread = threading.Thread(
+                    target=self._run, args=(job, app), name=f'scheduler-{job.name}'
+                )
+                thread.start()
+                self._threads.append(thread)
+                pending.discard(job.name)
+
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            if once and not pending and not self._threads:
+                break
+
+            next_run = min([job.next_run for job in self.jobs if job.enabled] or [0])
+            wait = 1 if once else min(TICK, max(1, next_run - time.time()))
+            self.stopping.wait(wait)
+
+        for thread in self._threads:
+            thread.join()
+        set_status(DAEMON, status='stopped', stopped=_iso(time.time()))
+
+    def stop(self):
+        self.stopping.set()
@@ -0,0 +1,117 @@
+"""
+Tests for scheduler.py, without a database: the status table is replaced by
+an in-memory store.
+"""
+import pytest
+
+import ckan.plugins.toolkit as toolkit
+
+from ckanext.obis_theme import scheduler
+
+NOW = 1717236000.0
+
+
+class MemoryStore(object):
+    """The harvest state functions of ckanext-doi-import's model"""
+
+    def __init__(self):
+        self.state = {}
+
+    def get_harvest_state(self, name, default=None):
+        return self.state.get(name, default)
+
+    def set_harvest_state(self, name, value):
+        self.state[name] = value
+
+
+@pytest.fixture
+def store(monkeypatch):
+    memory = MemoryStore()
+    monkeypatch.setattr(scheduler, 'state_store', lambda: memory)
+    return memory
+
+
+def job(name, next_run, after=()):
+    new_job = scheduler.Job(name, lambda: None, 3600, after)
+    new_job.next_run = next_run
+    return new_job
+
+
+def test_due_jobs_start_in_schedule_order():
+    jobs = [job('b', NOW - 10), job('a', NOW - 20), job('later', NOW + 10)]
+    runner = scheduler.Scheduler(jobs, max_concurrent=3, jitter=0)
+
+    assert [j.name for j in runner.due_jobs(NOW)] == ['a', 'b']
+    assert [j.running for j in jobs] == [True, True, False]
+    # Running jobs are not started twice
+    assert runner.due_jobs(NOW) == []
+
+
+def test_concurrency_limit():
+    jobs = [job('a', NOW - 20), job('b', NOW - 10)]
+    runner = scheduler.Scheduler(jobs, max_concurrent=1, jitter=0)
+
+    assert [j.name for j in runner.due_jobs(NOW)] == ['a']
+    assert runner.due_jobs(NOW) == []
+
+    # As _run_job leaves a finished job
+    jobs[0].running = False
+    jobs[0].next_run = NOW + 3600
+    assert [j.name for j in runner.due_jobs(NOW)] == ['b']
+
+
+def test_job_waits_for_prerequisites():
+    nodes = job('sync_nodes', NOW)
+    institutions = job('sync_institutions', NOW - 100, after=['sync_nodes'])
+    runner = scheduler.Scheduler([institutions, nodes], max_concurrent=2, jitter=0)
+
+    # Due earlier, but sync_nodes is due as well
+    assert [j.name for j in runner.due_jobs(NOW)] == ['sync_nodes']
+    # ... and then running
+    assert runner.due_jobs(NOW) == []
+
+    nodes.running = False
+    nodes.next_run = NOW + 3600
+    assert [j.name for j in runner.due_jobs(NOW)] == ['sync_institutions']
+
+
+def test_disabled_prerequisite_does_not_block(monkeypatch):
+    monkeypatch.setitem(toolkit.config, scheduler.CONFIG_PREFIX + 'sync_nodes.enabled', 'false')
+    nodes = job('sync_nodes', NOW)
+    institutions = job('sync_institutions', NOW, after=['sync_nodes'])
+    runner = scheduler.Scheduler([nodes, institutions], max_concurrent=2, jitter=0)
+
+    assert [j.name for j in runner.due_jobs(NOW)] == ['sync_institutions']
+
+
+def test_interval_setting(monkeypatch):
+    monkeypatch.setitem(toolkit.config, scheduler.CONFIG_PREFIX + 'a.interval', '60')
+    assert job('a', 0).interval == 60
+    assert job('b', 0).interval == 3600
+
+
+def test_finished_run_is_recorded(store):
+    failing = scheduler.Job('sync_nodes', lambda: 1 / 0, 3600)
+    runner = scheduler.Scheduler([failing], max_concurrent=1, jitter=0, echo=lambda line: None)
+    failing.running = True
+
+    runner._run_job(failing)
+
+    status = scheduler.get_status('sync_nodes')
+    assert status['status'] == 'failed'
+    assert status['last_error'] == 'division by zero'
+    assert (status['runs'], status['failures']) == (1, 1)
+    assert not failing.running
+    assert failing.next_run > NOW
+
+
+def test_schedule_continues_from_the_last_run(store, monkeypatch):
+    scheduler.set_status('sync_nodes', last_end='2024-06-01T10:00:00+00:00')
+    monkeypatch.setattr(scheduler.time, 'time', lambda: NOW + 86400)
+    nodes = scheduler.Job('sync_nodes', lambda: None, 3600)
+    new = scheduler.Job('sync_institutions', lambda: None, 3600)
+
+    scheduler.Scheduler([nodes, new], max_concurrent=1, jitter=0).load_schedule()
+
+    assert nodes.next_run == scheduler._timestamp('2024-06-01T11:00:00+00:00')
+    assert new.next_run == NOW + 86400
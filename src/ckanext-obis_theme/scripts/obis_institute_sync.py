@@ -16,6 +16,13 @@ import time
 import unicodedata
 from urllib.parse import urljoin
 
+try:
+    # Shared conditional-GET response cache and per-host rate limiter,
+    # available inside the CKAN container
+    from ckanext.doi_import import upstream
+except ImportError:
+    upstream = None
+
 # Configuration
 OBIS_API_URL = "https://api.obis.org/v3/institute"
 OCEAN_EXPERT_API_BASE = "https://oceanexpert.org/api/v1"
@@ -107,13 +114,21 @@ def fetch_obis_institutions():
         print("  This confirms the pagination issue you observed")
         return []
 
+def throttle_ocean_expert():
+    """Fixed delay between Ocean Expert calls when the shared rate limiter is unavailable"""
+    if upstream is None:
+        time.sleep(1)
+
 def fetch_ocean_expert_institution(oe_id):
     """Fetch detailed institution data from Ocean Expert API"""
     try:
         url = f"{OCEAN_EXPERT_API_BASE}/institute/{oe_id}.json"
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
-        data = response.json()
+        if upstream:
+            data = upstream.get_cached_json(url)
+        else:
+            response = requests.get(url, timeout=30)
+            response.raise_for_status()
+            data = response.json()
         
         # Always return data if we get a valid response - don't judge completeness here
         if data and isinstance(data, dict):
@@ -422,7 +437,7 @@ def sync_obis_institutions():
                         print(f"  ✓ Retrieved Ocean Expert data")
                     else:
                         print(f"  ! No Ocean Expert data available")
-                    time.sleep(1)  # Rate limiting
+                    throttle_ocean_expert()
                 
                 if update_group(existing_groups[preliminary_slug], institution, ocean_expert_data):
                     updated += 1
@@ -462,7 +477,7 @@ def sync_obis_institutions():
                         print(f"  ! No Ocean Expert data available - will create linkage anyway")
                         final_slug = preliminary_slug
                     
-                    time.sleep(1)  # Rate limiting
+                    throttle_ocean_expert()
                 else:
                     final_slug = preliminary_slug
                 
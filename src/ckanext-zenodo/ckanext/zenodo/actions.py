@@ -0,0 +1,27 @@
+import ckan.plugins.toolkit as tk
+
+# The lookup itself lives in ckanext-doi-import, which indexes the fields
+from ckanext.doi_import.lookup import find_datasets
+
+
+@tk.side_effect_free
+def zenodo_dataset_lookup(context, data_dict):
+    """Find existing datasets by DOI with exact-match term queries
+
+    Accepts ``doi`` (a single DOI, DOI URL or Zenodo record URL) and/or
+    ``dois`` (a list of them). Returns a dict mapping every requested value,
+    as given, to its dataset dict or None. Only datasets the user may see
+    are returned.
+    """
+    tk.check_access('package_search', context, data_dict)
+
+    requested = data_dict.get('dois') or []
+    if isinstance(requested, str):
+        requested = [requested]
+    requested = list(requested)
+    if data_dict.get('doi'):
+        requested.append(data_dict['doi'])
+    if not requested:
+        raise tk.ValidationError({'doi': 'At least one DOI is required'})
+
+    return find_datasets(context, requested)
@@ -2,9 +2,45 @@
 CKAN CLI commands for Zenodo harvesting
 """
 import click
-import requests
-from datetime import datetime
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 import ckan.plugins.toolkit as toolkit
+from ckanext.doi_import import identifiers, indexing
+from ckanext.doi_import import model as import_model
+from ckanext.doi_import.lookup import DOI_FIELD, HASH_FIELD, RECORD_ID_FIELD
+from ckanext.doi_import.plugin import (
+    fetch_doi_metadata, fetch_zenodo_record, map_zenodo_to_schema, metadata_hash,
+    metadata_unchanged
+)
+from ckanext.zenodo import incremental as incremental_harvest
+from ckanext.zenodo import oai as oai_source
+from ckanext.zenodo import report as run_report
+
+# Legacy plain-text registry, one DOI per line
+DEFAULT_REGISTRY_FILE = '/srv/app/src_extensions/ckanext-zenodo/ckanext/zenodo/config/zenodo_dois.txt'
+
+# DOIs fetched ahead of the writer per worker thread in `harvest --workers`
+PREFETCH_PER_WORKER = 4
+
+# Datasets per package_search page when preloading the DOI -> dataset map
+# (the default ckan.search.rows_max)
+PRELOAD_PAGE_SIZE = 1000
+
+# Stored Solr fields fetched by the preload
+PRELOAD_FIELDS = ['id', 'name', 'title', 'metadata_modified', DOI_FIELD, RECORD_ID_FIELD, HASH_FIELD]
+
+# doi_import_harvest_state key holding the start time of the last harvest
+# that finished without failures
+LAST_HARVEST_STATE = 'zenodo.last_harvest'
+
+# doi_import_harvest_state keys of the latest run and the latest completed run
+LAST_RUN_STATE = 'zenodo.last_run'
+FINISHED_RUN_STATE = 'zenodo.last_finished_run'
+
+# Harvest runs whose per-DOI checkpoints are kept
+CHECKPOINT_RUNS_KEPT = 10
 
 
 @click.group()
@@ -14,143 +50,687 @@ def zenodo():
 
 
 @zenodo.command()
-@click.option('--registry', default='/srv/app/src_extensions/ckanext-zenodo/ckanext/zenodo/config/zenodo_dois.txt',
-              help='Path to DOI registry file')
+@click.option('--registry', default=None,
+              help='Harvest DOIs from a text file instead of the registry table')
 @click.option('--org', default='obis-community',
               help='Organization to import datasets into')
-def harvest(registry, org):
-    """Harvest datasets from Zenodo DOI registry"""
+@click.option('--workers', default=1, type=int,
+              help='Number of threads fetching and mapping Zenodo records')
+@click.option('--incremental', is_flag=True,
+              help='Only refresh records Zenodo reports as updated since the last harvest')
+@click.option('--since', default=None,
+              help='Incremental harvest of records updated since this ISO 8601 time')
+@click.option('--community', default=None,
+              help='Restrict the incremental search to a Zenodo community')
+@click.option('--resume', is_flag=True,
+              help='Continue the last interrupted run, skipping DOIs it already handled')
+@click.option('--retry-failed', is_flag=True,
+              help='Only process the DOIs that failed in the last run')
+@click.option('--bulk', is_flag=True,
+              help='Defer Solr indexing and reindex the written datasets in chunks')
+@click.option('--report', default=None,
+              help='Write a JSON run report with per-stage timing percentiles to this file')
+@click.option('--events', default=None,
+              help='Write one NDJSON event per DOI to this file (default: next to --report)')
+def harvest(registry, org, workers, incremental, since, community, resume, retry_failed, bulk,
+            report, events):
+    """Harvest datasets from Zenodo DOI registry
     
+    With --workers N, Zenodo records are fetched and mapped by N threads while
+    all CKAN writes happen here, one DOI at a time and in registry order.
+    
+    With --incremental, one Zenodo search for records updated since the last
+    harvest replaces the per-DOI update checks; only those records, DOIs not
+    yet in CKAN and registry entries that are pending or failed are processed.
+    
+    The outcome of every DOI is checkpointed as the run goes. --resume
+    continues an interrupted run and --retry-failed re-runs only the DOIs that
+    failed in the last run.
+    
+    With --bulk, datasets are not indexed one by one as they are written;
+    they are reindexed in chunks with one Solr commit each.
+    
+    --report and --events record the outcome and the time spent fetching,
+    mapping, writing and indexing each DOI.
+    """
+    
+    run_id = start_run(resume, retry_failed)
+    report = run_report.HarvestReport(report, events, command=f'zenodo harvest (run {run_id})')
     click.echo(f"=== Zenodo DOI Harvest ===")
-    click.echo(f"Registry: {registry}")
-    click.echo(f"Target org: {org}\n")
+    click.echo(f"Run: {run_id}")
+    click.echo(f"Registry: {registry or 'doi_import_registry table'}")
+    click.echo(f"Target org: {org}")
+    click.echo(f"Workers: {workers}\n")
     
     # Load DOIs from registry
     dois = load_doi_registry(registry)
     click.echo(f"Found {len(dois)} DOIs to check\n")
     
+    # Skip what the run already handled, or keep only its failures
+    if resume or retry_failed:
+        checkpoints = import_model.get_checkpoints(run_id)
+        if retry_failed:
+            dois = [doi for doi in dois if checkpoints.get(doi, {}).get('status') == 'failed']
+            click.echo(f"Retrying {len(dois)} failed DOIs\n")
+        else:
+            dois = [doi for doi in dois if doi not in checkpoints]
+            click.echo(f"Resuming: {len(checkpoints)} DOIs already handled, {len(dois)} left\n")
+    
+    # Map every DOI to its existing dataset up front (in this thread)
+    with report.phase('lookup'):
+        datasets = preload_datasets(dois)
+    
+    changed = {}
+    if incremental or since:
+        since = since or import_model.get_harvest_state(LAST_HARVEST_STATE)
+        if since:
+            try:
+                with report.phase('incremental_search'):
+                    dois, changed = select_incremental(
+                        dois, datasets, since, community, registry is None
+                    )
+            except Exception as e:
+                click.echo(f"Zenodo search failed ({e}), running a full harvest\n", err=True)
+        else:
+            click.echo("No previous harvest recorded, running a full harvest\n")
+    
     stats = {
         'found': 0,
         'imported': 0,
         'updated': 0,
+        'unchanged': 0,
         'failed': 0
     }
     
-    for doi in dois:
-        click.echo(f"Checking: {doi}")
+    def _prepare(doi):
+        record = changed.get(identifiers.zenodo_record_id(doi))
+        return prepare_harvest(doi, datasets.get(doi), record)
+    
+    with deferred_index(bulk, report) as deferred:
+        for item in iter_prepared(dois, _prepare, workers):
+            for line in item['log']:
+                click.echo(line)
+            
+            try:
+                status, error = write_harvest_item(item, org, stats)
+            except Exception as e:
+                click.echo(f"  ✗ Error: {str(e)}")
+                stats['failed'] += 1
+                status, error = 'failed', str(e)
+            
+            import_model.record_checkpoint(
+                run_id, item['doi'], status,
+                upstream_updated=item.get('upstream_updated'),
+                metadata_hash=checkpoint_hash(item['metadata']),
+                error=error
+            )
+            
+            flush_index(deferred, item['event'])
+            report.finish(item['event'], status, error)
+            click.echo()
         
-        try:
-            # Check if dataset exists
-            dataset = find_dataset_by_doi(doi)
+        if bulk:
+            # The last, partial chunk of a bulk run
+            with report.phase('index'):
+                deferred.flush()
+    
+    import_model.set_harvest_state(FINISHED_RUN_STATE, run_id)
+    
+    # Summary
+    click.echo(f"\nSummary:")
+    click.echo(f"  Found: {stats['found']}/{len(dois)} datasets in CKAN")
+    click.echo(f"  Imported: {stats['imported']} new datasets")
+    click.echo(f"  Updated: {stats['updated']} datasets")
+    click.echo(f"  Unchanged: {stats['unchanged']} datasets (same metadata hash)")
+    click.echo(f"  Failed: {stats['failed']} operations")
+    if bulk:
+        click.echo(f"  Reindexed: {deferred.indexed} datasets in bulk")
+    
+    write_report(report)
+    
+    # Failed DOIs must be retried, so only a clean run moves the mark forward
+    failed = import_model.get_checkpoints(run_id, status='failed')
+    if failed:
+        click.echo(f"  {len(failed)} DOIs failed in this run; retry with --retry-failed")
+    else:
+        import_model.set_harvest_state(LAST_HARVEST_STATE, run_id)
+        click.echo(f"  Last harvest time set to {run_id}")
+
+
+def checkpoint_hash(metadata):
+    """Metadata hash of a harvested item, as stored on its dataset
+    
+    doi_create_dataset hashes the metadata before popping the file manifest
+    and keeps the hash in it; metadata that was not written still has its
+    manifest and is hashed here.
+    """
+    if not metadata:
+        return None
+    return metadata.get('metadata_hash') or metadata_hash(metadata)
+
+
+def deferred_index(bulk, report):
+    """Context of the write loop: deferred Solr indexing, or nothing
+    
+    Bulk runs reindex in chunks. A reported run that is not bulk reindexes
+    each dataset right after its write (as CKAN would), but as a separate
+    step so the report can tell write and index time apart.
+    """
+    if bulk:
+        return indexing.deferred_indexing()
+    if report.enabled:
+        return indexing.deferred_indexing(chunk_size=1)
+    return nullcontext()
+
+
+def flush_index(deferred, event):
+    """Reindex the datasets written so far once a chunk is due, timed for the report"""
+    if deferred is not None and deferred.is_due():
+        with run_report.timed(event, 'index'):
+            deferred.flush()
+
+
+def write_report(report):
+    if not report.enabled:
+        return
+    report.close()
+    summary = report.summary()
+    for stage, timing in summary['stages'].items():
+        if timing['count']:
+            click.echo(f"  {stage}: p50 {timing['p50']:.3f}s, p95 {timing['p95']:.3f}s, "
+                       f"p99 {timing['p99']:.3f}s ({timing['count']} DOIs)")
+    if report.report_path:
+        click.echo(f"  Report written to {report.report_path}")
+    if report.events_path:
+        click.echo(f"  Events written to {report.events_path}")
+
+
+def start_run(resume=False, retry_failed=False):
+    """Id of the harvest run to write checkpoints to
+    
+    A new run is identified by its start time. --resume reuses the last run
+    if it did not finish, --retry-failed reuses the last run in any case.
+    """
+    last_run = import_model.get_harvest_state(LAST_RUN_STATE)
+    if retry_failed and last_run:
+        return last_run
+    if resume and last_run and last_run != import_model.get_harvest_state(FINISHED_RUN_STATE):
+        return last_run
+    if resume or retry_failed:
+        click.echo("No previous run to continue, starting a new one")
+    
+    run_id = incremental_harvest.utc_now()
+    import_model.set_harvest_state(LAST_RUN_STATE, run_id)
+    import_model.prune_checkpoints(CHECKPOINT_RUNS_KEPT)
+    return run_id
+
+
+@zenodo.command()
+@click.argument('community_id')
+@click.option('--org', default='obis-community',
+              help='Organization to import datasets into')
+@click.option('--since', default=None,
+              help='Only records updated since this ISO 8601 time')
+@click.option('--register/--no-register', default=True,
+              help='Add the community\'s DOIs to the registry table')
+@click.option('--bulk', is_flag=True,
+              help='Defer Solr indexing and reindex the written datasets in chunks')
+@click.option('--report', default=None,
+              help='Write a JSON run report with per-stage timing percentiles to this file')
+@click.option('--events', default=None,
+              help='Write one NDJSON event per DOI to this file (default: next to --report)')
+def harvest_community(community_id, org, since, register, bulk, report, events):
+    """Mirror every record of a Zenodo community into CKAN
+    
+    Records are streamed page by page from the Zenodo search (the next page
+    is fetched while the current one is written), and each search hit is
+    mapped directly, so no DOI list is needed and no per-record requests are
+    made. Datasets whose mapped metadata is unchanged are not rewritten.
+    """
+    report = run_report.HarvestReport(
+        report, events, command=f'zenodo harvest-community {community_id}'
+    )
+    click.echo(f"=== Zenodo Community Harvest ===")
+    click.echo(f"Community: {community_id}")
+    click.echo(f"Target org: {org}\n")
+    
+    stats = {
+        'found': 0,
+        'imported': 0,
+        'updated': 0,
+        'unchanged': 0,
+        'failed': 0
+    }
+    total = 0
+    
+    with deferred_index(bulk, report) as deferred:
+        for hits in incremental_harvest.community_pages(community_id, since):
+            records = {}
+            concept_dois = {}
+            for hit in hits:
+                canonical = identifiers.from_zenodo_record(hit)
+                if canonical is not None and canonical.doi not in records:
+                    records[canonical.doi] = hit
+                    concept_dois[canonical.doi] = canonical.concept_doi
+            total += len(records)
+            
+            if register:
+                import_model.registry_add(list(records))
+            
+            # One batched lookup per page keeps memory bounded by the page size
+            with report.phase('lookup'):
+                datasets = find_version_datasets(concept_dois)
             
-            if dataset:
-                # Existing dataset - check for updates
-                click.echo(f"  ✓ Found: {dataset['title']}")
-                click.echo(f"    Last modified: {dataset.get('metadata_modified', 'Unknown')}")
+            for doi, record in records.items():
+                item = prepare_harvest(doi, datasets.get(doi), record)
+                for line in item['log']:
+                    click.echo(line)
                 
-                # Check if Zenodo has updates
-                zenodo_modified = get_zenodo_last_modified(doi)
-                if zenodo_modified:
-                    click.echo(f"    Zenodo updated: {zenodo_modified}")
-                    if should_update(dataset.get('metadata_modified'), zenodo_modified):
-                        click.echo(f"    → Updating...")
-                        if update_dataset(dataset['id'], doi, org):
-                            stats['updated'] += 1
-                            click.echo(f"    ✓ Updated successfully")
-                        else:
-                            stats['failed'] += 1
-                            click.echo(f"    ✗ Update failed")
-                    else:
-                        click.echo(f"    → No update needed")
-                stats['found'] += 1
-            else:
-                # New dataset - import it
-                click.echo(f"  → Not in CKAN, importing...")
-                if import_dataset(doi, org):
-                    stats['imported'] += 1
-                    click.echo(f"    ✓ Imported successfully")
-                else:
+                try:
+                    status, error = write_harvest_item(item, org, stats)
+                except Exception as e:
+                    click.echo(f"  ✗ Error: {str(e)}")
                     stats['failed'] += 1
-                    click.echo(f"    ✗ Import failed")
+                    status, error = 'failed', str(e)
+                
+                flush_index(deferred, item['event'])
+                report.finish(item['event'], status, error)
+                click.echo()
         
-        except Exception as e:
-            click.echo(f"  ✗ Error: {str(e)}")
-            stats['failed'] += 1
+        if bulk:
+            # The last, partial chunk of a bulk run
+            with report.phase('index'):
+                deferred.flush()
+    
+    # Summary
+    click.echo(f"\nSummary:")
+    click.echo(f"  Records: {total} in community {community_id}")
+    click.echo(f"  Found: {stats['found']}/{total} datasets in CKAN")
+    click.echo(f"  Imported: {stats['imported']} new datasets")
+    click.echo(f"  Updated: {stats['updated']} datasets")
+    click.echo(f"  Unchanged: {stats['unchanged']} datasets (same metadata hash)")
+    click.echo(f"  Failed: {stats['failed']} operations")
+    if bulk:
+        click.echo(f"  Reindexed: {deferred.indexed} datasets in bulk")
+    
+    write_report(report)
+
+
+@zenodo.command()
+@click.option('--community', default=None,
+              help='Only records of this Zenodo community (OAI set user-<community>)')
+@click.option('--from', 'from_date', default=None,
+              help='Records changed since this date (default: end of the last completed run)')
+@click.option('--org', default='obis-community',
+              help='Organization to import datasets into')
+@click.option('--files/--no-files', default=True,
+              help='Fetch the file list of each record from the Zenodo API (not in OAI-PMH)')
+@click.option('--url', default=oai_source.OAI_URL, help='OAI-PMH endpoint')
+def harvest_oai(community, from_date, org, files, url):
+    """Harvest records changed on Zenodo through OAI-PMH ListRecords
+    
+    DataCite records are streamed page by page and mapped like REST records.
+    The resumption token is stored after each page, so an interrupted run
+    continues where it stopped; a completed run is the starting point of
+    the next one.
+    """
+    set_name = oai_source.set_spec(community)
+    source = oai_source.ResumableHarvest(
+        import_model.get_harvest_state, import_model.set_harvest_state,
+        set_name=set_name, base_url=url, from_date=from_date
+    )
+    state = source.load()
+    
+    click.echo(f"=== Zenodo OAI-PMH Harvest ===")
+    click.echo(f"Set: {set_name or 'all records'}")
+    if state.get('token') and not from_date:
+        click.echo(f"Resuming the interrupted run from {state.get('from') or 'the beginning'}")
+    else:
+        click.echo(f"Changed since: {from_date or state.get('last') or 'the beginning'}")
+    click.echo(f"Target org: {org}\n")
+    
+    stats = {
+        'found': 0,
+        'imported': 0,
+        'updated': 0,
+        'unchanged': 0,
+        'failed': 0
+    }
+    deleted = 0
+    
+    for records in source.pages():
+        page = {}
+        concept_dois = {}
+        for record in records:
+            if record.get('deleted'):
+                click.echo(f"Deleted on Zenodo: record {record['id']}\n")
+                deleted += 1
+                continue
+            canonical = identifiers.from_zenodo_record(record)
+            if canonical is not None and canonical.doi not in page:
+                page[canonical.doi] = record
+                concept_dois[canonical.doi] = canonical.concept_doi
         
-        click.echo()
+        # New versions are matched to the dataset of their concept DOI
+        datasets = find_version_datasets(concept_dois) if page else {}
+        
+        for doi, record in page.items():
+            if files:
+                try:
+                    record['files'] = fetch_zenodo_record(doi, revalidate=True).get('files', [])
+                except Exception as e:
+                    click.echo(f"  File list error for {doi}: {str(e)}", err=True)
+            
+            item = prepare_harvest(doi, datasets.get(doi), record)
+            for line in item['log']:
+                click.echo(line)
+            
+            try:
+                write_harvest_item(item, org, stats)
+            except Exception as e:
+                click.echo(f"  ✗ Error: {str(e)}")
+                stats['failed'] += 1
+            
+            click.echo()
     
     # Summary
     click.echo(f"\nSummary:")
-    click.echo(f"  Found: {stats['found']}/{len(dois)} datasets in CKAN")
+    click.echo(f"  Found: {stats['found']} datasets in CKAN")
     click.echo(f"  Imported: {stats['imported']} new datasets")
     click.echo(f"  Updated: {stats['updated']} datasets")
+    click.echo(f"  Unchanged: {stats['unchanged']} datasets (same metadata hash)")
+    click.echo(f"  Deleted on Zenodo: {deleted} records (left in CKAN)")
     click.echo(f"  Failed: {stats['failed']} operations")
+    click.echo(f"  Next run harvests changes since {source.load().get('last')}")
+
+
+def select_incremental(dois, datasets, since, community=None, use_registry_status=True):
+    """DOIs to process in an incremental run, and the updated Zenodo records
+    
+    Returns (dois, {record_id: record}). Kept DOIs are those whose record was
+    updated since the given time, those without a dataset, and (for the
+    registry table) those whose last harvest is pending or failed.
+    """
+    click.echo(f"Incremental harvest: records updated since {since}"
+               + (f" in community {community}" if community else ""))
+    
+    record_ids = set(filter(None, (identifiers.zenodo_record_id(doi) for doi in dois)))
+    changed = incremental_harvest.updated_records(record_ids, since, community)
+    
+    retry = set()
+    if use_registry_status:
+        retry = set(
+            entry['doi'] for entry in import_model.registry_list()
+            if entry['status'] != import_model.REGISTRY_HARVESTED
+        )
+    
+    selected = [
+        doi for doi in dois
+        if identifiers.zenodo_record_id(doi) in changed or not datasets.get(doi) or doi in retry
+    ]
+    click.echo(f"  {len(changed)} updated on Zenodo, {len(selected)} of {len(dois)} DOIs to process\n")
+    return selected, changed
 
 
-def load_doi_registry(registry_file):
-    """Load DOIs from registry file"""
-    dois = []
+def iter_prepared(dois, prepare, workers):
+    """Yield prepare(doi) for every DOI, in order, computed by a thread pool
+    
+    At most workers * PREFETCH_PER_WORKER DOIs are in flight, so memory stays
+    bounded however long the registry is.
+    """
+    if workers <= 1:
+        for doi in dois:
+            yield prepare(doi)
+        return
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for doi in dois:
+            pending.append(executor.submit(prepare, doi))
+            if len(pending) >= workers * PREFETCH_PER_WORKER:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def prepare_harvest(doi, dataset, updated_record=None):
+    """Decide what to do with a DOI and fetch its metadata (no database access)
+    
+    Runs in worker threads. The Zenodo record is fetched once and drives both
+    the staleness check and the mapping. ``updated_record`` is the record
+    when an incremental search already returned it as updated. Returns a
+    dict with the action (import, update or skip), the mapped metadata or
+    the fetch error, and the log lines to print.
+    """
+    log = [f"Checking: {doi}"]
+    event = run_report.new_event(doi)
+    item = {'doi': doi, 'dataset': dataset, 'action': 'skip',
+            'metadata': None, 'error': None, 'log': log, 'event': event}
+    
+    try:
+        record = updated_record
+        if record is not None:
+            # Reported as updated by the incremental search: map the search
+            # hit directly, no further Zenodo requests
+            record['record_id'] = str(record.get('id'))
+        elif identifiers.zenodo_record_id(doi):
+            # A failed fetch fails the DOI, also for an existing dataset: a
+            # skip would let the run move the incremental watermark past a
+            # change it could not see. For the same reason a cached copy of
+            # the record is always revalidated.
+            with run_report.timed(event, 'fetch'):
+                record = fetch_zenodo_record(doi, revalidate=True)
+        
+        if dataset:
+            # Existing dataset - check for updates
+            log.append(f"  ✓ Found: {dataset['title']}")
+            log.append(f"    Last modified: {dataset.get('metadata_modified', 'Unknown')}")
+            
+            # Check if Zenodo has updates
+            zenodo_modified = record.get('updated') if record else None
+            item['upstream_updated'] = zenodo_modified
+            if zenodo_modified:
+                log.append(f"    Zenodo updated: {zenodo_modified}")
+                if updated_record is not None or \
+                        should_update(dataset.get('metadata_modified'), zenodo_modified):
+                    item['action'] = 'update'
+                else:
+                    log.append(f"    → No update needed")
+        else:
+            # New dataset - import it
+            log.append(f"  → Not in CKAN, importing...")
+            item['action'] = 'import'
+        
+        if item['action'] != 'skip':
+            if record is not None:
+                with run_report.timed(event, 'map'):
+                    item['metadata'] = map_zenodo_to_schema(record, doi)
+            else:
+                # Non-Zenodo DOI (DataCite, or a Zenodo search by DOI)
+                with run_report.timed(event, 'fetch'):
+                    item['metadata'] = fetch_doi_metadata(doi, revalidate=True)
+    
+    except Exception as e:
+        item['error'] = str(e)
+    
+    return item
+
+
+def write_harvest_item(item, org, stats):
+    """Apply one prepared DOI to CKAN and count the outcome
+    
+    Returns (status, error) with status one of imported, updated, unchanged,
+    skipped or failed.
+    """
+    doi, dataset, action = item['doi'], item['dataset'], item['action']
+    label = 'Update' if dataset else 'Import'
+    
+    if dataset:
+        stats['found'] += 1
+    
+    error = item['error']
+    status = 'skipped'
+    if not error and action != 'skip':
+        try:
+            with run_report.timed(item['event'], 'write'):
+                if action == 'update':
+                    click.echo(f"    → Updating...")
+                    status = update_dataset(dataset, doi, org, item['metadata'])
+                else:
+                    import_dataset(doi, org, item['metadata'])
+                    status = 'imported'
+        except Exception as e:
+            import_model.model.Session.rollback()
+            error = str(e)
+    
+    if error:
+        click.echo(f"    {label} error: {error}", err=True)
+        record_failure(doi, error)
+        stats['failed'] += 1
+        click.echo(f"    ✗ {label} failed")
+        return 'failed', error
+    
+    # Imported and updated DOIs are recorded by doi_create_dataset; the others
+    # are up to date too
+    if status in ('unchanged', 'skipped'):
+        record_harvested(doi, item.get('upstream_updated'))
+    
+    if status == 'unchanged':
+        stats['unchanged'] += 1
+        click.echo(f"    → Metadata unchanged, skipped write")
+    elif status == 'updated':
+        stats['updated'] += 1
+        click.echo(f"    ✓ Updated successfully")
+    elif status == 'imported':
+        stats['imported'] += 1
+        click.echo(f"    ✓ Imported successfully")
+    return status, None
+
+
+def load_doi_registry(registry_file=None):
+    """Load DOIs from the registry table, or from a text file if given"""
+    if registry_file is None:
+        dois = [entry['doi'] for entry in import_model.registry_list()]
+        if not dois:
+            click.echo("Registry is empty; load DOIs with `ckan zenodo registry-import FILE`", err=True)
+        return dois
+    
+    return read_registry_file(registry_file)
+
+
+def read_registry_file(registry_file):
+    """Load DOIs from a registry text file, canonicalized and de-duplicated"""
+    lines = []
     try:
         with open(registry_file, 'r') as f:
             for line in f:
-                doi = line.strip()
-                if doi and not doi.startswith('#'):
-                    dois.append(doi)
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    lines.append(line)
     except FileNotFoundError:
         click.echo(f"Error: Registry file not found: {registry_file}", err=True)
         raise click.Abort()
+    
+    invalid = []
+    dois = [canonical.doi for canonical in identifiers.normalize_many(lines, invalid)]
+    for value in invalid:
+        click.echo(f"Warning: Skipping invalid registry entry: {value}", err=True)
+    if len(dois) + len(invalid) < len(lines):
+        click.echo(f"Skipped {len(lines) - len(dois) - len(invalid)} duplicate registry entries")
     return dois
 
 
-def find_dataset_by_doi(doi):
-    """Search for existing dataset by DOI in canonical_id field"""
+def preload_datasets(dois):
+    """Map each DOI to {id, name, title, metadata_modified, metadata_hash} of its dataset, or None
+    
+    All harvested datasets are paged through once with a narrow field list
+    and indexed by normalized DOI and Zenodo record id, so the whole run
+    costs a few Solr queries instead of one lookup per DOI.
+    """
+    context = {'ignore_auth': True}
+    by_doi = {}
+    by_record_id = {}
+    
     try:
-        context = {'ignore_auth': True}
-        
-        # Search by canonical_id (which should contain the DOI URL)
-        result = toolkit.get_action('package_search')(
-            context,
-            {'q': f'canonical_id:"{doi}"', 'rows': 1}
-        )
-        
-        if result['count'] > 0:
-            return result['results'][0]
-        
-        # Fallback: search by url field
-        result = toolkit.get_action('package_search')(
-            context,
-            {'q': f'url:"{doi}"', 'rows': 1}
-        )
-        
-        if result['count'] > 0:
-            return result['results'][0]
-        
-        return None
+        start = 0
+        while True:
+            result = toolkit.get_action('package_search')(context, {
+                'q': '*:*',
+                'fq': f'{DOI_FIELD}:[* TO *] OR {RECORD_ID_FIELD}:[* TO *]',
+                'fl': PRELOAD_FIELDS,
+                'sort': 'id asc',
+                'rows': PRELOAD_PAGE_SIZE,
+                'start': start,
+                'include_private': True,
+            })
+            page = result.get('results', [])
+            for row in page:
+                summary = {key: row.get(key) for key in ('id', 'name', 'title', 'metadata_modified')}
+                summary['metadata_hash'] = (_as_list(row.get(HASH_FIELD)) or [None])[0]
+                for doi in _as_list(row.get(DOI_FIELD)):
+                    by_doi.setdefault(doi, summary)
+                for record_id in _as_list(row.get(RECORD_ID_FIELD)):
+                    by_record_id.setdefault(record_id, summary)
+            start += len(page)
+            if not page or start >= result.get('count', 0):
+                break
+    except Exception as e:
+        click.echo(f"Preload failed ({e}), looking up DOIs in batches", err=True)
+        return find_datasets_by_doi(dois)
     
+    click.echo(f"Preloaded {start} harvested datasets\n")
+    return {
+        doi: by_doi.get(identifiers.normalize_doi(doi))
+        or by_record_id.get(identifiers.zenodo_record_id(doi))
+        for doi in dois
+    }
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def find_datasets_by_doi(dois):
+    """Map each DOI to its existing dataset (or None) with batched exact-match lookups"""
+    try:
+        context = {'ignore_auth': True}
+        return toolkit.get_action('zenodo_dataset_lookup')(context, {'dois': list(dois)})
     except Exception as e:
         click.echo(f"    Search error: {str(e)}", err=True)
-        return None
+        return {doi: find_dataset_by_doi(doi) for doi in dois}
 
 
-def get_zenodo_last_modified(doi):
-    """Get last modified date from Zenodo record"""
+def find_version_datasets(concept_dois):
+    """Map each version DOI to its existing dataset, matching concept DOIs as well
+    
+    ``concept_dois`` maps version DOIs to their concept (all versions) DOI or
+    None. A new version of a record has a new DOI, so the dataset imported
+    from an earlier version is only found through the concept DOI.
+    """
+    dois = list(concept_dois)
+    dois += sorted(set(concept for concept in concept_dois.values() if concept) - set(dois))
+    found = find_datasets_by_doi(dois)
+    return {
+        doi: found.get(doi) or (found.get(concept) if concept else None)
+        for doi, concept in concept_dois.items()
+    }
+
+
+def find_dataset_by_doi(doi):
+    """Find an existing dataset by DOI with a single exact-match lookup"""
     try:
-        if 'zenodo' not in doi.lower():
-            return None
-        
-        # Extract record ID
-        zenodo_id = doi.split('/')[-1]
-        if zenodo_id.startswith('zenodo.'):
-            zenodo_id = zenodo_id.replace('zenodo.', '')
+        context = {'ignore_auth': True}
         
-        url = f"https://zenodo.org/api/records/{zenodo_id}"
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
-        data = response.json()
-        return data.get('updated')
+        result = toolkit.get_action('zenodo_dataset_lookup')(
+            context,
+            {'doi': doi}
+        )
+        return result.get(doi)
     
     except Exception as e:
-        click.echo(f"    Zenodo API error: {str(e)}", err=True)
+        click.echo(f"    Search error: {str(e)}", err=True)
         return None
 
 
@@ -160,71 +740,104 @@ def should_update(ckan_modified, zenodo_modified):
         return False
     
     try:
-        ckan_dt = datetime.fromisoformat(ckan_modified.replace('Z', '+00:00'))
-        zenodo_dt = datetime.fromisoformat(zenodo_modified.replace('Z', '+00:00'))
+        ckan_dt = _as_utc(datetime.fromisoformat(ckan_modified.replace('Z', '+00:00')))
+        zenodo_dt = _as_utc(datetime.fromisoformat(zenodo_modified.replace('Z', '+00:00')))
         return zenodo_dt > ckan_dt
     except:
         return False
 
 
-def import_dataset(doi, org):
-    """Import new dataset using doi_import actions"""
+def _as_utc(dt):
+    # CKAN's metadata_modified is naive UTC, Zenodo's timestamps carry an offset
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+def import_dataset(doi, org, metadata):
+    """Import new dataset from prefetched metadata using doi_import actions"""
+    context = {'ignore_auth': True, 'user': 'default'}
+    
+    # Create dataset
+    toolkit.get_action('doi_create_dataset')(
+        context,
+        {
+            'metadata': metadata,
+            'owner_org': org,
+            'contributing_organizations': []
+        }
+    )
+
+
+def update_dataset(dataset, doi, org, metadata):
+    """Update an existing dataset with fresh (prefetched) metadata
+    
+    ``dataset`` is the dataset found by the preload (id, name and
+    metadata_hash are used), so no package_show is needed. Returns
+    'updated' or 'unchanged' (the metadata hash matches, nothing is written).
+    """
+    context = {'ignore_auth': True, 'user': 'default'}
+    
+    # Preserve the existing dataset ID and name
+    metadata['id'] = dataset['id']
+    metadata['name'] = dataset['name']
+    
+    # Skip the write (and reindex) when the upstream metadata is unchanged
+    if metadata_unchanged(dataset, metadata):
+        return 'unchanged'
+    
+    # Update the dataset (also stores the file manifest and the new hash)
+    toolkit.get_action('doi_create_dataset')(
+        context,
+        {
+            'metadata': metadata,
+            'owner_org': org,
+            'contributing_organizations': [],
+            'is_update': True
+        }
+    )
+    
+    return 'updated'
+
+
+def record_harvested(doi, upstream_updated=None):
+    """Mark a DOI whose dataset is up to date as harvested in the registry"""
     try:
-        context = {'ignore_auth': True, 'user': 'default'}
-        
-        # Fetch metadata from DOI
-        metadata = toolkit.get_action('doi_fetch_metadata')(
-            context,
-            {'doi_url': doi}
+        import_model.registry_record(
+            doi, import_model.REGISTRY_HARVESTED, upstream_updated=upstream_updated
         )
-        
-        # Create dataset
-        dataset = toolkit.get_action('doi_create_dataset')(
-            context,
-            {
-                'metadata': metadata,
-                'owner_org': org,
-                'contributing_organizations': []
-            }
-        )
-        
-        return True
-    
     except Exception as e:
-        click.echo(f"    Import error: {str(e)}", err=True)
-        return False
+        import_model.model.Session.rollback()
+        click.echo(f"    Registry error: {str(e)}", err=True)
 
 
-def update_dataset(dataset_id, doi, org):
-    """Update existing dataset with fresh metadata"""
+def record_failure(doi, error):
+    """Keep the last harvest error of a DOI in the registry"""
     try:
-        context = {'ignore_auth': True, 'user': 'default'}
-        
-        # Fetch fresh metadata
-        metadata = toolkit.get_action('doi_fetch_metadata')(
-            context,
-            {'doi_url': doi}
-        )
-        
-        # Preserve the existing dataset ID and name
-        metadata['id'] = dataset_id
-        
-        # Get existing dataset to preserve name
-        existing = toolkit.get_action('package_show')(
-            context,
-            {'id': dataset_id}
-        )
-        metadata['name'] = existing['name']
-        metadata['owner_org'] = org
-        
-        # Update the dataset
-        toolkit.get_action('package_update')(context, metadata)
-        
-        return True
-    
+        import_model.registry_record(doi, import_model.REGISTRY_FAILED, error=str(error))
     except Exception as e:
-        click.echo(f"    Update error: {str(e)}", err=True)
-        return False
+        import_model.model.Session.rollback()
+        click.echo(f"    Registry error: {str(e)}", err=True)
+
+
+@zenodo.command()
+@click.argument('registry_file', default=DEFAULT_REGISTRY_FILE)
+def registry_import(registry_file):
+    """Add the DOIs of a registry text file to the registry table"""
+    dois = read_registry_file(registry_file)
+    added = import_model.registry_add(dois)
+    click.echo(f"Added {added} of {len(dois)} DOIs ({len(dois) - added} already registered)")
+
+
+@zenodo.command()
+@click.argument('registry_file', default='-')
+def registry_export(registry_file):
+    """Write the registry table as a text file (one DOI per line, '-' for stdout)"""
+    entries = import_model.registry_list()
+    with click.open_file(registry_file, 'w') as f:
+        f.write("# Zenodo DOI registry, exported from doi_import_registry\n")
+        for entry in entries:
+            f.write(f"https://doi.org/{entry['doi']}\n")
+    if registry_file != '-':
+        click.echo(f"Exported {len(entries)} DOIs to {registry_file}")
     
 @zenodo.command()
 def init_vocabularies():
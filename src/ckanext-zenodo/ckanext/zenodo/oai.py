@@ -0,0 +1,296 @@
+"""
+OAI-PMH harvest source for Zenodo
+
+Zenodo's OAI-PMH endpoint lists records changed since a date (`from=`),
+optionally within a community (`set=user-<community>`), one page at a time
+with a resumption token for the next page. Records are requested in the
+DataCite format (`oai_datacite`) and parsed into the shape of a Zenodo REST
+record, so they go through the same map_zenodo_to_schema mapping.
+
+The resumption point of a run is saved after every page through the
+get_state/set_state callables (the CLI uses the doi_import_harvest_state
+table), so an interrupted run continues with the next page instead of
+starting over, and a finished run becomes the `from=` of the next one.
+
+No CKAN dependency, so the harvest can be tested against a stub server.
+"""
+
+import json
+import xml.etree.ElementTree as ET
+
+from ckanext.doi_import import upstream
+
+OAI_URL = 'https://zenodo.org/oai2d'
+
+METADATA_PREFIX = 'oai_datacite'
+
+# OAI error that only means "nothing to harvest"
+NO_RECORDS = 'noRecordsMatch'
+
+# Zenodo REST resource types for DataCite resourceTypeGeneral values (see
+# map_zenodo_resource_type)
+RESOURCE_TYPES = {
+    'Dataset': 'dataset',
+    'Software': 'software',
+    'Text': 'publication',
+    'JournalArticle': 'publication',
+    'Report': 'publication',
+    'Preprint': 'publication',
+    'Image': 'image',
+    'Audiovisual': 'video',
+    'PhysicalObject': 'physicalobject',
+    'Workflow': 'workflow',
+}
+
+
+class OAIError(Exception):
+    """Error reported by the OAI-PMH server (code is the OAI error code)"""
+
+    def __init__(self, code, message=''):
+        super().__init__(f'{code}: {message}' if message else code)
+        self.code = code
+
+
+def set_spec(community):
+    """OAI set of a Zenodo community"""
+    if not community or community.startswith('user-'):
+        return community
+    return f'user-{community}'
+
+
+def _local(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def _children(element, name):
+    return [child for child in element if _local(child.tag) == name]
+
+
+def _child(element, name):
+    for child in element:
+        if _local(child.tag) == name:
+            return child
+    return None
+
+
+def _items(element, container, name):
+    """<name> children of the <container> child of element, e.g. creators/creator"""
+    element = _child(element, container)
+    return _children(element, name) if element is not None else []
+
+
+def _text(element, name=None):
+    if element is not None and name is not None:
+        element = _child(element, name)
+    if element is None or element.text is None:
+        return ''
+    return element.text.strip()
+
+
+def _find_resource(metadata):
+    """The DataCite <resource> element, wrapped in oai_datacite/payload or not"""
+    for element in metadata.iter():
+        if _local(element.tag) == 'resource':
+            return element
+    return None
+
+
+def parse_datacite(resource):
+    """Zenodo REST-style metadata dict of a DataCite <resource> element"""
+    metadata = {}
+
+    for title in _items(resource, 'titles', 'title'):
+        if not title.get('titleType') and title.text:
+            metadata['title'] = title.text.strip()
+            break
+
+    creators = []
+    for creator in _items(resource, 'creators', 'creator'):
+        affiliations = [_text(affiliation) for affiliation in _children(creator, 'affiliation')]
+        entry = {'name': _text(creator, 'creatorName')}
+        if any(affiliations):
+            entry['affiliation'] = ', '.join(filter(None, affiliations))
+        for name_identifier in _children(creator, 'nameIdentifier'):
+            if (name_identifier.get('nameIdentifierScheme') or '').upper() == 'ORCID':
+                entry['orcid'] = _text(name_identifier)
+        creators.append(entry)
+    if creators:
+        metadata['creators'] = creators
+
+    for description in _items(resource, 'descriptions', 'description'):
+        if description.get('descriptionType', 'Abstract') == 'Abstract':
+            metadata['description'] = ''.join(description.itertext()).strip()
+            break
+
+    keywords = [_text(subject) for subject in _items(resource, 'subjects', 'subject')]
+    if any(keywords):
+        metadata['keywords'] = [keyword for keyword in keywords if keyword]
+
+    for date in _items(resource, 'dates', 'date'):
+        if date.get('dateType') == 'Issued':
+            metadata['publication_date'] = _text(date)
+
+    if _text(resource, 'version'):
+        metadata['version'] = _text(resource, 'version')
+
+    for rights in _items(resource, 'rightsList', 'rights'):
+        if rights.get('rightsIdentifier'):
+            metadata['license'] = {'id': rights.get('rightsIdentifier').lower()}
+            break
+
+    resource_type = _child(resource, 'resourceType')
+    if resource_type is not None:
+        general = resource_type.get('resourceTypeGeneral')
+        metadata['resource_type'] = {'type': RESOURCE_TYPES.get(general, 'other')}
+
+    return metadata
+
+
+def parse_record(record):
+    """Zenodo REST-style record of an OAI <record> element
+
+    Deleted records come back as {'id', 'deleted': True, 'updated'}.
+    """
+    header = _child(record, 'header')
+    identifier = _text(header, 'identifier')
+    record_id = identifier.rsplit(':', 1)[-1]
+    parsed = {
+        'id': record_id,
+        'record_id': record_id,
+        'updated': _text(header, 'datestamp'),
+        'sets': [_text(spec) for spec in _children(header, 'setSpec')],
+    }
+    if header.get('status') == 'deleted':
+        parsed['deleted'] = True
+        return parsed
+
+    resource = _find_resource(_child(record, 'metadata'))
+    if resource is None:
+        raise OAIError('badRecord', f'No DataCite metadata in {identifier}')
+
+    for element in _children(resource, 'identifier'):
+        if element.get('identifierType') == 'DOI':
+            parsed['doi'] = _text(element)
+    for element in _items(resource, 'relatedIdentifiers', 'relatedIdentifier'):
+        if element.get('relationType') == 'IsVersionOf' and \
+                element.get('relatedIdentifierType') == 'DOI':
+            parsed['conceptdoi'] = _text(element)
+
+    parsed['metadata'] = parse_datacite(resource)
+    parsed['files'] = []
+    return parsed
+
+
+def parse_page(body):
+    """(records, resumption token or None, responseDate) of a ListRecords response"""
+    root = ET.fromstring(body)
+    response_date = _text(root, 'responseDate')
+
+    error = _child(root, 'error')
+    if error is not None:
+        if error.get('code') == NO_RECORDS:
+            return [], None, response_date
+        raise OAIError(error.get('code'), _text(error))
+
+    list_records = _child(root, 'ListRecords')
+    if list_records is None:
+        return [], None, response_date
+
+    records = [parse_record(record) for record in _children(list_records, 'record')]
+    token = _text(list_records, 'resumptionToken') or None
+    return records, token, response_date
+
+
+def list_records(base_url=OAI_URL, from_date=None, set_name=None, resumption_token=None,
+                 metadata_prefix=METADATA_PREFIX):
+    """Yield (records, next resumption token, responseDate) for each ListRecords page"""
+    if resumption_token:
+        # A resumption token replaces every other argument
+        params = {'verb': 'ListRecords', 'resumptionToken': resumption_token}
+    else:
+        params = {'verb': 'ListRecords', 'metadataPrefix': metadata_prefix}
+        if from_date:
+            params['from'] = from_date
+        if set_name:
+            params['set'] = set_name
+
+    while True:
+        response = upstream.get(base_url, params=params)
+        response.raise_for_status()
+        records, token, response_date = parse_page(response.content)
+        yield records, token, response_date
+        if not token:
+            return
+        params = {'verb': 'ListRecords', 'resumptionToken': token}
+
+
+def state_key(set_name=None):
+    return f"zenodo.oai.{set_name or 'all'}"
+
+
+class ResumableHarvest(object):
+    """ListRecords pages of one set whose resumption point survives restarts
+
+    The state (a JSON string under state_key(set_name)) holds:
+
+    - from: the from= of the run in progress
+    - until: responseDate of its first page, the from= of the next run
+    - token: resumption token of the next page not processed yet
+    - last: until of the last completed run
+    """
+
+    def __init__(self, get_state, set_state, set_name=None, base_url=OAI_URL,
+                 from_date=None, metadata_prefix=METADATA_PREFIX):
+        self.get_state = get_state
+        self.set_state = set_state
+        self.set_name = set_name
+        self.base_url = base_url
+        self.from_date = from_date
+        self.metadata_prefix = metadata_prefix
+        self.key = state_key(set_name)
+        self.resumed = False
+
+    def load(self):
+        value = self.get_state(self.key)
+        return json.loads(value) if value else {}
+
+    def save(self, state):
+        self.set_state(self.key, json.dumps(state))
+
+    def pages(self):
+        """Yield one list of records per page
+
+        The resumption token of a page is saved once the caller asks for the
+        next page, i.e. after the page has been processed.
+        """
+        state = self.load()
+        token = state.get('token') if not self.from_date else None
+        if token:
+            self.resumed = True
+            run = {'from': state.get('from'), 'until': state.get('until')}
+        else:
+            run = {'from': self.from_date or state.get('last'), 'until': None}
+
+        try:
+            for records, next_token, response_date in self._list(run, token):
+                if run['until'] is None:
+                    run['until'] = response_date
+                yield records
+                self.save(dict(state, token=next_token, **run))
+        except OAIError as e:
+            if e.code != 'badResumptionToken' or not token:
+                raise
+            # Expired token: start the interrupted run over from its from=
+            self.save(dict(state, token=None))
+            self.resumed = False
+            self.from_date = run['from']
+            yield from self.pages()
+            return
+
+        self.save({'last': run['until'] or state.get('last'), 'token': None})
+
+    def _list(self, run, token):
+        return list_records(
+            self.base_url, from_date=run['from'], set_name=self.set_name,
+            resumption_token=token, metadata_prefix=self.metadata_prefix
+        )
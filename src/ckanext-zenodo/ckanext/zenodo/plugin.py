@@ -1,6 +1,6 @@
 import ckan.plugins as plugins
 import ckan.plugins.toolkit as toolkit
-from ckanext.zenodo import validators
+from ckanext.zenodo import actions, validators
 
 
 class ZenodoPlugin(plugins.SingletonPlugin):
@@ -10,6 +10,7 @@ class ZenodoPlugin(plugins.SingletonPlugin):
     plugins.implements(plugins.IClick)
     plugins.implements(plugins.IFacets, inherit=True)
     plugins.implements(plugins.ITemplateHelpers) 
+    plugins.implements(plugins.IActions)
 
     def update_config(self, config_):
         toolkit.add_template_directory(config_, "templates")
@@ -59,6 +60,11 @@ class ZenodoPlugin(plugins.SingletonPlugin):
         
         return pkg_dict
     
+    def get_actions(self):
+        return {
+            'zenodo_dataset_lookup': actions.zenodo_dataset_lookup,
+        }
+    
     def get_commands(self):
         from ckanext.zenodo import cli
         return [cli.zenodo]
@@ -0,0 +1,143 @@
+"""
+Machine-readable harvest run reports
+
+A report keeps, for every DOI of a run, its outcome and the seconds spent in
+each stage (lookup, fetch, map, write, index). Each DOI is appended to an
+NDJSON event file as soon as it is done, and the run summary with
+p50/p95/p99 per stage is written as JSON at the end. Work done once for the
+whole run (e.g. preloading the DOI -> dataset map) is recorded as a phase.
+
+No CKAN dependency, so harvest_zenodo.py can use it as well as the CLI.
+"""
+
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from ckanext.zenodo.incremental import utc_now
+
+STAGES = ('lookup', 'fetch', 'map', 'write', 'index')
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers (None if empty)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, int(math.ceil(pct / 100.0 * len(ordered))))
+    return ordered[rank - 1]
+
+
+def stage_summary(values):
+    summary = {
+        'count': len(values),
+        'total': round(sum(values), 6),
+        'mean': round(sum(values) / len(values), 6) if values else None,
+        'max': round(max(values), 6) if values else None,
+    }
+    for pct in PERCENTILES:
+        value = percentile(values, pct)
+        summary[f'p{pct}'] = round(value, 6) if value is not None else None
+    return summary
+
+
+def new_event(doi):
+    """Empty per-DOI event, filled in by timed() and HarvestReport.finish()"""
+    return {'doi': doi, 'timings': {}}
+
+
+@contextmanager
+def timed(event, stage):
+    """Add the time spent in the block to a stage of a DOI event"""
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        elapsed = time.monotonic() - start
+        event['timings'][stage] = event['timings'].get(stage, 0.0) + elapsed
+
+
+def events_path_for(report_path):
+    """Default NDJSON event file next to a JSON report (out.json -> out.ndjson)"""
+    if report_path.endswith('.json'):
+        return report_path[:-len('.json')] + '.ndjson'
+    return report_path + '.ndjson'
+
+
+class HarvestReport(object):
+    """Per-DOI stage timings and outcomes of one harvest run"""
+
+    def __init__(self, report_path=None, events_path=None, command=None):
+        self.report_path = report_path
+        if report_path and not events_path:
+            events_path = events_path_for(report_path)
+        self.events_path = events_path
+        self.command = command
+        self.started = utc_now()
+        self._clock = time.monotonic()
+        self.counts = {}
+        self.phases = {}
+        self.timings = dict((stage, []) for stage in STAGES)
+        self._lock = threading.Lock()
+        self._events = open(events_path, 'w') if events_path else None
+
+    @property
+    def enabled(self):
+        return bool(self.report_path or self.events_path)
+
+    @contextmanager
+    def phase(self, name):
+        """Add the time spent in the block to a run-level phase"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - start
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def finish(self, event, status, error=None):
+        """Record the outcome of a DOI and append its event"""
+        event['status'] = status
+        if error:
+            event['error'] = str(error)
+        event['timings'] = dict(
+            (stage, round(seconds, 6)) for stage, seconds in event['timings'].items()
+        )
+        event['time'] = utc_now()
+
+        with self._lock:
+            self.counts[status] = self.counts.get(status, 0) + 1
+            for stage, seconds in event['timings'].items():
+                self.timings.setdefault(stage, []).append(seconds)
+            if self._events is not None:
+                self._events.write(json.dumps(event, ensure_ascii=False) + '\n')
+                self._events.flush()
+
+    def summary(self):
+        return {
+            'command': self.command,
+            'started': self.started,
+            'finished': utc_now(),
+            'duration': round(time.monotonic() - self._clock, 3),
+            'dois': sum(self.counts.values()),
+            'counts': dict(self.counts),
+            'phases': dict((name, round(seconds, 6)) for name, seconds in self.phases.items()),
+            'stages': dict(
+                (stage, stage_summary(values)) for stage, values in self.timings.items()
+            ),
+            'events': self.events_path,
+        }
+
+    def close(self):
+        """Write the JSON run report and close the event file"""
+        if self._events is not None:
+            self._events.close()
+            self._events = None
+        if self.report_path:
+            with open(self.report_path, 'w') as f:
+                json.dump(self.summary(), f, indent=2)
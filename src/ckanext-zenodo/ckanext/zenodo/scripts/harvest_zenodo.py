@@ -3,14 +3,74 @@
 OBIS Zenodo Harvest Script using API
 """
 
+import asyncio
+import json
 import os
+import re
 import requests
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from requests.adapters import HTTPAdapter
 
-def load_doi_registry():
+try:
+    # Canonical DOIs, the shared upstream client, incremental search and run
+    # reports, available inside the CKAN container
+    from ckanext.doi_import import identifiers, upstream
+    from ckanext.zenodo import incremental
+    from ckanext.zenodo import report as run_report
+except ImportError:
+    identifiers = upstream = incremental = run_report = None
+
+# Zenodo record id in a Zenodo DOI or record URL, when identifiers is unavailable
+ZENODO_RECORD_RE = re.compile(
+    r'zenodo\.org/(?:api/)?records?/(\d+)|10\.5281/zenodo\.(\d+)', re.IGNORECASE
+)
+
+# Where --incremental keeps the start time of the last run without failures
+STATE_FILE = os.getenv(
+    'ZENODO_HARVEST_STATE', os.path.expanduser('~/.zenodo_harvest_state.json')
+)
+
+# CKAN instance to harvest into (--base-url=... or $CKAN_URL)
+CKAN_URL = os.getenv('CKAN_URL', 'http://ckan-dev:5000').rstrip('/')
+
+# DOIs processed at the same time in --async mode (--concurrency=N)
+DEFAULT_CONCURRENCY = 8
+
+_ckan_session = None
+
+def ckan_session(pool_size=None):
+    """Keep-alive session for CKAN API calls, shared by all worker threads"""
+    global _ckan_session
+    if _ckan_session is None:
+        pool_size = pool_size or DEFAULT_CONCURRENCY
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        _ckan_session = requests.Session()
+        _ckan_session.mount('http://', adapter)
+        _ckan_session.mount('https://', adapter)
+    return _ckan_session
+
+def load_doi_registry(token):
+    """Load DOIs from the CKAN registry table, falling back to the text file"""
+    try:
+        response = ckan_session().get(
+            f"{CKAN_URL}/api/action/doi_registry_list",
+            headers={'Authorization': f'Bearer {token}'},
+            timeout=30
+        )
+        data = response.json()
+        if data.get('success'):
+            return [f"https://doi.org/{entry['doi']}" for entry in data['result']]
+        print(f"Warning: Could not read DOI registry from CKAN: {data.get('error')}")
+    except Exception as e:
+        print(f"Warning: Could not read DOI registry from CKAN: {e}")
+    
+    return load_doi_registry_file()
+
+def load_doi_registry_file():
     """Load DOIs from the extension's config directory"""
     # Get the script's directory and navigate to config
-    import os
     script_dir = os.path.dirname(os.path.abspath(__file__))
     registry_file = os.path.join(script_dir, '../config/zenodo_dois.txt')
     
@@ -23,66 +83,154 @@ def load_doi_registry():
         print(f"Warning: DOI registry not found at {registry_file}")
         return dois
     
+    print(f"Using registry file {registry_file}")
+    lines = []
     with open(registry_file, 'r') as f:
         for line in f:
-            doi = line.strip()
+            line = line.strip()
             # Skip empty lines and comments
-            if doi and not doi.startswith('#'):
-                # Normalize zenodo.org/record URLs to DOI format
-                if 'zenodo.org/record/' in doi:
-                    record_id = doi.split('/')[-1]
-                    doi = f"https://doi.org/10.5281/zenodo.{record_id}"
-                dois.append(doi)
+            if line and not line.startswith('#'):
+                lines.append(line)
+    
+    if identifiers is None:
+        # Without ckanext-doi-import the entries are used as written
+        return list(dict.fromkeys(lines))
+    
+    # One canonical DOI URL per record, whatever spelling the registry uses
+    invalid = []
+    dois = [canonical.url for canonical in identifiers.normalize_many(lines, invalid)]
+    for value in invalid:
+        print(f"Warning: Skipping invalid registry entry: {value}")
     return dois
 
-def find_dataset_via_api(doi):
+def get_arg_value(name, argv=None):
+    """Value of a --name=value or --name value command line argument, or None"""
+    import sys
+    args = sys.argv[1:] if argv is None else argv
+    for i, arg in enumerate(args):
+        if arg.startswith(f'--{name}='):
+            return arg.split('=', 1)[1]
+        if arg == f'--{name}' and i + 1 < len(args) and not args[i + 1].startswith('--'):
+            return args[i + 1]
+    return None
+
+def zenodo_record_id(doi):
+    """Zenodo record id of a DOI or record URL, or None"""
+    if identifiers is not None:
+        return identifiers.zenodo_record_id(doi)
+    match = ZENODO_RECORD_RE.search(doi or '')
+    return (match.group(1) or match.group(2)) if match else None
+
+def utc_now():
+    if incremental is not None:
+        return incremental.utc_now()
+    return datetime.now(timezone.utc).replace(microsecond=0).isoformat()
+
+class NullReport(object):
+    """Stand-in for report.HarvestReport when ckanext-zenodo is not installed"""
+    
+    enabled = False
+    
+    def phase(self, name):
+        return nullcontext()
+    
+    def finish(self, event, status, error=None):
+        pass
+
+def new_event(doi):
+    return run_report.new_event(doi) if run_report is not None else {'doi': doi}
+
+def timed(event, stage):
+    return run_report.timed(event, stage) if run_report is not None else nullcontext()
+
+def load_last_harvest():
+    try:
+        with open(STATE_FILE, 'r') as f:
+            return json.load(f).get('last_harvest')
+    except (FileNotFoundError, ValueError):
+        return None
+
+def save_last_harvest(timestamp):
+    with open(STATE_FILE, 'w') as f:
+        json.dump({'last_harvest': timestamp}, f)
+
+def find_datasets_via_api(dois, token):
+    """Look up the datasets of many DOIs with batched exact-match lookups"""
+    found = {}
+    for i in range(0, len(dois), 100):
+        response = ckan_session().post(
+            f"{CKAN_URL}/api/action/zenodo_dataset_lookup",
+            json={'dois': dois[i:i + 100]},
+            headers={'Authorization': f'Bearer {token}'},
+            timeout=60
+        )
+        data = response.json()
+        if not data.get('success'):
+            raise RuntimeError(data.get('error'))
+        found.update(data['result'])
+    return found
+
+def select_incremental(dois, since, token, community=None):
+    """DOIs updated on Zenodo since the given time, plus DOIs not yet in CKAN
+    
+    Also returns the datasets looked up for the DOIs, so they are not
+    looked up again one by one.
+    """
+    record_ids = set(filter(None, (zenodo_record_id(doi) for doi in dois)))
+    changed = incremental.updated_records(record_ids, since, community)
+    datasets = find_datasets_via_api(dois, token)
+    
+    selected = [
+        doi for doi in dois
+        if zenodo_record_id(doi) in changed or not datasets.get(doi)
+    ]
+    print(f"  {len(changed)} updated on Zenodo, {len(selected)} of {len(dois)} DOIs to process\n")
+    return selected, set(changed), datasets
+
+def find_dataset_via_api(doi, token, log=print):
     """Search for existing dataset by DOI or Zenodo URL."""
     try:
-        base_url = "http://ckan-dev:5000"  # Use container name instead
-        
-        # Try searching by the identifier field
-        doi_value = doi.replace('https://doi.org/', '').replace('http://doi.org/', '')
-        url = f"{base_url}/api/action/package_search"
         
-        # Search in the identifier field or url field
-        params = {
-            'fq': f'identifier:*{doi_value}* OR url:"{doi}"',
-            'rows': 1
-        }
+        # Exact-match lookup on the normalized DOI / Zenodo record id,
+        # authorized so that private datasets are found too
+        url = f"{CKAN_URL}/api/action/zenodo_dataset_lookup"
         
-        response = requests.get(url, params=params, timeout=10)
+        response = ckan_session().get(
+            url,
+            params={'doi': doi},
+            headers={'Authorization': f'Bearer {token}'},
+            timeout=10
+        )
         data = response.json()
         
-        if data.get('success') and data['result']['count'] > 0:
-            return data['result']['results'][0]
+        if data.get('success'):
+            return data['result'].get(doi)
         return None
     except Exception as e:
-        print(f"    Search error: {e}")
+        log(f"    Search error: {e}")
         return None
 
-def get_zenodo_last_modified(doi):
+def get_zenodo_last_modified(doi, log=print):
     """Get last modified date from Zenodo record."""
     try:
         # Extract Zenodo ID from DOI
-        if 'zenodo' in doi.lower():
-            zenodo_id = doi.split('/')[-1]
-            if zenodo_id.startswith('zenodo.'):
-                zenodo_id = zenodo_id.replace('zenodo.', '')
-            
-            # Remove any non-numeric characters
-            zenodo_id = ''.join(filter(str.isdigit, zenodo_id))
-            
-            if zenodo_id:
-                url = f"https://zenodo.org/api/records/{zenodo_id}"
-                response = requests.get(url, timeout=30)
+        zenodo_id = zenodo_record_id(doi)
+        
+        if zenodo_id:
+            url = f"https://zenodo.org/api/records/{zenodo_id}"
+            if upstream is not None:
+                # Revalidate any cached copy: a stale date would hide the update
+                data = upstream.get_cached_json(url, ttl=0)
+            else:
+                response = ckan_session().get(url, timeout=30)
                 response.raise_for_status()
                 data = response.json()
-                return data.get('updated')
+            return data.get('updated')
     except Exception as e:
-        print(f"    Zenodo API error: {e}")
+        log(f"    Zenodo API error: {e}")
     return None
 
-def should_update_dataset(ckan_modified, zenodo_modified):
+def should_update_dataset(ckan_modified, zenodo_modified, log=print):
     """Check if dataset should be updated based on modification dates."""
     if not zenodo_modified:
         return False
@@ -102,24 +250,24 @@ def should_update_dataset(ckan_modified, zenodo_modified):
         
         return zenodo_dt > ckan_dt
     except Exception as e:
-        print(f"    Date comparison error: {e}")
+        log(f"    Date comparison error: {e}")
         return False
 
-def update_dataset_via_api(dataset_id, doi, token):
+def update_dataset_via_api(dataset_id, doi, token, log=print):
     """Update existing dataset with fresh DOI metadata."""
     try:
-        base_url = "http://ckan-dev:5000"
         headers = {
             'Authorization': f'Bearer {token}',  # Changed: Added Bearer prefix
             'Content-Type': 'application/json'
         }
         
-        # First, fetch fresh metadata from Zenodo
-        data = {'doi_url': doi}
+        # The record changed (or the update is forced), so CKAN must fetch it
+        # from Zenodo rather than from its response cache
+        data = {'doi_url': doi, 'revalidate': True}
         
         # Use the same harvest endpoint, which will update if dataset exists
-        response = requests.post(
-            f'{base_url}/api/harvest-doi',
+        response = ckan_session().post(
+            f'{CKAN_URL}/api/harvest-doi',
             json=data,
             headers=headers,
             timeout=60
@@ -127,24 +275,28 @@ def update_dataset_via_api(dataset_id, doi, token):
         
         if response.status_code == 200:
             result = response.json()
-            print(f"    ✓ Updated: {result.get('dataset', {}).get('title', 'Unknown')}")
-            return True
+            title = result.get('dataset', {}).get('title', 'Unknown')
+            if result.get('action') == 'unchanged':
+                # Same metadata hash: CKAN skipped the write and the reindex
+                log(f"    = Unchanged: {title}")
+                return 'unchanged'
+            log(f"    ✓ Updated: {title}")
+            return 'updated'
         else:
             try:
                 error_msg = response.json().get('error', 'Unknown error')
             except:
                 error_msg = f"HTTP {response.status_code}: {response.text[:200]}"
-            print(f"    ✗ Update failed: {error_msg}")
+            log(f"    ✗ Update failed: {error_msg}")
             return False
             
     except Exception as e:
-        print(f"    Update error: {e}")
+        log(f"    Update error: {e}")
         return False
 
-def import_new_dataset_via_api(doi, token):
+def import_new_dataset_via_api(doi, token, log=print):
     """Import new dataset using the harvest API endpoint."""
     try:
-        base_url = "http://ckan-dev:5000"
         headers = {
             'Authorization': f'Bearer {token}',  # Changed: Added Bearer prefix
             'Content-Type': 'application/json'
@@ -152,8 +304,8 @@ def import_new_dataset_via_api(doi, token):
         
         data = {'doi_url': doi}
         
-        response = requests.post(
-            f'{base_url}/api/harvest-doi',
+        response = ckan_session().post(
+            f'{CKAN_URL}/api/harvest-doi',
             json=data,
             headers=headers,
             timeout=60
@@ -161,25 +313,112 @@ def import_new_dataset_via_api(doi, token):
         
         if response.status_code == 200:
             result = response.json()
-            print(f"    ✓ Imported: {result.get('dataset', {}).get('title', 'Unknown')}")
+            log(f"    ✓ Imported: {result.get('dataset', {}).get('title', 'Unknown')}")
             return True
         else:
             try:
                 error_msg = response.json().get('error', 'Unknown error')
             except:
                 error_msg = f"HTTP {response.status_code}: {response.text[:200]}"
-            print(f"    ✗ Import failed: {error_msg}")
+            log(f"    ✗ Import failed: {error_msg}")
             return False
             
     except Exception as e:
-        print(f"    Import error: {e}")
+        log(f"    Import error: {e}")
         return False
 
+def process_doi(i, total, doi, token, force_update, changed_record_ids, datasets, report,
+                log=print):
+    """Look up, update or import one DOI; returns (status, found in CKAN)
+    
+    ``datasets`` maps DOIs already looked up to their dataset or None.
+    """
+    log(f"[{i}/{total}] Processing: {doi}")
+    event = new_event(doi)
+    status = 'skipped'
+    found = False
+    
+    try:
+        # Find in CKAN, unless the incremental selection already did
+        if doi in datasets:
+            dataset = datasets[doi]
+        else:
+            with timed(event, 'lookup'):
+                dataset = find_dataset_via_api(doi, token, log=log)
+        
+        if dataset:
+            # Existing dataset - check for updates
+            found = True
+            log(f"  ✓ Found in CKAN: {dataset['title']}")
+            log(f"    CKAN modified: {dataset.get('metadata_modified', 'Unknown')}")
+            
+            if force_update or zenodo_record_id(doi) in changed_record_ids:
+                log(f"    → {'Force updating' if force_update else 'Updated on Zenodo, refreshing'}...")
+                with timed(event, 'write'):
+                    status = update_dataset_via_api(dataset['id'], doi, token, log=log) or 'failed'
+            else:
+                # Check if Zenodo has updates
+                with timed(event, 'fetch'):
+                    zenodo_modified = get_zenodo_last_modified(doi, log=log)
+                if zenodo_modified:
+                    log(f"    Zenodo updated: {zenodo_modified}")
+                    if should_update_dataset(dataset.get('metadata_modified'), zenodo_modified, log=log):
+                        log(f"    → Updating with latest Zenodo data...")
+                        with timed(event, 'write'):
+                            status = update_dataset_via_api(dataset['id'], doi, token, log=log) or 'failed'
+                    else:
+                        log(f"    → No update needed (CKAN is current)")
+        else:
+            # New dataset - import it
+            log(f"  → Not in CKAN, importing...")
+            with timed(event, 'write'):
+                imported = import_new_dataset_via_api(doi, token, log=log)
+            status = 'imported' if imported else 'failed'
+    except Exception as e:
+        log(f"    Error: {e}")
+        status = 'failed'
+    
+    report.finish(event, status)
+    log()  # Blank line between entries
+    return status, found
+
+async def harvest_async(dois, process, concurrency):
+    """Process up to `concurrency` DOIs at a time; returns the outcomes in DOI order
+    
+    The blocking CKAN/Zenodo calls run in a thread pool over keep-alive
+    sessions. Each DOI's output is printed in one block when it completes.
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    
+    async def run(i, doi):
+        async with semaphore:
+            lines = []
+            outcome = await loop.run_in_executor(
+                executor, process, i, doi, lambda *args: lines.append(' '.join(map(str, args)))
+            )
+            print('\n'.join(lines))
+            return outcome
+    
+    try:
+        return await asyncio.gather(*(run(i, doi) for i, doi in enumerate(dois, 1)))
+    finally:
+        executor.shutdown()
+
 def main():
     import sys
+    global CKAN_URL
     
     print("=== Zenodo DOI Harvest ===\n")
     
+    # --base-url=http://host:port: CKAN instance to harvest into
+    CKAN_URL = (get_arg_value('base-url') or CKAN_URL).rstrip('/')
+    concurrency = int(get_arg_value('concurrency') or DEFAULT_CONCURRENCY)
+    ckan_session(pool_size=concurrency)
+    # Size the Zenodo connection pool to the number of concurrent DOIs
+    os.environ.setdefault('CKANEXT__DOI_IMPORT__HTTP__POOL_MAXSIZE', str(max(10, concurrency)))
+    
     # Check for --force flag
     force_update = '--force' in sys.argv
     if force_update:
@@ -200,59 +439,64 @@ def main():
         print("  python harvest_zenodo.py")
         return
     
+    # --report=out.json / --events=out.ndjson: per-DOI outcomes and stage timings
+    if run_report is not None:
+        report = run_report.HarvestReport(
+            get_arg_value('report'), get_arg_value('events'), command='harvest_zenodo.py'
+        )
+    else:
+        if get_arg_value('report') or get_arg_value('events'):
+            print("Warning: --report and --events need ckanext-zenodo, no report is written\n")
+        report = NullReport()
+    
     # Load DOI registry
-    dois = load_doi_registry()
+    started = utc_now()
+    with report.phase('registry'):
+        dois = load_doi_registry(token)
     if not dois:
         print("No DOIs found in registry")
         return
         
     print(f"Found {len(dois)} DOIs to process\n")
     
-    found_count = 0
-    imported_count = 0
-    updated_count = 0
-    failed_count = 0
-    
-    for i, doi in enumerate(dois, 1):
-        print(f"[{i}/{len(dois)}] Processing: {doi}")
-        
-        # Find in CKAN
-        dataset = find_dataset_via_api(doi)
-        
-        if dataset:
-            # Existing dataset - check for updates
-            print(f"  ✓ Found in CKAN: {dataset['title']}")
-            print(f"    CKAN modified: {dataset.get('metadata_modified', 'Unknown')}")
-            
-            if force_update:
-                print(f"    → Force updating...")
-                if update_dataset_via_api(dataset['id'], doi, token):
-                    updated_count += 1
-                else:
-                    failed_count += 1
-            else:
-                # Check if Zenodo has updates
-                zenodo_modified = get_zenodo_last_modified(doi)
-                if zenodo_modified:
-                    print(f"    Zenodo updated: {zenodo_modified}")
-                    if should_update_dataset(dataset.get('metadata_modified'), zenodo_modified):
-                        print(f"    → Updating with latest Zenodo data...")
-                        if update_dataset_via_api(dataset['id'], doi, token):
-                            updated_count += 1
-                        else:
-                            failed_count += 1
-                    else:
-                        print(f"    → No update needed (CKAN is current)")
-            found_count += 1
+    # --incremental: one Zenodo search for records updated since the last run
+    # replaces the per-DOI update checks
+    changed_record_ids = set()
+    datasets = {}
+    since = get_arg_value('since')
+    if ('--incremental' in sys.argv or since) and incremental is None:
+        print("Incremental mode needs ckanext-zenodo and ckanext-doi-import, running a full harvest\n")
+    elif '--incremental' in sys.argv or since:
+        since = since or load_last_harvest()
+        if since:
+            print(f"INCREMENTAL MODE: records updated since {since}")
+            try:
+                with report.phase('incremental_search'):
+                    dois, changed_record_ids, datasets = select_incremental(
+                        dois, since, token, get_arg_value('community')
+                    )
+            except Exception as e:
+                print(f"Zenodo search failed ({e}), running a full harvest\n")
         else:
-            # New dataset - import it
-            print(f"  → Not in CKAN, importing...")
-            if import_new_dataset_via_api(doi, token):
-                imported_count += 1
-            else:
-                failed_count += 1
-        
-        print()  # Blank line between entries
+            print("No previous harvest recorded, running a full harvest\n")
+    
+    def process(i, doi, log=print):
+        return process_doi(
+            i, len(dois), doi, token, force_update, changed_record_ids, datasets, report, log
+        )
+    
+    if '--async' in sys.argv:
+        print(f"ASYNC MODE: {concurrency} DOIs at a time against {CKAN_URL}\n")
+        outcomes = asyncio.run(harvest_async(dois, process, concurrency))
+    else:
+        outcomes = [process(i, doi) for i, doi in enumerate(dois, 1)]
+    
+    statuses = [status for status, found in outcomes]
+    found_count = sum(1 for status, found in outcomes if found)
+    imported_count = statuses.count('imported')
+    updated_count = statuses.count('updated')
+    unchanged_count = statuses.count('unchanged')
+    failed_count = statuses.count('failed')
     
     print("=" * 50)
     print(f"Summary:")
@@ -260,8 +504,22 @@ def main():
     print(f"  Already in CKAN: {found_count}")
     print(f"  Newly imported: {imported_count}")
     print(f"  Updated: {updated_count}")
+    print(f"  Unchanged (skipped write): {unchanged_count}")
     print(f"  Failed: {failed_count}")
     print("=" * 50)
+    
+    if report.enabled:
+        report.close()
+        for stage, timing in report.summary()['stages'].items():
+            if timing['count']:
+                print(f"  {stage}: p50 {timing['p50']:.3f}s, p95 {timing['p95']:.3f}s, "
+                      f"p99 {timing['p99']:.3f}s ({timing['count']} DOIs)")
+        print(f"Report written to {report.report_path or report.events_path}")
+    
+    # Failed DOIs must be retried, so only a clean run moves the mark forward
+    if failed_count == 0:
+        save_last_harvest(started)
+        print(f"Last harvest time set to {started} ({STATE_FILE})")
 
 
 if __name__ == '__main__':
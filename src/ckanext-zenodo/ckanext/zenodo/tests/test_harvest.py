@@ -0,0 +1,303 @@
+"""
+Tests for the harvest helpers of cli.py.
+
+CKAN actions, the registry table and Zenodo are replaced with monkeypatched
+functions, so these run without a database or network.
+"""
+import threading
+import time
+
+import pytest
+
+from ckanext.doi_import import model as import_model
+from ckanext.zenodo import cli
+
+
+def test_prepared_items_keep_registry_order():
+    def prepare(doi):
+        # Later DOIs finish first
+        time.sleep(0.01 * (5 - doi))
+        return doi
+
+    assert list(cli.iter_prepared(range(5), prepare, workers=4)) == [0, 1, 2, 3, 4]
+
+
+def test_single_worker_prepares_inline():
+    threads = set()
+
+    def prepare(doi):
+        threads.add(threading.current_thread())
+        return doi
+
+    assert list(cli.iter_prepared(['a', 'b'], prepare, workers=1)) == ['a', 'b']
+    assert threads == {threading.current_thread()}
+
+
+def test_prefetch_is_bounded():
+    pulled = []
+
+    def registry():
+        for doi in range(100):
+            pulled.append(doi)
+            yield doi
+
+    items = cli.iter_prepared(registry(), lambda doi: doi, workers=2)
+
+    assert next(items) == 0
+    assert len(pulled) == 2 * cli.PREFETCH_PER_WORKER
+    assert list(items) == list(range(1, 100))
+
+
+def test_incremental_selection(monkeypatch):
+    dois = ['10.5281/zenodo.1', '10.5281/zenodo.2', '10.5281/zenodo.3',
+            '10.5281/zenodo.4', '10.1234/other']
+    datasets = {doi: {'id': doi} for doi in dois if doi != '10.5281/zenodo.3'}
+    registry = [
+        {'doi': '10.5281/zenodo.1', 'status': import_model.REGISTRY_HARVESTED},
+        {'doi': '10.5281/zenodo.2', 'status': import_model.REGISTRY_HARVESTED},
+        {'doi': '10.5281/zenodo.3', 'status': import_model.REGISTRY_PENDING},
+        {'doi': '10.5281/zenodo.4', 'status': import_model.REGISTRY_FAILED},
+        {'doi': '10.1234/other', 'status': import_model.REGISTRY_HARVESTED},
+    ]
+    searched = []
+
+    def updated_records(record_ids, since, community):
+        searched.append((sorted(record_ids), since, community))
+        return {'2': {'id': 2}}
+
+    monkeypatch.setattr(cli.incremental_harvest, 'updated_records', updated_records)
+    monkeypatch.setattr(import_model, 'registry_list', lambda: registry)
+
+    selected, changed = cli.select_incremental(dois, datasets, '2024-06-01T00:00:00Z')
+
+    # 1 and other: harvested and unchanged; 2: updated; 3: no dataset; 4: failed
+    assert selected == ['10.5281/zenodo.2', '10.5281/zenodo.3', '10.5281/zenodo.4']
+    assert changed == {'2': {'id': 2}}
+    assert searched == [(['1', '2', '3', '4'], '2024-06-01T00:00:00Z', None)]
+
+    # A registry file has no status to go by
+    selected, changed = cli.select_incremental(dois, datasets, '2024-06-01T00:00:00Z',
+                                               use_registry_status=False)
+    assert selected == ['10.5281/zenodo.2', '10.5281/zenodo.3']
+
+
+def harvest_item(action, dataset=True, **kwargs):
+    item = {'doi': '10.5281/zenodo.1', 'action': action, 'error': None,
+            'dataset': {'id': 'id-1', 'name': 'one', 'title': 'One'} if dataset else None,
+            'metadata': {'title': 'One'}, 'upstream_updated': '2024-06-01T10:00:00Z',
+            'event': cli.run_report.new_event('10.5281/zenodo.1'), 'log': []}
+    item.update(kwargs)
+    return item
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """Registry writes and CKAN writes; returns the registry writes"""
+    recorded = []
+
+    def registry_record(doi, status, upstream_updated=None, error=None):
+        recorded.append((doi, status))
+
+    monkeypatch.setattr(import_model, 'registry_record', registry_record)
+    monkeypatch.setattr(cli, 'import_dataset', lambda doi, org, metadata: None)
+    monkeypatch.setattr(cli, 'update_dataset', lambda dataset, doi, org, metadata: 'unchanged')
+    return recorded
+
+
+def stats():
+    return {'found': 0, 'imported': 0, 'updated': 0, 'unchanged': 0, 'failed': 0}
+
+
+def test_up_to_date_outcomes_are_recorded_as_harvested(registry):
+    assert cli.write_harvest_item(harvest_item('skip'), 'org', stats()) == ('skipped', None)
+    assert cli.write_harvest_item(harvest_item('update'), 'org', stats()) == ('unchanged', None)
+
+    assert registry == [('10.5281/zenodo.1', import_model.REGISTRY_HARVESTED)] * 2
+
+
+def test_zenodo_error_fails_an_existing_dataset(registry, monkeypatch):
+    def fetch_zenodo_record(doi, revalidate=False):
+        raise RuntimeError('502 Server Error')
+
+    monkeypatch.setattr(cli, 'fetch_zenodo_record', fetch_zenodo_record)
+    item = cli.prepare_harvest('10.5281/zenodo.1', {'id': 'id-1', 'title': 'One'})
+    counts = stats()
+
+    assert item['action'] == 'skip'
+    assert cli.write_harvest_item(item, 'org', counts) == ('failed', '502 Server Error')
+    assert registry == [('10.5281/zenodo.1', import_model.REGISTRY_FAILED)]
+    assert counts['failed'] == 1
+
+
+def test_failure_is_recorded(registry):
+    counts = stats()
+    item = harvest_item('import', dataset=False, error='DOI not found')
+
+    assert cli.write_harvest_item(item, 'org', counts) == ('failed', 'DOI not found')
+    assert registry == [('10.5281/zenodo.1', import_model.REGISTRY_FAILED)]
+    assert counts['failed'] == 1
+
+
+def indexed_row(record_id, modified='2024-01-01T00:00:00'):
+    return {
+        'id': f'id-{record_id}', 'name': f'record-{record_id}', 'title': f'Record {record_id}',
+        'metadata_modified': modified,
+        cli.DOI_FIELD: [f'10.5281/zenodo.{record_id}'],
+        cli.RECORD_ID_FIELD: str(record_id),
+        cli.HASH_FIELD: [f'hash-{record_id}'],
+    }
+
+
+def test_preload_pages_through_harvested_datasets(monkeypatch):
+    rows = [indexed_row(i) for i in range(5)]
+    searches = []
+
+    def package_search(context, data_dict):
+        searches.append(data_dict)
+        start, rows_per_page = data_dict['start'], data_dict['rows']
+        return {'count': len(rows), 'results': rows[start:start + rows_per_page]}
+
+    monkeypatch.setattr(cli, 'PRELOAD_PAGE_SIZE', 2)
+    monkeypatch.setattr(cli.toolkit, 'get_action', lambda name: package_search)
+
+    datasets = cli.preload_datasets([
+        '10.5281/zenodo.1', 'https://zenodo.org/records/4', '10.5281/zenodo.9',
+    ])
+
+    assert [search['start'] for search in searches] == [0, 2, 4]
+    assert searches[0]['fl'] == cli.PRELOAD_FIELDS
+    assert datasets == {
+        '10.5281/zenodo.1': {'id': 'id-1', 'name': 'record-1', 'title': 'Record 1',
+                             'metadata_modified': '2024-01-01T00:00:00',
+                             'metadata_hash': 'hash-1'},
+        'https://zenodo.org/records/4': {'id': 'id-4', 'name': 'record-4', 'title': 'Record 4',
+                                         'metadata_modified': '2024-01-01T00:00:00',
+                                         'metadata_hash': 'hash-4'},
+        '10.5281/zenodo.9': None,
+    }
+
+
+def test_preload_falls_back_to_batched_lookups(monkeypatch):
+    def package_search(context, data_dict):
+        raise RuntimeError('Solr is down')
+
+    monkeypatch.setattr(cli.toolkit, 'get_action', lambda name: package_search)
+    monkeypatch.setattr(cli, 'find_datasets_by_doi', lambda dois: {doi: None for doi in dois})
+
+    assert cli.preload_datasets(['10.5281/zenodo.1']) == {'10.5281/zenodo.1': None}
+
+
+ZENODO_RECORD = {
+    'id': 1, 'doi': '10.5281/zenodo.1', 'updated': '2024-06-01T10:00:00+00:00',
+    'metadata': {'title': 'One', 'resource_type': {'type': 'dataset'}}, 'files': [],
+}
+
+
+@pytest.fixture
+def fetches(monkeypatch):
+    """Zenodo record fetches made by prepare_harvest"""
+    made = []
+
+    def fetch_zenodo_record(doi, revalidate=False):
+        # Harvests never map a cached copy without asking Zenodo
+        assert revalidate
+        made.append(doi)
+        return dict(ZENODO_RECORD, record_id='1')
+
+    def fetch_doi_metadata(doi, revalidate=False):
+        assert revalidate
+        made.append(doi)
+        return {'title': 'Other'}
+
+    monkeypatch.setattr(cli, 'fetch_zenodo_record', fetch_zenodo_record)
+    monkeypatch.setattr(cli, 'fetch_doi_metadata', fetch_doi_metadata)
+    return made
+
+
+def test_new_record_is_fetched_once(fetches):
+    item = cli.prepare_harvest('10.5281/zenodo.1', None)
+
+    assert fetches == ['10.5281/zenodo.1']
+    assert item['action'] == 'import'
+    assert item['metadata']['title'] == 'One'
+
+
+def test_stale_dataset_is_updated_from_the_same_fetch(fetches):
+    dataset = {'id': 'id-1', 'title': 'One', 'metadata_modified': '2024-01-01T00:00:00'}
+    item = cli.prepare_harvest('10.5281/zenodo.1', dataset)
+
+    assert fetches == ['10.5281/zenodo.1']
+    assert item['action'] == 'update'
+    assert item['upstream_updated'] == ZENODO_RECORD['updated']
+    assert item['metadata']['title'] == 'One'
+
+
+def test_current_dataset_is_skipped(fetches):
+    dataset = {'id': 'id-1', 'title': 'One', 'metadata_modified': '2024-07-01T00:00:00'}
+    item = cli.prepare_harvest('10.5281/zenodo.1', dataset)
+
+    assert fetches == ['10.5281/zenodo.1']
+    assert item['action'] == 'skip'
+    assert item['metadata'] is None
+
+
+def test_incremental_search_hit_needs_no_fetch(fetches):
+    dataset = {'id': 'id-1', 'title': 'One', 'metadata_modified': '2024-07-01T00:00:00'}
+    item = cli.prepare_harvest('10.5281/zenodo.1', dataset, dict(ZENODO_RECORD))
+
+    assert fetches == []
+    assert item['action'] == 'update'
+
+
+def test_other_doi_is_fetched_once(fetches):
+    item = cli.prepare_harvest('10.1234/other', None)
+
+    assert fetches == ['10.1234/other']
+    assert item['metadata'] == {'title': 'Other'}
+
+
+def test_should_update_compares_naive_ckan_times_as_utc():
+    assert cli.should_update('2024-06-01T09:00:00.123456', '2024-06-01T10:00:00+00:00')
+    assert not cli.should_update('2024-06-01T11:00:00', '2024-06-01T12:00:00+02:00')
+    assert not cli.should_update('2024-06-01T09:00:00', None)
+
+
+def test_checkpoint_hash_is_the_stored_hash():
+    metadata = {'title': 'One', 'file_manifest': [{'name': 'a.csv'}]}
+    expected = cli.metadata_hash(metadata)
+
+    # What doi_create_dataset leaves behind after writing
+    written = dict(metadata, metadata_hash=expected)
+    del written['file_manifest']
+
+    assert cli.checkpoint_hash(written) == expected
+    assert cli.checkpoint_hash(dict(metadata)) == expected
+    assert cli.checkpoint_hash(None) is None
+
+
+def test_new_version_matches_dataset_of_its_concept(monkeypatch):
+    old_version = {'id': 'id-1', 'concept_doi': 'https://doi.org/10.5281/zenodo.100'}
+    current = {'id': 'id-3'}
+    looked_up = []
+
+    def find_datasets_by_doi(dois):
+        looked_up.append(dois)
+        found = {'10.5281/zenodo.100': old_version, '10.5281/zenodo.3': current}
+        return {doi: found.get(doi) for doi in dois}
+
+    monkeypatch.setattr(cli, 'find_datasets_by_doi', find_datasets_by_doi)
+
+    datasets = cli.find_version_datasets({
+        '10.5281/zenodo.2': '10.5281/zenodo.100',
+        '10.5281/zenodo.3': '10.5281/zenodo.200',
+        '10.5281/zenodo.4': None,
+    })
+
+    assert datasets == {
+        '10.5281/zenodo.2': old_version,
+        '10.5281/zenodo.3': current,
+        '10.5281/zenodo.4': None,
+    }
+    # One lookup for the page
+    assert looked_up == [['10.5281/zenodo.2', '10.5281/zenodo.3', '10.5281/zenodo.4',
+                          '10.5281/zenodo.100', '10.5281/zenodo.200']]
@@ -0,0 +1,81 @@
+"""
+Tests for the standalone scripts/harvest_zenodo.py helpers.
+"""
+import importlib.util
+import os
+
+import pytest
+
+SCRIPT = os.path.join(os.path.dirname(__file__), '..', 'scripts', 'harvest_zenodo.py')
+
+
+@pytest.fixture
+def script():
+    spec = importlib.util.spec_from_file_location('harvest_zenodo', SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.mark.parametrize('argv, expected', [
+    (['--since=2024-06-01'], '2024-06-01'),
+    (['--since', '2024-06-01'], '2024-06-01'),
+    (['--force', '--since', '2024-06-01', '--incremental'], '2024-06-01'),
+    (['--since', '--incremental'], None),
+    (['--since'], None),
+    (['--report=out.json'], None),
+])
+def test_get_arg_value(script, argv, expected):
+    assert script.get_arg_value('since', argv) == expected
+
+
+def test_fallbacks_without_ckan_extensions(script, monkeypatch):
+    monkeypatch.setattr(script, 'identifiers', None)
+    monkeypatch.setattr(script, 'run_report', None)
+
+    assert script.zenodo_record_id('https://doi.org/10.5281/zenodo.12345') == '12345'
+    assert script.zenodo_record_id('https://zenodo.org/api/records/678') == '678'
+    assert script.zenodo_record_id('10.1234/abc') is None
+
+    report = script.NullReport()
+    event = script.new_event('10.1234/abc')
+    with report.phase('registry'), script.timed(event, 'lookup'):
+        pass
+    report.finish(event, 'skipped')
+    assert not report.enabled
+
+
+def test_dataset_lookup_is_authorized(script, monkeypatch):
+    calls = []
+
+    class Response(object):
+        def json(self):
+            return {'success': True, 'result': {'10.1234/abc': {'id': 'private-dataset'}}}
+
+    class Session(object):
+        def get(self, url, params=None, headers=None, timeout=None):
+            calls.append(headers)
+            return Response()
+
+    monkeypatch.setattr(script, 'ckan_session', lambda: Session())
+
+    assert script.find_dataset_via_api('10.1234/abc', 'secret') == {'id': 'private-dataset'}
+    assert calls == [{'Authorization': 'Bearer secret'}]
+
+
+def test_incremental_lookups_are_not_repeated(script, monkeypatch):
+    def find_dataset_via_api(doi, token, log=print):
+        raise AssertionError(f'{doi} looked up again')
+
+    monkeypatch.setattr(script, 'find_dataset_via_api', find_dataset_via_api)
+    monkeypatch.setattr(script, 'update_dataset_via_api', lambda *args, **kwargs: 'updated')
+    monkeypatch.setattr(script, 'import_new_dataset_via_api', lambda *args, **kwargs: True)
+    monkeypatch.setattr(script, 'zenodo_record_id', lambda doi: doi.rsplit('.', 1)[-1])
+    datasets = {'10.5281/zenodo.1': {'id': 'one', 'title': 'One'}, '10.5281/zenodo.2': None}
+
+    outcomes = [
+        script.process_doi(i, 2, doi, 'secret', False, {'1'}, datasets, script.NullReport(),
+                           log=lambda *args: None)
+        for i, doi in enumerate(datasets, 1)
+    ]
+    assert outcomes == [('updated', True), ('imported', False)]
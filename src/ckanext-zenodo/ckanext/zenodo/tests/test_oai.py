@@ -0,0 +1,267 @@
+"""
+Tests for oai.py, against a stub OAI-PMH server running in a thread.
+"""
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+from click.testing import CliRunner
+
+from ckanext.doi_import import model as import_model
+from ckanext.zenodo import cli, oai
+
+RECORD = """
+<record>
+  <header>
+    <identifier>oai:zenodo.org:{record_id}</identifier>
+    <datestamp>2024-06-0{day}T10:00:00Z</datestamp>
+    <setSpec>user-obis</setSpec>
+  </header>
+  <metadata>
+    <oai_datacite xmlns="http://schema.datacite.org/oai/oai-1.1/">
+      <payload>
+        <resource xmlns="http://datacite.org/schema/kernel-4">
+          <identifier identifierType="DOI">10.5281/zenodo.{record_id}</identifier>
+          <creators>
+            <creator>
+              <creatorName>Doe, Jane</creatorName>
+              <nameIdentifier nameIdentifierScheme="ORCID">0000-0002-1825-0097</nameIdentifier>
+              <affiliation>Flanders Marine Institute</affiliation>
+            </creator>
+          </creators>
+          <titles><title>Record {record_id}</title></titles>
+          <subjects><subject>biodiversity</subject><subject>OBIS</subject></subjects>
+          <dates><date dateType="Issued">2024-05-01</date></dates>
+          <resourceType resourceTypeGeneral="Dataset"/>
+          <relatedIdentifiers>
+            <relatedIdentifier relatedIdentifierType="DOI" relationType="IsVersionOf">10.5281/zenodo.100</relatedIdentifier>
+          </relatedIdentifiers>
+          <version>2.0</version>
+          <rightsList>
+            <rights rightsURI="https://creativecommons.org/licenses/by/4.0/legalcode" rightsIdentifier="cc-by-4.0">Creative Commons Attribution 4.0 International</rights>
+          </rightsList>
+          <descriptions><description descriptionType="Abstract">Occurrences of record {record_id}</description></descriptions>
+        </resource>
+      </payload>
+    </oai_datacite>
+  </metadata>
+</record>
+"""
+
+DELETED = """
+<record>
+  <header status="deleted">
+    <identifier>oai:zenodo.org:{record_id}</identifier>
+    <datestamp>2024-06-0{day}T10:00:00Z</datestamp>
+  </header>
+</record>
+"""
+
+RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
+<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">
+  <responseDate>{response_date}</responseDate>
+  <request verb="ListRecords">https://zenodo.org/oai2d</request>
+  {body}
+</OAI-PMH>
+"""
+
+RESPONSE_DATE = '2024-06-10T12:00:00Z'
+
+# Two pages: records 1 and 2, then a deleted record 3
+PAGES = {
+    None: (RECORD.format(record_id=1, day=1) + RECORD.format(record_id=2, day=2), 'page-2'),
+    'page-2': (DELETED.format(record_id=3, day=3), None),
+}
+
+
+def error(code):
+    return RESPONSE.format(
+        response_date=RESPONSE_DATE, body=f'<error code="{code}">{code}</error>'
+    )
+
+
+class StubOAIHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        params = dict((key, values[0]) for key, values in parse_qs(urlparse(self.path).query).items())
+        self.server.requests.append(params)
+
+        token = params.get('resumptionToken')
+        if token not in PAGES:
+            body = error('badResumptionToken')
+        elif params.get('set') == 'user-empty':
+            body = error('noRecordsMatch')
+        else:
+            records, next_token = PAGES[token]
+            body = RESPONSE.format(
+                response_date=RESPONSE_DATE,
+                body='<ListRecords>{}<resumptionToken>{}</resumptionToken></ListRecords>'.format(
+                    records, next_token or ''
+                ),
+            )
+
+        payload = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def oai_server(monkeypatch):
+    # Local server: no rate limiting, no retries
+    monkeypatch.setenv('CKANEXT__DOI_IMPORT__RATELIMIT__ENABLED', 'false')
+    monkeypatch.setenv('CKANEXT__DOI_IMPORT__HTTP__RETRIES', '0')
+
+    server = HTTPServer(('127.0.0.1', 0), StubOAIHandler)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = f'http://127.0.0.1:{server.server_port}/oai2d'
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def state():
+    return {}
+
+
+def harvest(server, state, **kwargs):
+    return oai.ResumableHarvest(state.get, state.__setitem__, base_url=server.url, **kwargs)
+
+
+def test_list_records_follows_resumption_tokens(oai_server):
+    pages = list(oai.list_records(oai_server.url, from_date='2024-06-01', set_name='user-obis'))
+
+    assert [len(records) for records, token, response_date in pages] == [2, 1]
+    assert [token for records, token, response_date in pages] == ['page-2', None]
+    assert oai_server.requests[0] == {
+        'verb': 'ListRecords', 'metadataPrefix': 'oai_datacite',
+        'from': '2024-06-01', 'set': 'user-obis',
+    }
+    # A resumption token replaces every other argument
+    assert oai_server.requests[1] == {'verb': 'ListRecords', 'resumptionToken': 'page-2'}
+
+
+def test_parsed_record_has_zenodo_shape(oai_server):
+    records, token, response_date = next(oai.list_records(oai_server.url))
+    record = records[0]
+
+    assert record['id'] == '1'
+    assert record['doi'] == '10.5281/zenodo.1'
+    assert record['conceptdoi'] == '10.5281/zenodo.100'
+    assert record['updated'] == '2024-06-01T10:00:00Z'
+    assert record['files'] == []
+    assert record['metadata'] == {
+        'title': 'Record 1',
+        'creators': [{
+            'name': 'Doe, Jane',
+            'affiliation': 'Flanders Marine Institute',
+            'orcid': '0000-0002-1825-0097',
+        }],
+        'description': 'Occurrences of record 1',
+        'keywords': ['biodiversity', 'OBIS'],
+        'publication_date': '2024-05-01',
+        'version': '2.0',
+        'license': {'id': 'cc-by-4.0'},
+        'resource_type': {'type': 'dataset'},
+    }
+
+
+def test_deleted_record(oai_server):
+    pages = list(oai.list_records(oai_server.url))
+    assert pages[1][0] == [{
+        'id': '3', 'record_id': '3', 'updated': '2024-06-03T10:00:00Z', 'sets': [], 'deleted': True,
+    }]
+
+
+def test_no_records_match_is_empty(oai_server):
+    assert list(oai.list_records(oai_server.url, set_name='user-empty')) == [([], None, RESPONSE_DATE)]
+
+
+def test_completed_run_sets_next_from(oai_server, state):
+    source = harvest(oai_server, state, set_name='user-obis')
+    assert [len(records) for records in source.pages()] == [2, 1]
+
+    assert source.load() == {'last': RESPONSE_DATE, 'token': None}
+
+    # The next run asks for changes since the first response of this one
+    list(harvest(oai_server, state, set_name='user-obis').pages())
+    assert oai_server.requests[2]['from'] == RESPONSE_DATE
+
+
+def test_interrupted_run_resumes_after_last_processed_page(oai_server, state):
+    state[oai.state_key('user-obis')] = '{"last": "2024-01-01T00:00:00Z"}'
+
+    pages = harvest(oai_server, state, set_name='user-obis').pages()
+    next(pages)
+    next(pages)  # first page processed, second page in progress
+    pages.close()  # interrupted
+
+    saved = harvest(oai_server, state, set_name='user-obis').load()
+    assert saved['token'] == 'page-2'
+    assert saved['from'] == '2024-01-01T00:00:00Z'
+
+    source = harvest(oai_server, state, set_name='user-obis')
+    assert [len(records) for records in source.pages()] == [1]
+    assert source.resumed
+    assert oai_server.requests[-1] == {'verb': 'ListRecords', 'resumptionToken': 'page-2'}
+    assert source.load() == {'last': RESPONSE_DATE, 'token': None}
+
+
+def test_expired_token_restarts_interrupted_run(oai_server, state):
+    state[oai.state_key()] = (
+        '{"token": "expired", "from": "2024-01-01T00:00:00Z", "until": "2024-01-02T00:00:00Z"}'
+    )
+
+    assert [len(records) for records in harvest(oai_server, state).pages()] == [2, 1]
+    assert oai_server.requests[1]['from'] == '2024-01-01T00:00:00Z'
+
+
+def test_set_spec():
+    assert oai.set_spec('obis') == 'user-obis'
+    assert oai.set_spec('user-obis') == 'user-obis'
+    assert oai.set_spec(None) is None
+
+
+def test_new_versions_update_the_dataset_of_their_concept(oai_server, state, monkeypatch):
+    # Imported from an earlier version; records 1 and 2 are new versions of
+    # the same concept (10.5281/zenodo.100)
+    old_version = {'id': 'id-99', 'name': 'record-99', 'title': 'Record 99',
+                   'concept_doi': 'https://doi.org/10.5281/zenodo.100'}
+    looked_up = []
+    written = []
+
+    def find_datasets_by_doi(dois):
+        looked_up.append(dois)
+        return {doi: old_version if doi == '10.5281/zenodo.100' else None for doi in dois}
+
+    def update_dataset(dataset, doi, org, metadata):
+        written.append(('update', dataset['id'], doi))
+        return 'updated'
+
+    def import_dataset(doi, org, metadata):
+        written.append(('import', None, doi))
+
+    monkeypatch.setattr(import_model, 'get_harvest_state', state.get)
+    monkeypatch.setattr(import_model, 'set_harvest_state', state.__setitem__)
+    monkeypatch.setattr(import_model, 'registry_record', lambda *args, **kwargs: None)
+    monkeypatch.setattr(cli, 'find_datasets_by_doi', find_datasets_by_doi)
+    monkeypatch.setattr(cli, 'update_dataset', update_dataset)
+    monkeypatch.setattr(cli, 'import_dataset', import_dataset)
+
+    result = CliRunner().invoke(cli.harvest_oai, ['--url', oai_server.url, '--no-files'])
+
+    assert result.exit_code == 0, result.output
+    assert looked_up == [['10.5281/zenodo.1', '10.5281/zenodo.2', '10.5281/zenodo.100']]
+    assert written == [
+        ('update', 'id-99', '10.5281/zenodo.1'),
+        ('update', 'id-99', '10.5281/zenodo.2'),
+    ]
@@ -0,0 +1,67 @@
+"""
+Tests for report.py, the harvest run reports.
+"""
+import json
+
+import pytest
+
+from ckanext.zenodo import report
+
+
+@pytest.mark.parametrize('pct, expected', [(50, 5), (90, 9), (95, 10), (99, 10), (1, 1)])
+def test_nearest_rank_percentile(pct, expected):
+    assert report.percentile([7, 3, 10, 1, 5, 9, 2, 8, 4, 6], pct) == expected
+
+
+def test_percentile_of_small_samples():
+    assert report.percentile([], 50) is None
+    assert report.percentile([4], 99) == 4
+    assert report.percentile([1, 2], 50) == 1
+
+
+def test_stage_summary():
+    summary = report.stage_summary([0.1, 0.2, 0.3, 0.4])
+    assert summary == {'count': 4, 'total': 1.0, 'mean': 0.25, 'max': 0.4,
+                       'p50': 0.2, 'p95': 0.4, 'p99': 0.4}
+    assert report.stage_summary([])['p50'] is None
+
+
+def test_events_path_for():
+    assert report.events_path_for('run.json') == 'run.ndjson'
+    assert report.events_path_for('run') == 'run.ndjson'
+
+
+def test_report_records_events_and_summary(tmp_path):
+    path = str(tmp_path / 'run.json')
+    run = report.HarvestReport(path, command='zenodo harvest')
+    with run.phase('lookup'):
+        pass
+
+    for doi, status in [('10.5281/zenodo.1', 'imported'), ('10.5281/zenodo.2', 'failed')]:
+        event = report.new_event(doi)
+        with report.timed(event, 'fetch'):
+            pass
+        run.finish(event, status, 'timeout' if status == 'failed' else None)
+    run.close()
+
+    events = [json.loads(line) for line in open(str(tmp_path / 'run.ndjson'))]
+    assert [(e['doi'], e['status']) for e in events] == [
+        ('10.5281/zenodo.1', 'imported'), ('10.5281/zenodo.2', 'failed')
+    ]
+    assert events[1]['error'] == 'timeout'
+    assert set(events[0]['timings']) == {'fetch'}
+
+    summary = json.load(open(path))
+    assert summary['command'] == 'zenodo harvest'
+    assert summary['dois'] == 2
+    assert summary['counts'] == {'imported': 1, 'failed': 1}
+    assert 'lookup' in summary['phases']
+    assert summary['stages']['fetch']['count'] == 2
+    assert summary['stages']['write']['count'] == 0
+
+
+def test_report_without_paths_is_disabled():
+    run = report.HarvestReport()
+    run.finish(report.new_event('10.5281/zenodo.1'), 'skipped')
+    assert not run.enabled
+    assert run.summary()['counts'] == {'skipped': 1}